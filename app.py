@@ -1,20 +1,28 @@
-import pandas as pd
-import pickle
+import hashlib
+import time
+
+import numpy as np
 import streamlit as st
-from sklearn.impute import SimpleImputer
 
-import sklearn
-print(sklearn.__version__)
+from data_access import DEFAULT_PAGE_SIZE, load_dataset, n_pages, page
+from eda import attrition_chart, summaries, summary_table
+from features import INPUT_RANGES, LABEL_CODES, missing_columns
+import drift
+import metrics
+import prediction_cache
+import static_assets
+import warmup
+
+# The model and its dependencies are imported by the pages that use them;
+# set ATTRITION_WARMUP=1 to load them in the background at startup instead
+warmup.start_if_enabled()
 
 
 st.set_page_config(page_title='From Data to Retention: An Analysis of Employee Attrition')
 
 def load_data():
-    data = pd.read_csv(
-        "IBM_HR-Attrition.csv",
-        encoding='ISO-8859-1'
-    )
-    return data
+    # Typed Feather cache of the CSV, rebuilt only when the CSV changes
+    return load_dataset()
 
 
 def introduction():
@@ -22,7 +30,7 @@ def introduction():
 
     st.title("From Data to Retention: An Analysis of Employee Attrition")
 
-    st.image("./assets/img/intro_img.png")
+    static_assets.image("img/intro_img.png")
 
     st.caption("Source: *https://www.insureon.com/blog/what-is-an-employee*")
 
@@ -40,7 +48,7 @@ def introduction():
 
     st.subheader("Research Objectives")
 
-    st.image("./assets/img/objectives_img.png")
+    static_assets.image("img/objectives_img.png")
 
     
     st.subheader("Methodology")
@@ -53,15 +61,25 @@ def introduction():
     )
     
     with st.expander("View Data"):
-        
-        st.dataframe(data)
-        st.caption("Source: IBM HR Analytics Employee Attrition & Performance")
+        # Send one page of rows at a time instead of the whole table
+        page_number = st.number_input("Page", min_value=1, max_value=n_pages(len(data)), value=1, step=1)
+        st.dataframe(page(data, page_number))
+        first_row = (page_number - 1) * DEFAULT_PAGE_SIZE + 1
+        last_row = min(page_number * DEFAULT_PAGE_SIZE, len(data))
+        st.caption(f"Rows {first_row:,}-{last_row:,} of {len(data):,}. Source: IBM HR Analytics Employee Attrition & Performance")
 
     #################### END ####################
 
 
 
 def viz_variables():
+    # Stayed/left counts per category, aggregated once per version of the dataset
+    summary = summaries.get()
+
+    def eda_chart(name, label_angle=0):
+        chart = attrition_chart(summary_table(summary, name), label_angle)
+        st.altair_chart(chart, use_container_width=True)
+
     st.title("Exploratory Data Analysis")
 
     st.info('Through exploratory data analysis, valuable insight and observations were discovered, which can aid in identifying relations among different factors that contribute to attrition. By gaining a deeper understanding of the dataset, various hypotheses were generated, leading to meaningful insights and actionable conclusions that can aid in addressing and mitigating the issue of attrition within the organization.')
@@ -71,7 +89,7 @@ def viz_variables():
 
     st.subheader("Attrition Features")
 
-    st.image("./assets/attrition-count.png")
+    eda_chart('Attrition')
     
     st.markdown(
         """
@@ -89,7 +107,7 @@ def viz_variables():
             
             st.markdown("**▸ Gender**")
 
-            st.image("./assets/attrition-gender.png")
+            eda_chart('Gender')
             
             st.markdown(
                 """
@@ -102,7 +120,7 @@ def viz_variables():
             # Attrition-Age EDA
             st.markdown("**▸ Age Profile**")
 
-            st.image("./assets/attrition-age.png")
+            eda_chart('Age_Profile')
 
             st.markdown(
                 """
@@ -115,7 +133,7 @@ def viz_variables():
             # Attrition-JobLevel EDA
             st.markdown("**▸ Job Level**")
             
-            st.image("./assets/attrition-job_level.png")
+            eda_chart('JobLevel')
 
             st.caption("*This feature refers to the position of an employee according to the hierarchical structure of a company. It is often associated with the level of authority and responsibility that an employee has.*")
 
@@ -131,7 +149,7 @@ def viz_variables():
             # Attrition-MonthlyIncome EDA
             st.markdown("**▸ Monthly Income**")
             
-            st.image("./assets/attrition-monthly_income.png")
+            eda_chart('MonthlyIncome', label_angle=-45)
             
             st.markdown(
                 """
@@ -146,7 +164,7 @@ def viz_variables():
             # Attrition-BusinessTravel EDA
             st.markdown("**▸ Business Travel**")
 
-            st.image("./assets/attrition-business_travel.png")
+            eda_chart('BusinessTravel')
 
             st.caption("*This feature refers to the frequency of business travel that an employee undertakes for their job. This can include attending conferences, meeting clients, or collaborating with colleagues in other locations.*")
 
@@ -161,7 +179,7 @@ def viz_variables():
             # Attrition-OverTime EDA
             st.markdown("**▸ Over Time**")
             
-            st.image("./assets/attrition-overtime.png")
+            eda_chart('OverTime')
 
             st.markdown(
                 """
@@ -174,7 +192,7 @@ def viz_variables():
             # Attrition-WorkLifeBalance EDA
             st.markdown("**▸ Work-Life Balance**")    
 
-            st.image("./assets/attrition-work_life_balance.png")
+            eda_chart('WorkLifeBalance')
 
             st.markdown(
                 """
@@ -188,7 +206,7 @@ def viz_variables():
             # Attrition-TrainingTimeLastYear EDA
             st.markdown("**▸ Training Times**")
 
-            st.image("./assets/attrition-training_times_last_yr.png")
+            eda_chart('TrainingTimesLastYear')
 
             st.markdown(
                 """
@@ -202,7 +220,7 @@ def viz_variables():
             # Attrition-YearsAtCompany EDA
             st.markdown("**▸ Tenure**")
 
-            st.image("./assets/attrition-years_at_company.png")
+            eda_chart('YearsAtCompany')
 
             st.caption("*This feature indicates the duration of an employee's tenure with the company.*")
 
@@ -220,7 +238,7 @@ def viz_variables():
             # Attrition-EnvironmentSatisfaction EDA
             st.markdown("**▸ Environment Satisfaction**")
 
-            st.image("./assets/attrition-environment_satisfaction.png")
+            eda_chart('EnvironmentSatisfaction')
 
             st.caption("*This feature refers to the level of satisfaction among employees regarding their work environment*")
 
@@ -238,7 +256,7 @@ def viz_variables():
             # Attrition-JobSatisfaction EDA
             st.markdown("**▸ Job Satisfaction**")
 
-            st.image("./assets/attrition-job_satisfaction.png")
+            eda_chart('JobSatisfaction')
 
             st.caption("*This feature refers to the level of employee satisfaction with their current job.*")
 
@@ -377,33 +395,20 @@ def discussion():
     # REFERENCES
     st.caption("References:")
 
-    st.image("./assets/img/references_img.png")
+    static_assets.image("img/references_img.png")
 
     
     #################### END ####################
 
 
 def predictive_model():
-    # Load the trained model
-    model = pickle.load(open('model/model_gbm.pkl', 'rb'))
+    from model_registry import get_model
 
-    # Load the column names used for training
-    columns = pd.read_csv('model/training_cols.csv')['0'].tolist()
-
-    def one_hot_encode_input(data, col_ohe):
-        # One-hot encode the categorical features
-        encoded_data = pd.get_dummies(data, columns=col_ohe)
-        
-        # Add any missing columns
-        missing_cols = set(columns) - set(encoded_data.columns)
-        for col in missing_cols:
-            encoded_data[col] = 0
-
-        
-        # Reorder columns to match training data
-        encoded_data = encoded_data[columns]
-        
-        return encoded_data
+    # Load the trained model and the column names used for training
+    # (cached per process, reloaded only when the artifacts change)
+    with metrics.timer('attrition_stage_seconds', stage='model_load'):
+        loaded_model = get_model()
+    encoder = loaded_model.encoder
 
 
     st.title('Employee Attrition Prediction')
@@ -425,135 +430,64 @@ def predictive_model():
     )
 
 
-    st.subheader("Demographics")
-    Gender = st.radio("▸   ***Gender***", ["Male", "Female"])
-    Age_Profile = st.radio("▸   ***Age***", ["Young Adult (18-25)", "Adult (26-44)", "Middle-age (45-59)", "Old age (60+)"])
-    JobLevel = st.radio("▸   ***Current Position in the Company***", ["Entry-Level", "Junior", "Middle", "Senior", "Executive"])
-    MonthlyIncome = st.number_input(label="▸   ***Monthly Income***", min_value=1009, max_value=19999, value=1009, step=1)
+    # The inputs only rerun the script when the form is submitted
+    with st.form('employee_inputs'):
+        st.subheader("Demographics")
+        Gender = st.radio("▸   ***Gender***", list(LABEL_CODES['Gender']))
+        Age_Profile = st.radio("▸   ***Age***", list(LABEL_CODES['Age_Profile']))
+        JobLevel = st.radio("▸   ***Current Position in the Company***", list(LABEL_CODES['JobLevel']))
+        income_min, income_max = INPUT_RANGES['MonthlyIncome']
+        MonthlyIncome = st.number_input(label="▸   ***Monthly Income***", min_value=income_min, max_value=income_max, value=income_min, step=1)
 
 
-    st.subheader("Work-Related Factors")
-    BusinessTravel = st.radio("▸   ***How frequent does the employee travel for business?***", ["Rarely", "Frequently", "Non-Travel"])
-    OverTime = st.radio("▸   ***Does the employee work overtime?***", ["No", "Yes"])
-    WorkLifeBalance = st.radio("▸   ***Work-Life balance rating***", ["Bad", "Good", "Better", "Best"])
-    TrainingTimesLastYear = st.radio("▸   ***Number of training completed last year***", ["None", "1-2", "3-4", "5-6", "7-8", "9-10", "More than 10"])
-    YearsAtCompany = st.number_input(label="▸   ***Tenure of service***", min_value=0, max_value=40, value=0, step=1)
+        st.subheader("Work-Related Factors")
+        BusinessTravel = st.radio("▸   ***How frequent does the employee travel for business?***", list(LABEL_CODES['BusinessTravel']))
+        OverTime = st.radio("▸   ***Does the employee work overtime?***", list(LABEL_CODES['OverTime']))
+        WorkLifeBalance = st.radio("▸   ***Work-Life balance rating***", list(LABEL_CODES['WorkLifeBalance']))
+        TrainingTimesLastYear = st.radio("▸   ***Number of training completed last year***", list(LABEL_CODES['TrainingTimesLastYear']))
+        tenure_min, tenure_max = INPUT_RANGES['YearsAtCompany']
+        YearsAtCompany = st.number_input(label="▸   ***Tenure of service***", min_value=tenure_min, max_value=tenure_max, value=tenure_min, step=1)
 
 
-    st.subheader("Employee Satisfaction")
-    JobSatisfaction = st.radio("▸   ***Level of satisfaction with current job.***", ["Low", "Medium", "High", "Very High"])
-    EnvironmentSatisfaction = st.radio("▸   ***Level of satisfaction with current work environment.***", ["Low", "Medium", "High", "Very High"])
+        st.subheader("Employee Satisfaction")
+        JobSatisfaction = st.radio("▸   ***Level of satisfaction with current job.***", list(LABEL_CODES['JobSatisfaction']))
+        EnvironmentSatisfaction = st.radio("▸   ***Level of satisfaction with current work environment.***", list(LABEL_CODES['EnvironmentSatisfaction']))
 
+        col1, col2, col3 = st.columns(3)
+        with col2:
+            center_button = st.form_submit_button('**Predict Employee Attrition**')
 
-    Gender = 1 if Gender == "Male" else 0
 
-    if Age_Profile == "Young Adult (18-25)":
-        Age_Profile= 1
-    elif Age_Profile == "Adult (26-44)":
-        Age_Profile = 2
-    elif Age_Profile == "Middle-age (45-59)":
-        Age_Profile = 3
-    else:
-        Age_Profile = 4
-
-    if JobLevel == "Entry-Level":
-        JobLevel = 1
-    elif JobLevel == "Junior":
-        JobLevel = 2
-    elif JobLevel == "Middle":
-        JobLevel = 3
-    elif JobLevel == "Senior":
-        JobLevel = 4
-    else:
-        JobLevel = 5
-
-    if BusinessTravel == "Rarely":
-        BusinessTravel = 1
-    elif BusinessTravel == "Frequently":
-        BusinessTravel = 2
-    else:
-        BusinessTravel = 3
-
-    OverTime = 1 if OverTime == "Yes" else 0
-
-    if WorkLifeBalance == "Bad":
-        WorkLifeBalance = 1
-    elif WorkLifeBalance == "Good":
-        WorkLifeBalance = 2
-    elif WorkLifeBalance == "Better":
-        WorkLifeBalance = 3
-    else:
-        WorkLifeBalance = 4
-
-    if JobSatisfaction == "Low":
-        JobSatisfaction = 1
-    elif JobSatisfaction == "Medium":
-        JobSatisfaction = 2
-    elif JobSatisfaction == "High":
-        JobSatisfaction = 3
-    else:
-        JobSatisfaction = 4
-
-    if EnvironmentSatisfaction == "Low":
-        EnvironmentSatisfaction = 1
-    elif EnvironmentSatisfaction == "Medium":
-        EnvironmentSatisfaction = 2
-    elif EnvironmentSatisfaction == "High":
-        EnvironmentSatisfaction = 3
-    else:
-        EnvironmentSatisfaction = 4
-
-
-    if TrainingTimesLastYear == "None":
-        TrainingTimesLastYear = 0
-    elif TrainingTimesLastYear == "1-2":
-        TrainingTimesLastYear = 1
-    elif TrainingTimesLastYear == "3-4":
-        TrainingTimesLastYear = 2
-    elif TrainingTimesLastYear == "5-6":
-        TrainingTimesLastYear = 3
-    elif TrainingTimesLastYear == "7-8":
-        TrainingTimesLastYear = 4
-    elif TrainingTimesLastYear == "9-10":
-        TrainingTimesLastYear = 5
-    else:
-        TrainingTimesLastYear = 6
+    # Store the user input; the encoder maps the labels to model codes
+    user_input = {
+    'Gender': Gender,
+    'Age_Profile': Age_Profile,
+    'JobLevel': JobLevel,
+    'MonthlyIncome': MonthlyIncome,
+    'BusinessTravel': BusinessTravel,
+    'OverTime': OverTime,
+    'WorkLifeBalance': WorkLifeBalance,
+    'JobSatisfaction': JobSatisfaction,
+    'EnvironmentSatisfaction': EnvironmentSatisfaction,
+    'TrainingTimesLastYear': TrainingTimesLastYear,
+    'YearsAtCompany': YearsAtCompany
+    }
 
 
     def predict_attrition():
-        # Create a dictionary to store the user input
-        user_input = {
-        'Gender': Gender,
-        'Age_Profile': Age_Profile,
-        'JobLevel': JobLevel,
-        'MonthlyIncome': MonthlyIncome,
-        'BusinessTravel': BusinessTravel,
-        'OverTime': OverTime,
-        'WorkLifeBalance': WorkLifeBalance,
-        'JobSatisfaction': JobSatisfaction,
-        'EnvironmentSatisfaction': EnvironmentSatisfaction,
-        'TrainingTimesLastYear': TrainingTimesLastYear,
-        'YearsAtCompany': YearsAtCompany
-        }
-
-        # Convert the user input into a Pandas DataFrame
-        user_input_df = pd.DataFrame(user_input, index=[0])
-
-        cols_to_encode = ['Age_Profile', 'BusinessTravel']
+        with metrics.timer('attrition_stage_seconds', stage='codes'):
+            user_codes = encoder.codes(user_input)
 
         # Check for missing values
-        if user_input_df.isnull().values.any():
+        if np.isnan(user_codes).any():
             st.write('Please fill in all the input fields.')
         else:
-            # One-hot encode the categorical features in the user input
-            encoded_user_input = one_hot_encode_input(user_input_df, cols_to_encode)
-
-            #Impute any missing values
-            imputer = SimpleImputer(strategy='median')
-            user_input_imputed = imputer.fit_transform(encoded_user_input)
+            drift.monitor.observe(user_codes)
+            # Profiles already predicted in this process are not scored again
+            proba, prediction, explained = prediction_cache.predict(loaded_model, user_codes)
+            metrics.count('attrition_predictions_total', outcome='leave' if prediction[0] == 1 else 'stay')
 
-            # Make a prediction using the trained model
-            prediction = model.predict(user_input_imputed)
+            render_start = time.perf_counter()
 
             # Display the prediction
             if prediction[0]==0:
@@ -579,38 +513,242 @@ def predictive_model():
                     """
                 )
 
-    col1, col2, col3 = st.columns(3)
+            metrics.observe('attrition_stage_seconds', time.perf_counter() - render_start, stage='render')
+
+            if explained is not None:
+                from explanations import contribution_chart, contribution_table
+
+                contributions, expected_value = explained
+                st.subheader("What drives this prediction")
+                st.markdown(
+                    f"""
+                    Starting from the log-odds of an average employee ({expected_value:+.2f}), each feature below moves this employee's log-odds up or down; together they give the predicted probability of leaving of **{proba[0, 1]:.0%}**.
+                    """
+                )
+                with metrics.timer('attrition_stage_seconds', stage='render'):
+                    st.altair_chart(contribution_chart(contribution_table(contributions[0])), use_container_width=True)
 
-    with col1:
-        pass
-    with col3:
-        pass
-    with col2 :
-        center_button = st.button('**Predict Employee Attrition**')
-    
     st.divider()
 
     if center_button:
         predict_attrition()
 
+    def what_if():
+        from whatif import lowest_risk, sweep, sweep_chart
+
+        user_codes = encoder.codes(user_input)
+        if np.isnan(user_codes).any():
+            st.write('Please fill in all the input fields.')
+            return
+
+        # Every counterfactual is scored in one batched call
+        with metrics.timer('attrition_stage_seconds', stage='what_if'):
+            table = sweep(loaded_model, user_codes)
+        best = lowest_risk(table)
+
+        st.subheader("What if")
+        st.markdown(
+            f"""
+            Each curve shows the predicted probability of leaving for this employee as the monthly income changes, with and without overtime and for every amount of training ({len(table):,} scenarios). The dashed line is the point above which the employee is predicted to leave; the gray line marks the current income.
+
+            The lowest risk in these scenarios is **{best['Probability of Leaving']:.0%}**, at a monthly income of **{best['Monthly Income']:,}**, overtime **{best['Overtime']}** and training **{best['Training Last Year']}**.
+            """
+        )
+        st.altair_chart(sweep_chart(table, MonthlyIncome))
+
+    if st.checkbox("Show what-if curves for income, overtime and training"):
+        what_if()
+
     
     #################### END ####################
 
 
-# def clustering():
-#     st.title("Clustering")
+def batch_scoring():
+    st.title('Batch Attrition Scoring')
+    st.markdown(
+        """
+        Upload a workforce extract in the same layout as the IBM HR Analytics dataset to score every employee at once. The scored file keeps all of the original columns and adds the predicted attrition class and its probability.
+        """
+    )
+
+    st.warning("This predictive model is designed specifically for the context of Avyan and is not intended for generic use across different organizations or industries.", icon='⚠️')
+
+    uploaded_file = st.file_uploader("▸   ***Workforce extract (CSV)***", type='csv')
+
+    if uploaded_file is None:
+        return
+
+    from batch_scoring import CONTRIBUTION_PREFIX, IMPUTED_COL, PREDICTION_COL, read_workforce_csv, score_frame
+
+    explain = st.checkbox("Explain each prediction (adds a contribution column per feature)")
+
+    data = read_workforce_csv(uploaded_file)
+    missing = missing_columns(data)
+    if missing:
+        st.error(f"The extract has no {', '.join(missing)} column. Every model field is needed to score it.")
+        return
+    # Every widget change reruns the page; the drift monitor counts each upload once
+    digest = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    observed = st.session_state.setdefault('drift_observed', set())
+    with metrics.timer('attrition_stage_seconds', stage='batch_score'):
+        scored = score_frame(data, explain=explain, observe=digest not in observed)
+    observed.add(digest)
+
+    n_imputed = int(scored[IMPUTED_COL].sum())
+    n_leaving = int((scored[PREDICTION_COL] == 1).sum())
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Employees", f"{len(scored):,}")
+    col2.metric("Likely to leave", f"{n_leaving:,}")
+    col3.metric("Attrition rate", f"{n_leaving / max(len(scored), 1):.1%}")
+
+    if n_imputed:
+        st.info(f"{n_imputed:,} rows have missing or unknown values in the model features. These were filled with the medians of the training data, or the median category for business travel and age profile.")
+
+    contribution_cols = [col for col in scored.columns if col.startswith(CONTRIBUTION_PREFIX)]
+    if contribution_cols:
+        from explanations import importance_chart, importance_table
+
+        st.subheader("What drives attrition risk in this extract")
+        st.altair_chart(importance_chart(importance_table(scored[contribution_cols].to_numpy())),
+                        use_container_width=True)
+
+    st.dataframe(scored.head(100))
+
+    st.download_button(
+        '**Download Scored CSV**',
+        data=scored.to_csv(index=False).encode('utf-8'),
+        file_name='attrition_scores.csv',
+        mime='text/csv',
+    )
+
+    #################### END ####################
+
+
+def cohort_risk():
+    from cohorts import DIMENSIONS, cohort_cache, risk_chart
+
+    st.title('Cohort Risk')
+    st.markdown(
+        """
+        Every employee in the dataset is scored by the attrition model. Filter the workforce and group it by any of the fields below to compare the average predicted probability of leaving of each cohort with its actual attrition rate.
+        """
+    )
+
+    # Scored and indexed once per dataset and model; queries read the index
+    index = cohort_cache.get()
+
+    filters = {}
+    with st.expander('Filters'):
+        for dim in DIMENSIONS:
+            selected = st.multiselect(dim, list(index.labels[dim]))
+            if selected:
+                filters[dim] = selected
+    group_by = st.multiselect('Group by', DIMENSIONS, default=['Department', 'JobRole', 'JobLevel', 'OverTime'])
+
+    with metrics.timer('attrition_stage_seconds', stage='cohort_query'):
+        table = index.aggregate(filters, group_by)
+
+    if not len(table):
+        st.write('No employees match these filters.')
+        return
+
+    if group_by:
+        st.altair_chart(risk_chart(table.head(25), [dim for dim in DIMENSIONS if dim in group_by]),
+                        use_container_width=True)
+    st.dataframe(table.style.format({'Average Probability': '{:.1%}', 'Attrition Rate': '{:.1%}'}))
+
+    st.subheader('Employees most at risk in this selection')
+    st.dataframe(index.employees(filters, top=100).style.format({'Probability of Leaving': '{:.1%}'}))
+
+
+def diagnostics():
+    import pandas as pd
+
+    from model_registry import registry
+
+    st.title('Diagnostics')
+    if not metrics.registry.enabled:
+        st.info(f"Instrumentation is off. Start the app with {metrics.METRICS_ENV}=1 to record stage timings and counters.")
+
+    st.subheader('Stage timings')
+    st.dataframe(pd.DataFrame(metrics.registry.histogram_rows()))
+
+    st.subheader('Cache hit rates')
+    model_stats = registry.stats()
+    rates = {'model registry': (model_stats['hits'], model_stats['hits'] + model_stats['loads'])}
+    rates.update(metrics.registry.hit_rates())
+    # Counted even when the instrumentation is off
+    cache_stats = prediction_cache.cache.stats()
+    rates['prediction'] = (cache_stats['hits'], cache_stats['hits'] + cache_stats['misses'])
+    st.dataframe(pd.DataFrame([
+        {'cache': cache, 'hits': hits, 'requests': requests, 'hit rate': hits / requests if requests else 0.0}
+        for cache, (hits, requests) in rates.items()
+    ]))
+
+    st.subheader('Input drift')
+    if drift.monitor.profile is None:
+        st.info(f"No training profile at {drift.PROFILE_PATH}. Build it with `python drift.py`.")
+    else:
+        # Every input scored by this process, against data/attrition_features.csv
+        st.dataframe(drift.monitor.report())
+
+    st.subheader('Model and warm-up')
+    st.json({'registry': model_stats, 'prediction cache': cache_stats, 'warmup': warmup.status})
+
+    st.download_button('**Download Prometheus metrics**', data=metrics.registry.prometheus_text(),
+                       file_name='attrition_metrics.prom', mime='text/plain')
+    if st.button('Reset metrics'):
+        metrics.registry.reset()
+
+
+def clustering():
+    from clustering import RATE_COL, SEGMENT_COL, SIZE_COL, segment_cache, segment_chart
+
+    st.title("Employee Segments")
+    st.markdown(
+        """
+        Employees are grouped into segments of similar profiles with mini-batch k-means over the encoded features. Each segment below shows its share of the workforce, its attrition rate and its average profile; the dashed line is the attrition rate of the whole workforce.
+        """
+    )
+
+    # Fitted ahead of time by clustering.py; never on a page render
+    with metrics.timer('attrition_stage_seconds', stage='segments'):
+        segments = segment_cache.get()
+    if segments is None:
+        st.info("The segments have not been computed yet. Run `python clustering.py` to fit them.")
+        return
+    if segment_cache.stale:
+        st.warning("The features changed since these segments were fitted. Run `python clustering.py` to update them.")
+
+    st.altair_chart(segment_chart(segments), use_container_width=True)
+
+    highest = segments.loc[segments[RATE_COL].idxmax()]
+    st.markdown(
+        f"""
+        Segment **{int(highest[SEGMENT_COL])}** ({int(highest[SIZE_COL]):,} employees) has the highest attrition rate, **{highest[RATE_COL]:.0%}**.
+        """
+    )
+    st.dataframe(segments.set_index(SEGMENT_COL))
 
 
 list_of_pages = [
     "Introduction",
     "Exploratory Data Analysis",
-    # "Clustering",
+    "Clustering",
     "Discussion",  
     "Predictive Model",
+    "Batch Scoring",
+    "Cohort Risk",
 ]
 
+# Not in the menu; open the app with ?diagnostics=1
+if 'diagnostics' in st.experimental_get_query_params():
+    list_of_pages.append("Diagnostics")
+
 st.sidebar.title('💼 Main Menu')
 selection = st.sidebar.radio("Go to: ", list_of_pages)
+rerun_start = time.perf_counter()
 
 if selection == "Introduction":
     introduction()
@@ -618,11 +756,23 @@ if selection == "Introduction":
 elif selection == "Exploratory Data Analysis":
     viz_variables()
 
-# elif selection == "Clustering":
-#     clustering()
+elif selection == "Clustering":
+    clustering()
 
 elif selection == "Discussion":
     discussion()
 
 elif selection == "Predictive Model":
     predictive_model()
+
+elif selection == "Batch Scoring":
+    batch_scoring()
+
+elif selection == "Cohort Risk":
+    cohort_risk()
+
+elif selection == "Diagnostics":
+    diagnostics()
+
+metrics.observe('attrition_rerun_seconds', time.perf_counter() - rerun_start, page=selection)
+metrics.registry.maybe_write_textfile()
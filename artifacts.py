@@ -0,0 +1,230 @@
+"""Versioned model bundle that can be loaded without pickle or scikit-learn.
+
+A bundle is a directory holding the flattened trees of tree_engine.CompiledGBM
+as plain .npy arrays, plus a manifest.json with everything else needed to
+score and explain: the feature schema, the scalar parameters of the
+ensemble, the expected value of the attributions, the sha256 of every
+array file and the sha256 of the pickle and training_cols.csv it was
+converted from, so a stale bundle can be told apart.
+
+    model/gbm_bundle/
+        manifest.json
+        feature.npy
+        threshold.npy
+        leaves.npy
+        cover.npy
+
+The arrays are opened with np.load(mmap_mode='r'), so loading does not copy
+them and processes that load the same bundle share the pages in the OS cache.
+Nothing in a bundle is executed on load; np.load is called with
+allow_pickle=False.
+
+To convert the pickled model after retraining:
+    python artifacts.py
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from tree_engine import CompiledGBM
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, 'model')
+BUNDLE_PATH = os.path.join(MODEL_DIR, 'gbm_bundle')
+MANIFEST_NAME = 'manifest.json'
+
+# Held exclusively while a new set of artifacts is swapped in (see train.py)
+# and shared while the registry reads them
+LOCK_PATH = os.path.join(MODEL_DIR, '.publish.lock')
+
+# Bumped whenever the layout of the arrays or the manifest changes
+FORMAT_VERSION = 3
+
+ARRAY_NAMES = ['feature', 'threshold', 'leaves', 'cover']
+
+
+@contextlib.contextmanager
+def publish_lock(exclusive=False, path=LOCK_PATH):
+    """Lock the model directory; a no-op without fcntl or write access."""
+    try:
+        f = open(path, 'a') if fcntl is not None else None
+    except OSError:
+        f = None
+    if f is None:
+        yield
+        return
+
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def manifest_path(bundle_path=BUNDLE_PATH):
+    return os.path.join(bundle_path, MANIFEST_NAME)
+
+
+def array_paths(bundle_path=BUNDLE_PATH):
+    return [os.path.join(bundle_path, name + '.npy') for name in ARRAY_NAMES]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_sha256(model_path, columns_path):
+    """sha256 of the pickle and training_cols.csv a bundle is converted from."""
+    return {'model': file_sha256(model_path), 'columns': file_sha256(columns_path)}
+
+
+def content_hash(files):
+    # Hash of the per-file hashes, in a fixed order
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update('{}:{}\n'.format(name, files[name]['sha256']).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def save_bundle(engine, columns, bundle_path=BUNDLE_PATH, source=None, source_hashes=None):
+    """Write the engine and its schema as a bundle, replacing any existing one.
+
+    source_hashes is source_sha256() of the files the engine was built from.
+    """
+    if len(columns) != engine.n_features:
+        raise ValueError('Model expects {} features but {} columns were given'.format(
+            engine.n_features, len(columns)))
+
+    # Write next to the target and swap it in once everything is on disk
+    tmp_path = bundle_path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    files = {}
+    for name in ARRAY_NAMES:
+        filename = name + '.npy'
+        array = np.ascontiguousarray(getattr(engine, name))
+        np.save(os.path.join(tmp_path, filename), array, allow_pickle=False)
+        files[filename] = {
+            'sha256': file_sha256(os.path.join(tmp_path, filename)),
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+        }
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'model_type': 'GradientBoostingClassifier',
+        'source': source,
+        'source_sha256': source_hashes,
+        'columns': list(columns),
+        'classes': engine.classes.tolist(),
+        'n_features': engine.n_features,
+        'n_trees': engine.n_trees,
+        'depth': engine.depth,
+        'init_score': engine.init_score,
+        'learning_rate': engine.learning_rate,
+        'link': engine.link,
+        # Cached so explaining a prediction does not need a pass over the trees
+        'expected_value': engine.expected_value,
+        'files': files,
+        'content_hash': content_hash(files),
+    }
+    with open(manifest_path(tmp_path), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    old_path = bundle_path + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(bundle_path):
+        os.rename(bundle_path, old_path)
+    os.rename(tmp_path, bundle_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+def read_manifest(bundle_path=BUNDLE_PATH):
+    with open(manifest_path(bundle_path)) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError('{} has bundle format {}, expected {}'.format(
+            bundle_path, manifest.get('format_version'), FORMAT_VERSION))
+    return manifest
+
+
+def load_bundle(bundle_path=BUNDLE_PATH, mmap_mode='r', verify=True):
+    """Return (engine, manifest) for a bundle directory.
+
+    With verify=True every array file is checked against its sha256 in the
+    manifest before it is used.
+    """
+    manifest = read_manifest(bundle_path)
+    files = manifest['files']
+    if verify and content_hash(files) != manifest['content_hash']:
+        raise ValueError('{} manifest does not match its content hash'.format(bundle_path))
+
+    arrays = {}
+    for name in ARRAY_NAMES:
+        filename = name + '.npy'
+        path = os.path.join(bundle_path, filename)
+        if verify and file_sha256(path) != files[filename]['sha256']:
+            raise ValueError('{} does not match the bundle manifest'.format(path))
+
+        array = np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+        if array.dtype.str != files[filename]['dtype'] or list(array.shape) != files[filename]['shape']:
+            raise ValueError('{} does not match the bundle manifest'.format(path))
+        # Plain ndarray view of the mapped file, as numba does not take np.memmap
+        arrays[name] = np.asarray(array)
+
+    engine = CompiledGBM(arrays['feature'], arrays['threshold'], arrays['leaves'],
+                         manifest['depth'], manifest['init_score'], manifest['learning_rate'],
+                         manifest['n_features'], manifest['classes'], manifest['link'],
+                         arrays['cover'], manifest['expected_value'])
+    return engine, manifest
+
+
+def convert(model_path, columns_path, bundle_path=BUNDLE_PATH):
+    """Convert a pickled GradientBoostingClassifier into a bundle."""
+    import pickle
+
+    from model_registry import read_training_columns
+
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+    engine = CompiledGBM.from_sklearn(model)
+    engine.check(model)
+    return save_bundle(engine, read_training_columns(columns_path), bundle_path,
+                       source=os.path.relpath(model_path, BASE_DIR),
+                       source_hashes=source_sha256(model_path, columns_path))
+
+
+def main():
+    from model_registry import COLUMNS_PATH, MODEL_PATH
+
+    parser = argparse.ArgumentParser(description='Convert the pickled model into a model bundle.')
+    parser.add_argument('--model', default=MODEL_PATH, help='pickled GradientBoostingClassifier')
+    parser.add_argument('--columns', default=COLUMNS_PATH, help='training_cols.csv of the model')
+    parser.add_argument('-o', '--output', default=BUNDLE_PATH, help='bundle directory to write')
+    args = parser.parse_args()
+
+    manifest = convert(args.model, args.columns, args.output)
+    print('Saved {} trees over {} columns to {} (content hash {})'.format(
+        manifest['n_trees'], len(manifest['columns']), args.output, manifest['content_hash'][:12]))
+
+
+if __name__ == '__main__':
+    main()
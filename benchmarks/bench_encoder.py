@@ -0,0 +1,120 @@
+"""Micro-benchmark: FeatureEncoder vs the previous if/elif + get_dummies path.
+
+Run from the repository root:
+    python -m benchmarks.bench_encoder
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_FIELDS, FeatureEncoder, raw_to_features
+from model_registry import read_training_columns
+
+
+INPUTS = {
+    'Gender': "Male",
+    'Age_Profile': "Adult (26-44)",
+    'JobLevel': "Junior",
+    'MonthlyIncome': 5993,
+    'BusinessTravel': "Frequently",
+    'OverTime': "Yes",
+    'WorkLifeBalance': "Better",
+    'JobSatisfaction': "High",
+    'EnvironmentSatisfaction': "Medium",
+    'TrainingTimesLastYear': "3-4",
+    'YearsAtCompany': 6,
+}
+
+
+def legacy_map(inputs):
+    # Label mapping as it was done in predictive_model()
+    Gender = 1 if inputs['Gender'] == "Male" else 0
+
+    if inputs['Age_Profile'] == "Young Adult (18-25)":
+        Age_Profile = 1
+    elif inputs['Age_Profile'] == "Adult (26-44)":
+        Age_Profile = 2
+    elif inputs['Age_Profile'] == "Middle-age (45-59)":
+        Age_Profile = 3
+    else:
+        Age_Profile = 4
+
+    JobLevel = ["Entry-Level", "Junior", "Middle", "Senior", "Executive"].index(inputs['JobLevel']) + 1
+
+    if inputs['BusinessTravel'] == "Rarely":
+        BusinessTravel = 1
+    elif inputs['BusinessTravel'] == "Frequently":
+        BusinessTravel = 2
+    else:
+        BusinessTravel = 3
+
+    OverTime = 1 if inputs['OverTime'] == "Yes" else 0
+    WorkLifeBalance = ["Bad", "Good", "Better", "Best"].index(inputs['WorkLifeBalance']) + 1
+    levels = ["Low", "Medium", "High", "Very High"]
+    JobSatisfaction = levels.index(inputs['JobSatisfaction']) + 1
+    EnvironmentSatisfaction = levels.index(inputs['EnvironmentSatisfaction']) + 1
+    TrainingTimesLastYear = ["None", "1-2", "3-4", "5-6", "7-8", "9-10", "More than 10"].index(inputs['TrainingTimesLastYear'])
+
+    return {
+        'Gender': Gender,
+        'Age_Profile': Age_Profile,
+        'JobLevel': JobLevel,
+        'MonthlyIncome': inputs['MonthlyIncome'],
+        'BusinessTravel': BusinessTravel,
+        'OverTime': OverTime,
+        'WorkLifeBalance': WorkLifeBalance,
+        'JobSatisfaction': JobSatisfaction,
+        'EnvironmentSatisfaction': EnvironmentSatisfaction,
+        'TrainingTimesLastYear': TrainingTimesLastYear,
+        'YearsAtCompany': inputs['YearsAtCompany'],
+    }
+
+
+def legacy_one_hot(data, columns):
+    # one_hot_encode_input() as it was done in predictive_model()
+    encoded_data = pd.get_dummies(data, columns=['Age_Profile', 'BusinessTravel'])
+    missing_cols = set(columns) - set(encoded_data.columns)
+    for col in missing_cols:
+        encoded_data[col] = 0
+    return encoded_data[columns]
+
+
+def best_of(stmt, number, repeat=5):
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+
+def main():
+    columns = read_training_columns()
+    encoder = FeatureEncoder(columns)
+
+    # Both paths must agree before timing them
+    legacy = legacy_one_hot(pd.DataFrame(legacy_map(INPUTS), index=[0]), columns).to_numpy(dtype=float)
+    assert np.array_equal(legacy, encoder.transform_labels(INPUTS))
+
+    out = np.empty((1, encoder.n_columns))
+    legacy_single = best_of(lambda: legacy_one_hot(pd.DataFrame(legacy_map(INPUTS), index=[0]), columns), 200)
+    encoder_single = best_of(lambda: encoder.transform_labels(INPUTS, out=out), 5000)
+    print('Single row')
+    print('  legacy  {:10.1f} us'.format(legacy_single * 1e6))
+    print('  encoder {:10.1f} us  ({:.0f}x)'.format(encoder_single * 1e6, legacy_single / encoder_single))
+
+    data = pd.read_csv('data/attrition_features.csv')
+    features = raw_to_features(data)
+    for n_rows in [1000, 100000]:
+        batch = features.sample(n_rows, replace=True, random_state=42).reset_index(drop=True)
+        codes = batch[FEATURE_FIELDS].to_numpy(dtype=float)
+        out = np.empty((n_rows, encoder.n_columns))
+        legacy_df = batch.astype(int)
+
+        assert np.array_equal(legacy_one_hot(legacy_df, columns).to_numpy(dtype=float), encoder.transform(codes))
+
+        legacy_batch = best_of(lambda: legacy_one_hot(legacy_df, columns), 5)
+        encoder_batch = best_of(lambda: encoder.transform(codes, out=out), 20)
+        print('Batch of {:,} rows (one-hot step only)'.format(n_rows))
+        print('  legacy  {:10.3f} ms'.format(legacy_batch * 1e3))
+        print('  encoder {:10.3f} ms  ({:.0f}x)'.format(encoder_batch * 1e3, legacy_batch / encoder_batch))
+
+
+if __name__ == '__main__':
+    main()
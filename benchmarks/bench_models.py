@@ -0,0 +1,250 @@
+"""Benchmark: the candidate models of the compare_models notebooks.
+
+Each model is run with its tuned settings from
+notebooks/compare_models_data_encoded.ipynb on data/attrition_features_ohe.csv,
+over the same train_test_split seeds the notebooks tuned over (1-9). For
+every seed the fit is warmed up once and then timed --repeat times; the
+predict latency is timed for the whole test split and for single rows. The
+peak Python memory of a fit and predict is measured separately with
+tracemalloc, so it does not slow down the timed runs.
+
+This replaces the one-shot time.time() runtimes of data/modelling/results_df.csv
+and the per-model df_training_*/df_test_* dumps with one JSON file of
+distributions. Results are compared against a stored baseline and the run
+exits with status 1 if a model got slower, hungrier or less accurate.
+
+Run from the repository root:
+    python -m benchmarks.bench_models
+    python -m benchmarks.bench_models --models gbm rf --seeds 3
+    python -m benchmarks.bench_models --save-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, recall_score
+from sklearn.model_selection import train_test_split
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from imputation import TRAINING_DATA_PATH
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_PATH = os.path.join(BENCH_DIR, 'results', 'bench_models.json')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baselines', 'bench_models.json')
+
+TARGET = 'Attrition'
+TEST_SIZE = 0.30
+SEEDS = range(1, 10)
+
+# Best settings found in the compare_models notebooks
+MODELS = {
+    'lr': ('logistic regression', lambda seed: LogisticRegression(C=0.75, max_iter=100000, random_state=seed)),
+    'rf': ('random forest', lambda seed: RandomForestClassifier(n_estimators=6, random_state=seed)),
+    'dt': ('decision trees', lambda seed: DecisionTreeClassifier(max_depth=3, random_state=seed)),
+    'gbm': ('gradient boosting', lambda seed: GradientBoostingClassifier(learning_rate=0.05, random_state=seed)),
+    'knn': ('knn', lambda seed: KNeighborsClassifier(n_neighbors=7)),
+}
+
+# Allowed change against the baseline before a metric counts as a regression:
+# relative for times and memory, absolute for scores
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.25
+SCORE_TOLERANCE = 0.01
+
+# Metric, direction (+1 when higher is worse), tolerance kind
+CHECKS = [
+    ('fit_ms.p50', 1, 'time'),
+    ('predict_batch_ms.p50', 1, 'time'),
+    ('predict_row_ms.p50', 1, 'time'),
+    ('peak_memory_mb.max', 1, 'memory'),
+    ('accuracy.mean', -1, 'score'),
+    ('recall.mean', -1, 'score'),
+]
+
+
+def load_data(path=TRAINING_DATA_PATH):
+    data = pd.read_csv(path)
+    return data.drop([TARGET], axis=1).to_numpy(dtype=float), data[TARGET].to_numpy()
+
+
+def timed(func, repeat):
+    """Wall times in ms of repeat calls, after one untimed warmup call."""
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1e3)
+    return times
+
+
+def peak_memory_mb(make_model, X_train, y_train, X_test):
+    tracemalloc.start()
+    try:
+        make_model().fit(X_train, y_train).predict(X_test)
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def distribution(values):
+    values = np.asarray(values, dtype=float)
+    return {
+        'n': len(values),
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'min': float(values.min()),
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+    }
+
+
+def run_model(name, X, y, seeds, repeat, row_samples):
+    label, factory = MODELS[name]
+    samples = {key: [] for key in ['fit_ms', 'predict_batch_ms', 'predict_row_ms', 'peak_memory_mb',
+                                   'rows_per_second', 'accuracy', 'recall']}
+    for seed in seeds:
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TEST_SIZE, random_state=seed)
+
+        samples['fit_ms'].extend(timed(lambda: factory(seed).fit(X_train, y_train), repeat))
+        model = factory(seed).fit(X_train, y_train)
+
+        batch_ms = timed(lambda: model.predict(X_test), repeat)
+        samples['predict_batch_ms'].extend(batch_ms)
+        samples['rows_per_second'].extend(len(X_test) / (ms / 1e3) for ms in batch_ms)
+        rows = X_test[np.random.RandomState(seed).randint(0, len(X_test), row_samples)]
+        for row in rows:
+            samples['predict_row_ms'].extend(timed(lambda: model.predict(row[None, :]), 1))
+
+        samples['peak_memory_mb'].append(peak_memory_mb(lambda: factory(seed), X_train, y_train, X_test))
+
+        y_pred = model.predict(X_test)
+        samples['accuracy'].append(accuracy_score(y_test, y_pred))
+        samples['recall'].append(recall_score(y_test, y_pred))
+
+    result = {'label': label, 'params': factory(0).get_params(), 'test_rows': len(X_test)}
+    result.update({key: distribution(values) for key, values in samples.items()})
+    return result
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def lookup(result, metric):
+    key, stat = metric.split('.')
+    return result[key][stat]
+
+
+def regressions(results, baseline, tolerances):
+    """(model, metric, baseline, current) for every metric outside its tolerance."""
+    # Scores depend on the splits, so they are only comparable over the same seeds
+    same_splits = baseline['settings']['seeds'] == results['settings']['seeds']
+    found = []
+    for name, result in results['models'].items():
+        if name not in baseline['models']:
+            continue
+        for metric, direction, kind in CHECKS:
+            if kind == 'score' and not same_splits:
+                continue
+            old = lookup(baseline['models'][name], metric)
+            new = lookup(result, metric)
+            if kind == 'score':
+                worse = direction * (new - old) > tolerances[kind]
+            else:
+                worse = direction * (new - old) > tolerances[kind] * abs(old)
+            if worse:
+                found.append((name, metric, old, new))
+    return found
+
+
+def write_json(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2, default=str)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the candidate attrition models.')
+    parser.add_argument('--models', nargs='+', choices=list(MODELS), default=list(MODELS))
+    parser.add_argument('--seeds', type=int, default=len(SEEDS), help='split seeds, from 1 (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per seed (default: %(default)s)')
+    parser.add_argument('--row-samples', type=int, default=50,
+                        help='single rows timed per seed (default: %(default)s)')
+    parser.add_argument('-o', '--output', default=RESULTS_PATH, help='results JSON to write')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='results JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE)
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument('--score-tolerance', type=float, default=SCORE_TOLERANCE)
+    args = parser.parse_args()
+
+    # KNeighborsClassifier warns about scipy.stats.mode on every predict
+    warnings.filterwarnings('ignore', category=FutureWarning)
+
+    X, y = load_data()
+    seeds = list(SEEDS)[:args.seeds]
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'settings': {'seeds': seeds, 'repeat': args.repeat, 'row_samples': args.row_samples,
+                     'test_size': TEST_SIZE, 'rows': len(X)},
+        'models': {},
+    }
+
+    print('{:>5}  {:>9}  {:>9}  {:>11}  {:>11}  {:>10}  {:>9}  {:>8}  {:>6}'.format(
+        'model', 'fit p50', 'fit p90', 'batch p50', 'row p50', 'rows/s', 'peak MB', 'accuracy', 'recall'))
+    for name in args.models:
+        result = run_model(name, X, y, seeds, args.repeat, args.row_samples)
+        results['models'][name] = result
+        print('{:>5}  {:>7.2f}ms  {:>7.2f}ms  {:>9.3f}ms  {:>9.3f}ms  {:>10,.0f}  {:>9.2f}  {:>8.3f}  {:>6.3f}'.format(
+            name, result['fit_ms']['p50'], result['fit_ms']['p90'], result['predict_batch_ms']['p50'],
+            result['predict_row_ms']['p50'], result['rows_per_second']['p50'],
+            result['peak_memory_mb']['max'], result['accuracy']['mean'], result['recall']['mean']))
+
+    write_json(args.output, results)
+    print('Results -> {}'.format(os.path.relpath(args.output)))
+
+    if args.save_baseline:
+        write_json(args.baseline, results)
+        print('Baseline -> {}'.format(os.path.relpath(args.baseline)))
+        return
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}; run with --save-baseline to store one'.format(os.path.relpath(args.baseline)))
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    tolerances = {'time': args.time_tolerance, 'memory': args.memory_tolerance, 'score': args.score_tolerance}
+    found = regressions(results, baseline, tolerances)
+    if baseline.get('environment') != results['environment']:
+        print('Note: the baseline was recorded on {}'.format(baseline.get('environment')))
+    for name, metric, old, new in found:
+        print('REGRESSION {} {}: {:.4g} -> {:.4g}'.format(name, metric, old, new))
+    if found:
+        raise SystemExit(1)
+    print('No regressions against {}'.format(os.path.relpath(args.baseline)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark: scaling of parallel.ParallelScorer with the number of workers.
+
+Scores one large batch of training rows (drawn with replacement) with the
+pickled sklearn model, with the compiled trees on one thread and on numba's
+threads in this process, and with a pool of 1, 2, 4 and 8 worker processes
+sharing the model and the batch through shared memory.
+
+Run from the repository root:
+    python -m benchmarks.bench_parallel
+    python -m benchmarks.bench_parallel --rows 5000000 --workers 1 2 4 8 16
+"""
+import argparse
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from imputation import TRAINING_DATA_PATH
+from model_registry import MODEL_PATH, read_training_columns
+from parallel import ParallelScorer
+from tree_engine import CompiledGBM
+
+
+# Rows scored by sklearn, which is too slow for the whole batch
+SKLEARN_ROWS = 200000
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure multi-process scoring at several worker counts.')
+    parser.add_argument('--rows', type=int, default=2000000, help='rows in the batch (default: %(default)s)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each scorer (default: %(default)s)')
+    args = parser.parse_args()
+
+    with open(MODEL_PATH, 'rb') as f:
+        model = pickle.load(f)
+    engine = CompiledGBM.from_sklearn(model)
+    training = pd.read_csv(TRAINING_DATA_PATH)[read_training_columns()].to_numpy(dtype=float)
+    X = training[np.random.RandomState(42).randint(0, len(training), args.rows)]
+    print('{:,} rows, {} trees, {} cores'.format(args.rows, engine.n_trees, os.cpu_count()))
+
+    expected = engine.decision_function(X)
+    raw = np.empty(args.rows)
+
+    def report(name, seconds, baseline=None):
+        print('{:>26}  {:>12,.0f}  {:>8}'.format(
+            name, args.rows / seconds, '' if baseline is None else '{:.2f}x'.format(baseline / seconds)))
+
+    print('{:>26}  {:>12}  {:>8}'.format('scorer', 'rows/s', 'vs 1'))
+    n_sklearn = min(args.rows, SKLEARN_ROWS)
+    sklearn_time = best_of(lambda: model.predict_proba(X[:n_sklearn]), 1) * args.rows / n_sklearn
+    report('sklearn', sklearn_time)
+    report('engine, 1 thread', best_of(lambda: engine.decision_function_into(
+        np.ascontiguousarray(X.T, dtype=np.float32), raw), args.repeat))
+    report('engine, numba threads', best_of(lambda: engine.decision_function(X), args.repeat))
+
+    single = None
+    for workers in args.workers:
+        with ParallelScorer(engine, workers) as scorer:
+            scorer.warm_up()
+            diff = np.max(np.abs(scorer.decision_function(X) - expected))
+            if diff > 0:
+                raise ValueError('{} workers differ from the engine by {:.3g}'.format(workers, diff))
+            seconds = best_of(lambda: scorer.decision_function(X), args.repeat)
+        single = seconds if single is None else single
+        report('{} worker processes'.format(workers), seconds, single)
+
+
+if __name__ == '__main__':
+    main()
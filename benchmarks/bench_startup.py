@@ -0,0 +1,98 @@
+"""Cold-start benchmark for app.py, one fresh interpreter per page.
+
+Each run imports streamlit, executes app.py in bare mode with the sidebar
+selection patched to one page, and reports:
+    import   interpreter start until the page is dispatched
+    render   time spent running the page function
+    heavy    heavy modules loaded by then
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --app /tmp/app_before.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+PAGES = [
+    "Introduction",
+    "Exploratory Data Analysis",
+    "Clustering",
+    "Discussion",
+    "Predictive Model",
+    "Batch Scoring",
+    "Cohort Risk",
+]
+
+HEAVY_MODULES = ['sklearn', 'scipy', 'numba', 'model_registry']
+
+# Runs inside the child interpreter; argv is (app path, page, submit forms)
+DRIVER = """
+import json, runpy, sys, time
+start = time.perf_counter()
+import streamlit as st
+
+app_path, page, click = sys.argv[1], sys.argv[2], sys.argv[3] == '1'
+marks = {}
+
+def radio(label, options, *args, **kwargs):
+    marks['dispatch'] = time.perf_counter()
+    return page
+
+st.sidebar.radio = radio
+if click:
+    st.form_submit_button = lambda *args, **kwargs: True
+
+runpy.run_path(app_path, run_name='__main__')
+end = time.perf_counter()
+print(json.dumps({
+    'import': marks['dispatch'] - start,
+    'render': end - marks['dispatch'],
+    'heavy': [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_page(app_path, page, click=False, env=None):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', DRIVER, app_path, page, '1' if click else '0'],
+        capture_output=True, text=True, env=env, check=True)
+    wall = time.perf_counter() - start
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['wall'] = wall
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start time of each app page.')
+    parser.add_argument('--app', default='app.py', help='app script to run (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='cold runs per page, median reported')
+    parser.add_argument('--warmup', action='store_true', help='run with ATTRITION_WARMUP=1')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+    if args.warmup:
+        env['ATTRITION_WARMUP'] = '1'
+
+    # The predictive page is also run with its form submitted, so the first
+    # prediction (model load and kernel compilation) is included
+    runs = [(page, False) for page in PAGES] + [("Predictive Model", True)]
+
+    print('{:<34} {:>9} {:>9} {:>9}  {}'.format('page', 'import s', 'render s', 'wall s', 'heavy modules'))
+    for page, click in runs:
+        results = [run_page(args.app, page, click, env) for _ in range(args.repeat)]
+        median = {key: statistics.median(r[key] for r in results) for key in ['import', 'render', 'wall']}
+        label = page + (' + predict' if click else '')
+        print('{:<34} {:>9.3f} {:>9.3f} {:>9.3f}  {}'.format(
+            label, median['import'], median['render'], median['wall'], ', '.join(results[-1]['heavy']) or '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark: peak memory and throughput of streaming.py on a synthetic extract.
+
+The extract is built from rows of IBM_HR-Attrition.csv drawn at random (with
+fresh EmployeeNumbers) and written in blocks, so it never sits in memory.
+Each configuration is scored in its own process so that its peak RSS is its
+own. Files of up to --in-memory-rows rows are also scored whole with
+batch_scoring.py for comparison.
+
+Run from the repository root:
+    python -m benchmarks.bench_streaming
+    python -m benchmarks.bench_streaming --rows 1000000 --chunk-sizes 50000 200000 --workers 1 2
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from batch_scoring import read_workforce_csv
+from data_access import DATASET_PATH
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WRITE_BLOCK = 500000
+
+# Runs a scorer in a fresh process and prints its peak RSS in MB last
+_RUN = '''
+import sys, streaming
+{call}
+print(streaming.peak_rss_mb())
+'''
+_STREAM_CALL = 'streaming.score_file(sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))'
+_BATCH_CALL = 'import batch_scoring; batch_scoring.score_csv(sys.argv[1], sys.argv[2])'
+
+
+def write_extract(path, n_rows, random_state=0):
+    source = read_workforce_csv(DATASET_PATH)
+    rng = np.random.RandomState(random_state)
+    with open(path, 'w', newline='') as out:
+        for start in range(0, n_rows, WRITE_BLOCK):
+            stop = min(start + WRITE_BLOCK, n_rows)
+            block = source.iloc[rng.randint(0, len(source), stop - start)].copy()
+            block['EmployeeNumber'] = np.arange(start, stop) + 1
+            block.to_csv(out, index=False, header=start == 0)
+
+
+def run(call, *args):
+    """Seconds taken and peak RSS (MB) of a scorer in a fresh process."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', _RUN.format(call=call)] + [str(a) for a in args],
+                            cwd=BASE_DIR, check=True, capture_output=True, text=True)
+    return time.perf_counter() - start, float(result.stdout.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure streaming.py on a large synthetic extract.')
+    parser.add_argument('--rows', type=int, default=10000000, help='rows in the extract (default: %(default)s)')
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[50000, 100000, 200000])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--in-memory-rows', type=int, default=1000000,
+                        help='largest extract also scored whole with batch_scoring.py (default: %(default)s)')
+    parser.add_argument('--dir', default=tempfile.gettempdir(), help='where to write the extract')
+    args = parser.parse_args()
+
+    input_path = os.path.join(args.dir, 'bench_streaming_input.csv')
+    output_path = os.path.join(args.dir, 'bench_streaming_output.csv')
+    start = time.perf_counter()
+    write_extract(input_path, args.rows)
+    print('Wrote {:,} rows ({:.0f} MB) in {:.0f}s'.format(
+        args.rows, os.path.getsize(input_path) / 1e6, time.perf_counter() - start))
+
+    try:
+        print('{:>22}  {:>8}  {:>8}  {:>12}  {:>13}'.format('scorer', 'chunk', 'workers', 'rows/s', 'peak RSS MB'))
+        if args.rows <= args.in_memory_rows:
+            seconds, peak = run(_BATCH_CALL, input_path, output_path)
+            print('{:>22}  {:>8}  {:>8}  {:>12,.0f}  {:>13,.0f}'.format(
+                'batch_scoring (whole)', '-', '-', args.rows / seconds, peak))
+        for chunk_size in args.chunk_sizes:
+            for workers in args.workers:
+                seconds, peak = run(_STREAM_CALL, input_path, output_path, chunk_size, workers)
+                print('{:>22}  {:>8,}  {:>8}  {:>12,.0f}  {:>13,.0f}'.format(
+                    'streaming', chunk_size, workers, args.rows / seconds, peak))
+    finally:
+        for path in [input_path, output_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
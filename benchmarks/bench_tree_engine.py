@@ -0,0 +1,77 @@
+"""Benchmark: CompiledGBM vs sklearn predict_proba across batch sizes.
+
+Also times the TreeSHAP attributions of a batch of --explain-rows employees.
+
+Run from the repository root:
+    python -m benchmarks.bench_tree_engine
+    python -m benchmarks.bench_tree_engine --max-rows 100000
+"""
+import argparse
+import pickle
+import time
+import timeit
+
+import numpy as np
+import pandas as pd
+
+import tree_engine
+from imputation import TRAINING_DATA_PATH
+from model_registry import MODEL_PATH, read_training_columns
+from tree_engine import CompiledGBM
+
+
+BATCH_SIZES = [1, 10, 100, 1000, 10000, 100000, 1000000]
+
+
+def best_of(stmt, number, repeat=5):
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the compiled trees with sklearn.')
+    parser.add_argument('--max-rows', type=int, default=BATCH_SIZES[-1],
+                        help='largest batch to time (default: %(default)s)')
+    parser.add_argument('--explain-rows', type=int, default=10000,
+                        help='batch to explain with TreeSHAP (default: %(default)s)')
+    args = parser.parse_args()
+
+    with open(MODEL_PATH, 'rb') as f:
+        model = pickle.load(f)
+    engine = CompiledGBM.from_sklearn(model)
+    print('{} trees of depth {}, native loops: {}'.format(
+        engine.n_trees, engine.depth, 'numba' if tree_engine.numba is not None else 'no (NumPy)'))
+
+    training = pd.read_csv(TRAINING_DATA_PATH)[read_training_columns()].to_numpy(dtype=float)
+
+    # Both paths must agree before timing them
+    print('Max |diff| on the training data: {:.3g}'.format(engine.check(model, training)))
+    print('Max |diff| around the split thresholds: {:.3g}'.format(
+        engine.check(model, engine.sample_inputs(100000))))
+
+    rng = np.random.RandomState(42)
+    print('{:>10}  {:>12}  {:>12}  {:>8}'.format('rows', 'sklearn ms', 'engine ms', 'speedup'))
+    for n_rows in BATCH_SIZES:
+        if n_rows > args.max_rows:
+            break
+        X = training[rng.randint(0, len(training), n_rows)]
+        number = max(1, 2000 // n_rows)
+        repeat = 5 if n_rows < 1000000 else 2
+        sklearn_time = best_of(lambda: model.predict_proba(X), number, repeat)
+        engine_time = best_of(lambda: engine.predict_proba(X), number, repeat)
+        print('{:>10,}  {:>12.3f}  {:>12.3f}  {:>7.1f}x'.format(
+            n_rows, sklearn_time * 1e3, engine_time * 1e3, sklearn_time / engine_time))
+
+    X = training[rng.randint(0, len(training), args.explain_rows)]
+    # A fresh engine, as check() above already built the tables
+    engine = CompiledGBM.from_sklearn(model)
+    start = time.perf_counter()
+    engine.shap_tables()
+    tables_time = time.perf_counter() - start
+    explain_time = best_of(lambda: engine.shap_values(X), 1, 3)
+    gap = np.max(np.abs(engine.shap_values(X).sum(axis=1) + engine.expected_value - engine.decision_function(X)))
+    print('TreeSHAP for {:,} rows: {:.1f} ms after {:.1f} ms building the tables (max additivity gap {:.3g})'.format(
+        args.explain_rows, explain_time * 1e3, tables_time * 1e3, gap))
+
+
+if __name__ == '__main__':
+    main()
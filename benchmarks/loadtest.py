@@ -0,0 +1,98 @@
+"""Load test for serve.py against localhost.
+
+Start the service first (python serve.py), then run from the repository root:
+    python -m benchmarks.loadtest --clients 32 --duration 20
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_FIELDS
+
+
+def load_records(n_records):
+    data = pd.read_csv('data/attrition_features.csv')
+    data = data.sample(n_records, replace=True, random_state=42)
+    return [{field: float(row[field]) for field in FEATURE_FIELDS} for _, row in data.iterrows()]
+
+
+def client(host, port, records, deadline, batch_rows, latencies, errors):
+    conn = http.client.HTTPConnection(host, port)
+    i = 0
+    while time.perf_counter() < deadline:
+        if batch_rows == 1:
+            body = records[i % len(records)]
+        else:
+            body = {'instances': [records[(i + j) % len(records)] for j in range(batch_rows)]}
+        i += batch_rows
+
+        start = time.perf_counter()
+        try:
+            conn.request('POST', '/predict', json.dumps(body), {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as exc:
+            errors.append(str(exc))
+            conn.close()
+            conn = http.client.HTTPConnection(host, port)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the attrition scoring service.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent connections')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run')
+    parser.add_argument('--batch-rows', type=int, default=1, help='employees per request')
+    args = parser.parse_args()
+
+    records = load_records(1000)
+    deadline = time.perf_counter() + args.duration
+    results = [([], []) for _ in range(args.clients)]
+    threads = [
+        threading.Thread(target=client, args=(args.host, args.port, records, deadline,
+                                              args.batch_rows, latencies, errors))
+        for latencies, errors in results
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([x for latencies, _ in results for x in latencies])
+    n_errors = sum(len(errors) for _, errors in results)
+
+    print('Clients: {}, rows per request: {}, duration: {:.1f}s'.format(
+        args.clients, args.batch_rows, elapsed))
+    print('Requests: {:,} ok, {:,} failed'.format(len(latencies), n_errors))
+    print('Throughput: {:,.0f} requests/s, {:,.0f} rows/s'.format(
+        len(latencies) / elapsed, len(latencies) * args.batch_rows / elapsed))
+    if len(latencies):
+        print('Client latency (ms): p50 {:.2f}  p90 {:.2f}  p99 {:.2f}  max {:.2f}'.format(
+            *(np.percentile(latencies, [50, 90, 99, 100]) * 1e3)))
+
+    conn = http.client.HTTPConnection(args.host, args.port)
+    conn.request('GET', '/stats')
+    stats = json.loads(conn.getresponse().read())
+    conn.close()
+    print('Server stats:')
+    for key, value in stats.items():
+        print('  {:<22} {}'.format(key, round(value, 3) if isinstance(value, float) else value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+"""Employee segments from mini-batch k-means over the encoded features.
+
+The engine reads a file in the data/attrition_features_ohe.csv layout
+(Attrition followed by the sixteen model columns) a chunk at a time, so the
+memory used does not depend on the size of the workforce:
+
+    pass 1    mean and standard deviation of every column
+    pass 2+   MiniBatchKMeans.partial_fit on mini-batches of each chunk
+    last      assign every employee to a segment, and sum up the segments
+
+The segments (size, attrition rate and mean profile) are written to
+data/cache/segments.csv, and the centroids and the sha256 of the file they
+were fitted on to data/cache/clustering_state.json. Rerunning it does nothing
+unless the data has changed. When it has, the previous centroids are the
+starting point and are refined with a couple of passes, instead of fitting
+from scratch, so segments keep their numbers across updates.
+
+The Clustering page only reads the segments back; it never fits. To build
+or update them:
+    python clustering.py
+    python clustering.py --input /exports/workforce_ohe.csv --full
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_access import CACHE_DIR, file_sha256, file_stamp
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FEATURES_PATH = os.path.join(BASE_DIR, 'data', 'attrition_features_ohe.csv')
+SEGMENTS_PATH = os.path.join(CACHE_DIR, 'segments.csv')
+STATE_PATH = os.path.join(CACHE_DIR, 'clustering_state.json')
+
+# Bumped whenever the state or the summary layout change
+STATE_VERSION = 1
+
+TARGET_COL = 'Attrition'
+SEGMENT_COL = 'Segment'
+SIZE_COL = 'Employees'
+RATE_COL = 'Attrition_Rate'
+
+# Seven segments, like the k-modes clustering of the EDA notebook
+N_CLUSTERS = 7
+CHUNK_SIZE = 50000
+BATCH_SIZE = 1024
+# Passes over the data when fitting from scratch, and when refining
+FIT_EPOCHS = 10
+UPDATE_EPOCHS = 2
+RANDOM_STATE = 42
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """(features, attrition) arrays of each chunk of the file."""
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        yield (chunk.drop(columns=[TARGET_COL]).to_numpy(dtype=float),
+               chunk[TARGET_COL].to_numpy(dtype=float))
+
+
+def read_columns(path):
+    return [col for col in pd.read_csv(path, nrows=0).columns if col != TARGET_COL]
+
+
+def column_scale(path, chunk_size=CHUNK_SIZE):
+    """Mean and standard deviation of every feature column, in one pass."""
+    n = 0
+    total = None
+    total_sq = None
+    for X, _ in read_chunks(path, chunk_size):
+        if total is None:
+            total = np.zeros(X.shape[1])
+            total_sq = np.zeros(X.shape[1])
+        n += len(X)
+        total += X.sum(axis=0)
+        total_sq += (X * X).sum(axis=0)
+    if not n:
+        raise ValueError('{} has no rows'.format(path))
+    mean = total / n
+    std = np.sqrt(np.maximum(total_sq / n - mean * mean, 0.0))
+    # Constant columns are left as they are
+    std[std == 0] = 1.0
+    return mean, std
+
+
+def fit_centroids(path, mean, std, n_clusters=N_CLUSTERS, init=None, epochs=FIT_EPOCHS,
+                  chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, random_state=RANDOM_STATE):
+    """Centroids (in scaled units) after epochs passes of mini-batch k-means.
+
+    init (scaled centroids) is the starting point when given; k-means++ on
+    the first mini-batch otherwise.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, init='k-means++' if init is None else init,
+                             n_init=1, batch_size=batch_size, random_state=random_state)
+    rng = np.random.RandomState(random_state)
+    for _ in range(epochs):
+        for X, _ in read_chunks(path, chunk_size):
+            X = (X - mean) / std
+            order = rng.permutation(len(X))
+            for start in range(0, len(X), batch_size):
+                batch = X[order[start:start + batch_size]]
+                # k-means++ needs at least one row per cluster to start from
+                if not hasattr(kmeans, 'cluster_centers_') and len(batch) < n_clusters:
+                    continue
+                kmeans.partial_fit(batch)
+    return kmeans.cluster_centers_
+
+
+def assign(X, centroids):
+    """Index of the nearest centroid of every (scaled) row."""
+    distances = (X * X).sum(axis=1)[:, None] - 2 * X @ centroids.T + (centroids * centroids).sum(axis=1)
+    return distances.argmin(axis=1)
+
+
+def summarize(path, columns, mean, std, centroids, chunk_size=CHUNK_SIZE):
+    """Size, attrition rate and mean profile of every segment, in one pass."""
+    n_clusters = len(centroids)
+    sizes = np.zeros(n_clusters)
+    left = np.zeros(n_clusters)
+    totals = np.zeros((n_clusters, len(columns)))
+    inertia = 0.0
+    for X, attrition in read_chunks(path, chunk_size):
+        scaled = (X - mean) / std
+        labels = assign(scaled, centroids)
+        sizes += np.bincount(labels, minlength=n_clusters)
+        left += np.bincount(labels, weights=attrition, minlength=n_clusters)
+        np.add.at(totals, labels, X)
+        inertia += float(((scaled - centroids[labels]) ** 2).sum())
+
+    nonempty = np.maximum(sizes, 1)
+    segments = pd.DataFrame(totals / nonempty[:, None], columns=columns).round(2)
+    segments.insert(0, SEGMENT_COL, np.arange(n_clusters) + 1)
+    segments.insert(1, SIZE_COL, sizes.astype(int))
+    segments.insert(2, RATE_COL, (left / nonempty).round(4))
+    return segments, inertia
+
+
+class SegmentCache:
+    """The segments of the current features file, in memory and on disk."""
+
+    def __init__(self, features_path=FEATURES_PATH, segments_path=SEGMENTS_PATH, state_path=STATE_PATH):
+        self.features_path = features_path
+        self.segments_path = segments_path
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._segments = None
+        self.stale = False
+        self.last_run = None
+
+    def read_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state if state.get('version') == STATE_VERSION else None
+
+    def _write_state(self, state):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _read_segments(self, state):
+        if not os.path.exists(self.segments_path) or file_sha256(self.segments_path) != state.get('segments_sha256'):
+            return None
+        return pd.read_csv(self.segments_path)
+
+    def refresh(self, full=False, n_clusters=N_CLUSTERS, chunk_size=CHUNK_SIZE):
+        """Bring the segments up to date with the features file; returns them."""
+        start = time.perf_counter()
+        stamp = file_stamp(self.features_path)
+        state = None if full else self.read_state()
+        if state is not None and (state['stamp'] != stamp or state['n_clusters'] != n_clusters):
+            digest = file_sha256(self.features_path)
+            if state['n_clusters'] != n_clusters or state['sha256'] != digest:
+                state = dict(state, sha256=digest, stale=True)
+            else:
+                state['stamp'] = stamp
+
+        if state is not None and not state.get('stale'):
+            segments = self._read_segments(state)
+            if segments is not None:
+                if state['stamp'] != stamp:
+                    self._write_state(state)
+                self.last_run = {'mode': 'cached', 'seconds': time.perf_counter() - start}
+                return segments
+
+        columns = read_columns(self.features_path)
+        mean, std = column_scale(self.features_path, chunk_size)
+        if state is not None and not state.get('stale'):
+            # Only the summary file was lost; the centroids still fit the data
+            centroids = np.array(state['centroids'])
+            mode = 'summarized'
+        elif state is not None and state['columns'] == columns and state['n_clusters'] == n_clusters:
+            # Carry the previous centroids over to the new scale, and refine them
+            previous = np.array(state['centroids']) * np.array(state['std']) + np.array(state['mean'])
+            centroids = fit_centroids(self.features_path, mean, std, n_clusters, init=(previous - mean) / std,
+                                      epochs=UPDATE_EPOCHS, chunk_size=chunk_size)
+            mode = 'updated'
+        else:
+            centroids = fit_centroids(self.features_path, mean, std, n_clusters, chunk_size=chunk_size)
+            mode = 'fitted'
+        segments, inertia = summarize(self.features_path, columns, mean, std, centroids, chunk_size)
+
+        os.makedirs(os.path.dirname(self.segments_path), exist_ok=True)
+        tmp_path = self.segments_path + '.tmp'
+        segments.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.segments_path)
+        self._write_state({
+            'version': STATE_VERSION,
+            'source': os.path.basename(self.features_path),
+            'stamp': stamp,
+            'sha256': file_sha256(self.features_path),
+            'segments_sha256': file_sha256(self.segments_path),
+            'n_clusters': n_clusters,
+            'columns': columns,
+            'mean': mean.tolist(),
+            'std': std.tolist(),
+            'centroids': centroids.tolist(),
+            'rows': int(segments[SIZE_COL].sum()),
+            'inertia': inertia,
+        })
+        self.last_run = {'mode': mode, 'seconds': time.perf_counter() - start, 'inertia': inertia}
+        return segments
+
+    def _stamps(self):
+        stamps = []
+        for path in [self.features_path, self.state_path, self.segments_path]:
+            stamps.append(file_stamp(path) if os.path.exists(path) else None)
+        return stamps
+
+    def get(self):
+        """The segments built by python clustering.py, or None before it has been run.
+
+        Never fits. When the features file changed since, the segments of the
+        previous version are returned and stale is set.
+        """
+        stamps = self._stamps()
+        if stamps == self._stamp:
+            return self._segments
+        with self._lock:
+            if stamps != self._stamp:
+                state = self.read_state()
+                segments = self._read_segments(state) if state is not None else None
+                self.stale = segments is not None and state['stamp'] != stamps[0] and (
+                    stamps[0] is None or state['sha256'] != file_sha256(self.features_path))
+                self._segments = segments
+                self._stamp = stamps
+            return self._segments
+
+
+segment_cache = SegmentCache()
+
+
+def segment_chart(segments):
+    """Attrition rate of every segment, bar width by the number of employees."""
+    import altair as alt
+
+    from eda import LEFT_COLOR
+
+    table = segments.assign(**{SEGMENT_COL: 'Segment ' + segments[SEGMENT_COL].astype(str)})
+    overall = float((segments[RATE_COL] * segments[SIZE_COL]).sum() / max(segments[SIZE_COL].sum(), 1))
+    bars = alt.Chart(table).mark_bar(color=LEFT_COLOR).encode(
+        x=alt.X(SEGMENT_COL + ':N', title=None, sort=list(table[SEGMENT_COL]), axis=alt.Axis(labelAngle=0)),
+        y=alt.Y(RATE_COL + ':Q', title='Attrition Rate', axis=alt.Axis(format='%')),
+        tooltip=[SEGMENT_COL + ':N', alt.Tooltip(SIZE_COL + ':Q', format=','),
+                 alt.Tooltip(RATE_COL + ':Q', format='.1%', title='Attrition Rate')],
+    )
+    rule = alt.Chart(pd.DataFrame({'overall': [overall]})).mark_rule(color='gray', strokeDash=[4, 4]).encode(
+        y='overall:Q')
+    return bars + rule
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Segment the workforce with mini-batch k-means.')
+    parser.add_argument('--input', default=FEATURES_PATH,
+                        help='features in the attrition_features_ohe.csv layout (default: %(default)s)')
+    parser.add_argument('--output', default=SEGMENTS_PATH, help='segment summary to write (default: %(default)s)')
+    parser.add_argument('--state', default=STATE_PATH, help='centroids and fingerprint (default: %(default)s)')
+    parser.add_argument('--clusters', type=int, default=N_CLUSTERS, help='number of segments (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='rows read at a time (default: %(default)s)')
+    parser.add_argument('--full', action='store_true', help='fit from scratch even if the data did not change')
+    args = parser.parse_args()
+
+    cache = SegmentCache(args.input, args.output, args.state)
+    segments = cache.refresh(args.full, args.clusters, args.chunk_size)
+    print('{} {:,} employees into {} segments in {:.2f}s -> {}'.format(
+        cache.last_run['mode'].capitalize(), int(segments[SIZE_COL].sum()), len(segments),
+        cache.last_run['seconds'], args.output))
+    print(segments[[SEGMENT_COL, SIZE_COL, RATE_COL]].to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
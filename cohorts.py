@@ -0,0 +1,277 @@
+"""Indexed rollups of attrition risk over cohorts of scored employees.
+
+Every employee of IBM_HR-Attrition.csv is scored once, and the result is
+kept as a small columnar index instead of a frame:
+
+    codes      one small integer column per dimension (dictionary encoded),
+               with the sorted labels of each dimension
+    bitmaps    one packed bit per employee for every label of every
+               dimension; a filter is the AND over dimensions of the OR of
+               the selected labels
+    cube       employees, summed probability, predicted and actual leavers
+               for every combination of labels of all dimensions
+
+A filtered group-by over the dimensions slices and sums the cube, whose
+size depends on the number of labels, not of employees. Only listing the
+employees of a cohort goes back to rows, through the bitmaps.
+
+The index is cached in memory and in data/cache/cohort_index.npz, keyed by
+the sha256 of the dataset and the model fingerprint. To rebuild it ahead of
+time:
+    python cohorts.py
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_access import CACHE_DIR, dataset
+
+
+INDEX_PATH = os.path.join(CACHE_DIR, 'cohort_index.npz')
+
+# Bumped whenever the layout of the index changes
+INDEX_VERSION = 1
+
+DIMENSIONS = ['Department', 'JobRole', 'JobLevel', 'OverTime', 'BusinessTravel', 'Gender', 'MaritalStatus']
+KEY_COL = 'EmployeeNumber'
+
+# Sums kept per cube cell, in this order
+MEASURES = ['employees', 'probability', 'predicted', 'left']
+
+# Cells above which the cube is not built and aggregates are counted from rows
+MAX_CUBE_CELLS = 5000000
+
+
+def dictionary_encode(column):
+    """(codes, labels) with labels sorted by value, as strings."""
+    codes, labels = pd.factorize(column, sort=True)
+    if (codes < 0).any():
+        raise ValueError('{} has missing values'.format(column.name))
+    dtype = np.uint8 if len(labels) <= 256 else np.uint16
+    return codes.astype(dtype), np.asarray(labels).astype(str)
+
+
+class CohortIndex:
+    """Dictionary-encoded dimensions, bitmaps and the cube of a scored workforce."""
+
+    def __init__(self, codes, labels, probability, predicted, left, keys, cube=None, key=None):
+        self.codes = codes
+        self.labels = labels
+        self.probability = probability
+        self.predicted = predicted
+        self.left = left
+        self.keys = keys
+        self.n_rows = len(probability)
+        self.key = key
+        self.shape = tuple(len(labels[dim]) for dim in DIMENSIONS)
+        self._code_of = {dim: {label: i for i, label in enumerate(labels[dim])} for dim in DIMENSIONS}
+        self.bitmaps = {dim: np.stack([np.packbits(codes[dim] == i) for i in range(len(labels[dim]))])
+                        for dim in DIMENSIONS}
+        if cube is None and int(np.prod(self.shape)) <= MAX_CUBE_CELLS:
+            cube = self._build_cube()
+        self.cube = cube
+
+    @classmethod
+    def build(cls, data, loaded_model=None, key=None):
+        """Score a raw workforce frame and index it."""
+        from batch_scoring import score_features
+        from features import raw_to_features
+
+        # The training data is not live input, so it is kept out of the drift monitor
+        probability, prediction, _, _ = score_features(raw_to_features(data), loaded_model, observe=False)
+        codes = {}
+        labels = {}
+        for dim in DIMENSIONS:
+            codes[dim], labels[dim] = dictionary_encode(data[dim])
+        left = (data['Attrition'].astype(str) == 'Yes').to_numpy()
+        return cls(codes, labels, probability.astype(np.float32), prediction == 1, left,
+                   data[KEY_COL].to_numpy(), key=key)
+
+    def _build_cube(self):
+        cell = np.ravel_multi_index([self.codes[dim].astype(np.intp) for dim in DIMENSIONS], self.shape)
+        n_cells = int(np.prod(self.shape))
+        cube = np.empty((len(MEASURES), n_cells))
+        cube[0] = np.bincount(cell, minlength=n_cells)
+        cube[1] = np.bincount(cell, weights=self.probability, minlength=n_cells)
+        cube[2] = np.bincount(cell, weights=self.predicted, minlength=n_cells)
+        cube[3] = np.bincount(cell, weights=self.left, minlength=n_cells)
+        return cube.reshape((len(MEASURES),) + self.shape)
+
+    def _selected(self, filters):
+        # Codes selected per dimension; every code of unfiltered dimensions
+        selected = []
+        for dim in DIMENSIONS:
+            values = filters.get(dim)
+            if values:
+                code_of = self._code_of[dim]
+                selected.append(np.array(sorted({code_of[str(v)] for v in values if str(v) in code_of}),
+                                         dtype=np.intp))
+            else:
+                selected.append(np.arange(len(self.labels[dim])))
+        return selected
+
+    def mask(self, filters):
+        """Rows matching filters ({dimension: [labels]}), from the bitmaps."""
+        packed = None
+        for dim, codes in zip(DIMENSIONS, self._selected(filters)):
+            if not filters.get(dim):
+                continue
+            dim_bits = np.bitwise_or.reduce(self.bitmaps[dim][codes], axis=0, initial=0)
+            packed = dim_bits if packed is None else packed & dim_bits
+        if packed is None:
+            return np.ones(self.n_rows, dtype=bool)
+        return np.unpackbits(packed, count=self.n_rows).astype(bool)
+
+    def aggregate(self, filters=None, group_by=()):
+        """Employees, mean probability, predicted and actual attrition per group."""
+        filters = filters or {}
+        group_by = [dim for dim in DIMENSIONS if dim in group_by]
+        if self.cube is not None:
+            sums = self._aggregate_cube(filters, group_by)
+        else:
+            sums = self._aggregate_rows(filters, group_by)
+        groups, totals = sums
+
+        table = pd.DataFrame(groups, columns=group_by, index=np.arange(totals.shape[1]))
+        table['Employees'] = totals[0].astype(int)
+        employees = np.maximum(totals[0], 1)
+        table['Average Probability'] = totals[1] / employees
+        table['Predicted to Leave'] = totals[2].astype(int)
+        table['Attrition Rate'] = totals[3] / employees
+        table = table[table['Employees'] > 0]
+        return table.sort_values('Average Probability', ascending=False).reset_index(drop=True)
+
+    def _aggregate_cube(self, filters, group_by):
+        selected = self._selected(filters)
+        sliced = self.cube[np.ix_(np.arange(len(MEASURES)), *selected)]
+        other_axes = tuple(1 + i for i, dim in enumerate(DIMENSIONS) if dim not in group_by)
+        summed = sliced.sum(axis=other_axes)
+        group_shape = summed.shape[1:]
+        group_codes = [selected[DIMENSIONS.index(dim)] for dim in group_by]
+        # Labels of every remaining cell, in C order like the reshaped sums
+        grid = np.meshgrid(*group_codes, indexing='ij') if group_by else []
+        groups = {dim: self.labels[dim][codes.ravel()] for dim, codes in zip(group_by, grid)}
+        return groups, summed.reshape(len(MEASURES), int(np.prod(group_shape)))
+
+    def _aggregate_rows(self, filters, group_by):
+        rows = np.flatnonzero(self.mask(filters))
+        shape = [len(self.labels[dim]) for dim in group_by]
+        cell = np.ravel_multi_index([self.codes[dim][rows].astype(np.intp) for dim in group_by], shape) \
+            if group_by else np.zeros(len(rows), dtype=np.intp)
+        n_cells = int(np.prod(shape))
+        totals = np.stack([np.bincount(cell, weights=weights, minlength=n_cells) for weights in
+                           [None, self.probability[rows], self.predicted[rows], self.left[rows]]])
+        grid = np.unravel_index(np.arange(n_cells), shape) if group_by else []
+        groups = {dim: self.labels[dim][codes] for dim, codes in zip(group_by, grid)}
+        return groups, totals
+
+    def employees(self, filters=None, top=100):
+        """The top employees of a cohort by probability of leaving."""
+        rows = np.flatnonzero(self.mask(filters or {}))
+        rows = rows[np.argsort(-self.probability[rows], kind='stable')[:top]]
+        table = pd.DataFrame({KEY_COL: self.keys[rows]})
+        for dim in DIMENSIONS:
+            table[dim] = self.labels[dim][self.codes[dim][rows]]
+        table['Probability of Leaving'] = self.probability[rows]
+        return table
+
+    def save(self, path):
+        arrays = {'probability': self.probability, 'predicted': self.predicted, 'left': self.left,
+                  'keys': self.keys}
+        for dim in DIMENSIONS:
+            arrays['codes_' + dim] = self.codes[dim]
+        if self.cube is not None:
+            arrays['cube'] = self.cube
+        meta = {'version': INDEX_VERSION, 'key': self.key, 'labels': {dim: self.labels[dim].tolist()
+                                                                     for dim in DIMENSIONS}}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, key):
+        """The saved index, or None if it is missing or was built for other data or another model."""
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                meta = json.loads(str(stored['meta']))
+                if meta.get('version') != INDEX_VERSION or meta.get('key') != key:
+                    return None
+                arrays = {name: stored[name] for name in stored.files if name != 'meta'}
+        except (OSError, ValueError, KeyError):
+            return None
+        codes = {dim: arrays['codes_' + dim] for dim in DIMENSIONS}
+        labels = {dim: np.array(meta['labels'][dim]) for dim in DIMENSIONS}
+        return cls(codes, labels, arrays['probability'], arrays['predicted'], arrays['left'],
+                   arrays['keys'], arrays.get('cube'), key)
+
+
+class CohortCache:
+    """The index of the current dataset and model, in memory and on disk."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index = None
+        self.last_seconds = 0.0
+
+    def get(self):
+        from model_registry import get_model
+
+        data = dataset.get()
+        loaded_model = get_model()
+        key = '{}:{}'.format(dataset.fingerprint, loaded_model.fingerprint)
+        index = self._index
+        if index is not None and index.key == key:
+            return index
+
+        with self._lock:
+            if self._index is None or self._index.key != key:
+                start = time.perf_counter()
+                index = CohortIndex.load(self.path, key)
+                if index is None:
+                    index = CohortIndex.build(data, loaded_model, key)
+                    index.save(self.path)
+                self._index = index
+                self.last_seconds = time.perf_counter() - start
+            return self._index
+
+
+cohort_cache = CohortCache()
+
+
+def risk_chart(table, group_by):
+    """Average probability of leaving per group, largest first."""
+    import altair as alt
+
+    from eda import LEFT_COLOR
+
+    table = table.assign(Cohort=table[group_by].astype(str).agg(' / '.join, axis=1))
+    return alt.Chart(table).mark_bar(color=LEFT_COLOR).encode(
+        x=alt.X('Average Probability:Q', axis=alt.Axis(format='%'), title='Average probability of leaving'),
+        y=alt.Y('Cohort:N', sort=list(table['Cohort']), title=None),
+        tooltip=['Cohort:N', alt.Tooltip('Employees:Q', format=','),
+                 alt.Tooltip('Average Probability:Q', format='.1%'),
+                 alt.Tooltip('Attrition Rate:Q', format='.1%')],
+    )
+
+
+def main():
+    from model_registry import get_model
+
+    start = time.perf_counter()
+    data = dataset.get()
+    loaded_model = get_model()
+    index = CohortIndex.build(data, loaded_model, '{}:{}'.format(dataset.fingerprint, loaded_model.fingerprint))
+    index.save(INDEX_PATH)
+    print('Indexed {:,} employees over {} dimensions ({} cube cells) in {:.2f}s -> {}'.format(
+        index.n_rows, len(DIMENSIONS), 'no' if index.cube is None else '{:,}'.format(index.cube[0].size),
+        time.perf_counter() - start, INDEX_PATH))
+
+
+if __name__ == '__main__':
+    main()
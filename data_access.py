@@ -0,0 +1,177 @@
+"""Columnar cache for the HR dataset shown in the app.
+
+IBM_HR-Attrition.csv is parsed once and stored as a typed Feather file in
+data/cache, with low-cardinality text columns as categoricals and integers
+downcast. A sidecar JSON records the (mtime, size) and sha256 of the CSV it
+was built from; the cache is rebuilt only when the content of the CSV
+changes. On top of that the frame is kept in memory for the lifetime of the
+process, like the model in model_registry.
+
+To rebuild the cache ahead of time (e.g. after the nightly export):
+    python data_access.py
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from features import clean_column_names
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_PATH = os.path.join(BASE_DIR, 'IBM_HR-Attrition.csv')
+CACHE_DIR = os.path.join(BASE_DIR, 'data', 'cache')
+
+# Bumped whenever the cached layout or dtypes change
+CACHE_VERSION = 1
+
+# Text columns with at most this share of distinct values become categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+DEFAULT_PAGE_SIZE = 100
+
+
+def file_stamp(path):
+    info = os.stat(path)
+    return [info.st_mtime_ns, info.st_size]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def optimize_dtypes(data):
+    """Categoricals for repetitive text columns, smallest integer types otherwise."""
+    data = data.copy()
+    for col in data.columns:
+        if data[col].dtype == object:
+            if data[col].nunique() <= CATEGORY_MAX_RATIO * len(data):
+                data[col] = data[col].astype('category')
+        elif pd.api.types.is_integer_dtype(data[col]):
+            data[col] = pd.to_numeric(data[col], downcast='integer')
+    return data
+
+
+def read_source(path=DATASET_PATH):
+    data = pd.read_csv(path, encoding='ISO-8859-1')
+    return optimize_dtypes(clean_column_names(data))
+
+
+class DatasetCache:
+    """Serve the dataset from memory, then the Feather cache, then the CSV."""
+
+    def __init__(self, source_path=DATASET_PATH, cache_dir=CACHE_DIR):
+        self.source_path = source_path
+        name = os.path.splitext(os.path.basename(source_path))[0]
+        self.cache_path = os.path.join(cache_dir, name + '.feather')
+        self.meta_path = os.path.join(cache_dir, name + '.json')
+        self._lock = threading.Lock()
+        self._frame = None
+        self._stamp = None
+        # sha256 of the CSV the current frame was built from
+        self.fingerprint = None
+        self.stats = {'memory_hits': 0, 'cache_loads': 0, 'builds': 0, 'last_seconds': 0.0}
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != CACHE_VERSION or not os.path.exists(self.cache_path):
+            return None
+        return meta
+
+    def _write_meta(self, meta):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def _build(self, stamp, digest):
+        data = read_source(self.source_path)
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        data.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, self.cache_path)
+        self._write_meta({
+            'version': CACHE_VERSION,
+            'source': os.path.basename(self.source_path),
+            'stamp': stamp,
+            'sha256': digest,
+            'rows': len(data),
+        })
+        return data
+
+    def get(self):
+        stamp = file_stamp(self.source_path)
+        frame = self._frame
+        if frame is not None and stamp == self._stamp:
+            self.stats['memory_hits'] += 1
+            return frame
+
+        with self._lock:
+            if self._frame is not None and stamp == self._stamp:
+                self.stats['memory_hits'] += 1
+                return self._frame
+
+            start = time.perf_counter()
+            meta = self._read_meta()
+            if meta is not None and meta['stamp'] == stamp:
+                frame = pd.read_feather(self.cache_path)
+                digest = meta['sha256']
+                self.stats['cache_loads'] += 1
+            else:
+                # The CSV was touched; only rebuild if its content changed
+                digest = file_sha256(self.source_path)
+                if meta is not None and meta['sha256'] == digest:
+                    frame = pd.read_feather(self.cache_path)
+                    meta['stamp'] = stamp
+                    self._write_meta(meta)
+                    self.stats['cache_loads'] += 1
+                else:
+                    frame = self._build(stamp, digest)
+                    self.stats['builds'] += 1
+            self.stats['last_seconds'] = time.perf_counter() - start
+
+            self._frame = frame
+            self._stamp = stamp
+            self.fingerprint = digest
+            return frame
+
+
+dataset = DatasetCache()
+
+
+def load_dataset():
+    return dataset.get()
+
+
+def n_pages(n_rows, page_size=DEFAULT_PAGE_SIZE):
+    return max(1, -(-n_rows // page_size))
+
+
+def page(data, page_number, page_size=DEFAULT_PAGE_SIZE):
+    """Rows of the 1-based page_number."""
+    start = (page_number - 1) * page_size
+    return data.iloc[start:start + page_size]
+
+
+def main():
+    cache = DatasetCache()
+    start = time.perf_counter()
+    data = cache._build(file_stamp(cache.source_path), file_sha256(cache.source_path))
+    print('Cached {:,} rows x {} columns to {} in {:.2f}s ({:.1f} MB in memory)'.format(
+        len(data), data.shape[1], cache.cache_path, time.perf_counter() - start,
+        data.memory_usage(deep=True).sum() / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""Input drift monitor for every scoring path.
+
+The training distribution of each model field is stored once in
+model/drift_profile.json, built from data/attrition_features.csv:
+
+    numeric fields       100 equi-depth bins on the training percentiles
+    categorical fields   one counter per training code
+
+Every scored row is counted into the same bins, so the live sketches take
+constant memory however many rows are scored, plus a counter for values
+outside the training codes and one for missing values. Rows are buffered
+and binned a batch at a time, so a single prediction only pays for
+appending to a list. Live counts are compared with the training profile by
+the population stability index on deciles of the bins and by the
+Kolmogorov-Smirnov distance between the binned distributions (exact at the
+bin edges, so a lower bound for the numeric fields).
+
+The prediction page, serve.py, the batch_scoring.py, streaming.py and
+incremental.py scripts, and the batch page (once per uploaded file, not on
+every rerun) feed the process-wide monitor. The training data scored for
+the cohort index is not counted. Set ATTRITION_DRIFT=0 to turn it off. To rebuild the profile after
+retraining:
+    python drift.py
+"""
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from features import FEATURE_FIELDS, INPUT_RANGES
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_PATH = os.path.join(BASE_DIR, 'model', 'drift_profile.json')
+PROFILE_DATA_PATH = os.path.join(BASE_DIR, 'data', 'attrition_features.csv')
+DRIFT_ENV = 'ATTRITION_DRIFT'
+
+NUMERIC_FIELDS = list(INPUT_RANGES)
+N_QUANTILES = 100
+
+# Buffered rows binned at once
+FLUSH_ROWS = 1024
+
+# Population stability index bands
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+# Floor of bin shares in the PSI, so empty bins do not divide by zero
+PSI_EPSILON = 1e-4
+
+
+def build_profile(data):
+    """Bin edges and training counts of every field of a frame of model codes."""
+    fields = {}
+    for field in FEATURE_FIELDS:
+        values = pd.to_numeric(data[field], errors='coerce').dropna().to_numpy(dtype=float)
+        if field in NUMERIC_FIELDS:
+            # Bin i holds edges[i - 1] < x <= edges[i]; the last bin is above the training maximum
+            edges = np.unique(np.percentile(values, np.linspace(0, 100, N_QUANTILES + 1)[1:]))
+            labels = None
+        else:
+            codes = np.unique(values)
+            # Midpoints between codes, so every code has a bin of its own
+            edges = np.append((codes[:-1] + codes[1:]) / 2, codes[-1])
+            labels = codes.tolist()
+        counts = np.bincount(np.searchsorted(edges, values, side='left'), minlength=len(edges) + 1)
+        fields[field] = {'kind': 'numeric' if labels is None else 'categorical', 'edges': edges.tolist(),
+                         'codes': labels, 'counts': counts.tolist()}
+    return {'source': os.path.relpath(PROFILE_DATA_PATH, BASE_DIR), 'rows': len(data), 'fields': fields}
+
+
+def load_profile(path=PROFILE_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def psi(expected, actual):
+    """Population stability index between two count vectors over the same bins."""
+    expected = np.maximum(expected / max(expected.sum(), 1), PSI_EPSILON)
+    actual = np.maximum(actual / max(actual.sum(), 1), PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def ks(expected, actual):
+    """Largest difference between the cumulative shares of two count vectors."""
+    expected = np.cumsum(expected) / max(expected.sum(), 1)
+    actual = np.cumsum(actual) / max(actual.sum(), 1)
+    return float(np.max(np.abs(actual - expected)))
+
+
+def _deciles(counts, training_counts):
+    # Merge the percentile bins into ten, by the training cumulative share
+    share = np.cumsum(training_counts) / max(training_counts.sum(), 1)
+    group = np.minimum((share * 10 - 1e-9).astype(int), 9)
+    return np.bincount(group, weights=counts, minlength=10)
+
+
+class DriftMonitor:
+    """Constant-memory counts of the scored model codes, by training bins."""
+
+    def __init__(self, profile=None, enabled=True):
+        self.enabled = enabled and profile is not None
+        self.profile = profile
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered = 0
+        if profile is None:
+            return
+        self._edges = [np.array(profile['fields'][field]['edges']) for field in FEATURE_FIELDS]
+        self._training = [np.array(profile['fields'][field]['counts'], dtype=float) for field in FEATURE_FIELDS]
+        self.reset()
+
+    @classmethod
+    def from_path(cls, path=PROFILE_PATH, enabled=True):
+        """A monitor for the stored profile; a disabled one when there is no profile."""
+        try:
+            profile = load_profile(path)
+        except (OSError, ValueError):
+            profile = None
+        return cls(profile, enabled)
+
+    def reset(self):
+        with self._lock:
+            self._buffer = []
+            self._buffered = 0
+            self.counts = [np.zeros(len(edges) + 1) for edges in self._edges]
+            self.unseen = np.zeros(len(FEATURE_FIELDS))
+            self.missing = np.zeros(len(FEATURE_FIELDS))
+            self.rows = 0
+
+    def observe(self, codes):
+        """Count rows of model codes ordered like FEATURE_FIELDS (an array or a list of them)."""
+        if not self.enabled:
+            return
+        codes = np.asarray(codes, dtype=float)
+        if codes.ndim == 1:
+            codes = codes.reshape(1, -1)
+        with self._lock:
+            self._buffer.append(codes)
+            self._buffered += len(codes)
+            if self._buffered < FLUSH_ROWS:
+                return
+            buffer, self._buffer, self._buffered = self._buffer, [], 0
+            self._count(np.concatenate(buffer) if len(buffer) > 1 else buffer[0])
+
+    def observe_frame(self, features):
+        """Count a frame with one column per field of FEATURE_FIELDS."""
+        if self.enabled:
+            self.observe(features[FEATURE_FIELDS].to_numpy(dtype=float))
+
+    def _count(self, codes):
+        # Called with the lock held
+        self.rows += len(codes)
+        for j, edges in enumerate(self._edges):
+            column = codes[:, j]
+            missing = np.isnan(column)
+            bins = np.searchsorted(edges, column[~missing], side='left')
+            self.counts[j] += np.bincount(bins, minlength=len(edges) + 1)
+            self.missing[j] += missing.sum()
+            if self.profile['fields'][FEATURE_FIELDS[j]]['kind'] == 'categorical':
+                known = np.isin(column[~missing], self.profile['fields'][FEATURE_FIELDS[j]]['codes'])
+                self.unseen[j] += (~known).sum()
+
+    def flush(self):
+        with self._lock:
+            if self._buffer:
+                buffer, self._buffer, self._buffered = self._buffer, [], 0
+                self._count(np.concatenate(buffer))
+
+    def report(self):
+        """One row per field: PSI, KS, status, and the live shares of unseen and missing values."""
+        if self.profile is None:
+            return pd.DataFrame()
+        self.flush()
+        rows = []
+        with self._lock:
+            for j, field in enumerate(FEATURE_FIELDS):
+                counts, training = self.counts[j], self._training[j]
+                kind = self.profile['fields'][field]['kind']
+                if kind == 'numeric':
+                    field_psi = psi(_deciles(training, training), _deciles(counts, training))
+                else:
+                    field_psi = psi(training, counts)
+                field_psi = field_psi if self.rows else 0.0
+                rows.append({
+                    'field': field,
+                    'kind': kind,
+                    'rows': int(counts.sum()),
+                    'psi': field_psi,
+                    'ks': ks(training, counts) if self.rows else 0.0,
+                    'status': 'no data' if not self.rows else 'significant' if field_psi >= PSI_SIGNIFICANT
+                    else 'moderate' if field_psi >= PSI_MODERATE else 'stable',
+                    'unseen_share': self.unseen[j] / self.rows if self.rows else 0.0,
+                    'missing_share': self.missing[j] / self.rows if self.rows else 0.0,
+                })
+        return pd.DataFrame(rows)
+
+    def gauges(self):
+        """{name: value} for metrics.py: the PSI and KS of every field."""
+        if self.profile is None:
+            return {}
+        report = self.report()
+        values = {'attrition_drift_rows': self.rows}
+        for row in report.itertuples():
+            values['attrition_drift_psi_' + row.field] = row.psi
+            values['attrition_drift_ks_' + row.field] = row.ks
+        return values
+
+
+monitor = DriftMonitor.from_path(enabled=metrics.env_flag(DRIFT_ENV, default=True))
+metrics.registry.add_collector(monitor.gauges)
+
+
+def main():
+    data = pd.read_csv(PROFILE_DATA_PATH)
+    profile = build_profile(data)
+    with open(PROFILE_PATH, 'w') as f:
+        json.dump(profile, f, indent=2)
+    print('Profiled {} fields over {:,} rows of {} -> {}'.format(
+        len(profile['fields']), len(data), os.path.basename(PROFILE_DATA_PATH), PROFILE_PATH))
+
+
+if __name__ == '__main__':
+    main()
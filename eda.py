@@ -0,0 +1,213 @@
+"""Attrition aggregates behind the charts of the Exploratory Data Analysis page.
+
+Every chart is a count of stayed and left employees per category of one
+field. All of them come out of a single np.bincount over the dataset: each
+field is mapped to integer bins, offset into one shared range and counted at
+once, weighted by the Attrition flag for the left counts. The result is a
+few hundred numbers however large the dataset, so the page only renders
+these small tables.
+
+The aggregates are cached in memory and in data/cache/eda_summary.json,
+keyed by the sha256 of the dataset. To rebuild them ahead of time:
+    python eda.py
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_access import CACHE_DIR, dataset
+from features import LABEL_CODES, SATISFACTION_CODES, raw_to_features
+
+
+SUMMARY_PATH = os.path.join(CACHE_DIR, 'eda_summary.json')
+
+# Bumped whenever the charts or their bins change
+SUMMARY_VERSION = 1
+
+INCOME_BIN_WIDTH = 1000
+INCOME_MAX = 20000
+TENURE_MAX = 40
+
+STAYED_COLOR = '#ccd5e8'
+LEFT_COLOR = '#3589c1'
+
+
+def _labels_by_code(mapping):
+    return {code: label for label, code in mapping.items()}
+
+
+def _category_chart(field, mapping):
+    # Codes in ascending order; each code gets its own bin
+    by_code = _labels_by_code(mapping)
+    codes = sorted(by_code)
+    return {
+        'field': field,
+        'offset': codes[0],
+        'width': 1,
+        'labels': [by_code[code] for code in codes],
+    }
+
+
+def _range_chart(field, low, high, width, label_format):
+    # Values above the last bin are counted in it, hence the "+"
+    edges = list(range(low, high + 1, width))
+    labels = [label_format(edge, width) for edge in edges[:-1]]
+    labels.append('{:,}+'.format(edges[-1]))
+    return {
+        'field': field,
+        'offset': low,
+        'width': width,
+        'labels': labels,
+    }
+
+
+CHARTS = {
+    'Gender': _category_chart('Gender', {"Female": 0, "Male": 1}),
+    'Age_Profile': _category_chart('Age_Profile', LABEL_CODES['Age_Profile']),
+    'JobLevel': _category_chart('JobLevel', LABEL_CODES['JobLevel']),
+    'MonthlyIncome': _range_chart('MonthlyIncome', 0, INCOME_MAX - INCOME_BIN_WIDTH, INCOME_BIN_WIDTH,
+                                  lambda edge, width: '{:,}-{:,}'.format(edge, edge + width - 1)),
+    'BusinessTravel': _category_chart('BusinessTravel', LABEL_CODES['BusinessTravel']),
+    'OverTime': _category_chart('OverTime', LABEL_CODES['OverTime']),
+    'WorkLifeBalance': _category_chart('WorkLifeBalance', LABEL_CODES['WorkLifeBalance']),
+    'TrainingTimesLastYear': _range_chart('TrainingTimesLastYear', 0, 6, 1, lambda edge, width: str(edge)),
+    'YearsAtCompany': _range_chart('YearsAtCompany', 0, TENURE_MAX, 1, lambda edge, width: str(edge)),
+    'EnvironmentSatisfaction': _category_chart('EnvironmentSatisfaction', SATISFACTION_CODES),
+    'JobSatisfaction': _category_chart('JobSatisfaction', SATISFACTION_CODES),
+}
+
+# Business travel is shown from none to frequent, not in code order
+CHARTS['BusinessTravel']['order'] = [3, 1, 2]
+
+
+def _bins(values, chart):
+    # Integer bin of each value within the chart, -1 when missing
+    n_bins = len(chart['labels'])
+    bins = np.floor((values - chart['offset']) / chart['width'])
+    bins = np.clip(bins, 0, n_bins - 1)
+    return np.where(np.isnan(values), -1, bins).astype(np.intp)
+
+
+def compute_summary(data):
+    """Return {chart: (labels, stayed, left)} for a frame in the raw CSV layout."""
+    features = raw_to_features(data)
+    left = (data['Attrition'].astype(str) == 'Yes').to_numpy(dtype=float)
+
+    names = list(CHARTS)
+    sizes = [len(CHARTS[name]['labels']) for name in names]
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+
+    # One (rows, charts) matrix of bins in a shared range, counted in one pass
+    bins = np.empty((len(data), len(names)), dtype=np.intp)
+    for j, name in enumerate(names):
+        chart_bins = _bins(features[CHARTS[name]['field']].to_numpy(dtype=float), CHARTS[name])
+        bins[:, j] = np.where(chart_bins < 0, offsets[-1], chart_bins + offsets[j])
+    total = np.bincount(bins.ravel(), minlength=offsets[-1] + 1)
+    n_left = np.bincount(bins.ravel(), weights=np.repeat(left, len(names)), minlength=offsets[-1] + 1)
+
+    summary = {'Attrition': (['Stayed', 'Left'], [int(len(data) - left.sum()), 0], [0, int(left.sum())])}
+    for j, name in enumerate(names):
+        chart_left = n_left[offsets[j]:offsets[j + 1]].astype(int)
+        chart_stayed = total[offsets[j]:offsets[j + 1]] - chart_left
+        labels = CHARTS[name]['labels']
+        order = range(len(labels))
+        if 'order' in CHARTS[name]:
+            order = [code - CHARTS[name]['offset'] for code in CHARTS[name]['order']]
+        summary[name] = ([labels[i] for i in order],
+                         [int(chart_stayed[i]) for i in order],
+                         [int(chart_left[i]) for i in order])
+    return summary
+
+
+def summary_table(summary, name):
+    labels, stayed, left = summary[name]
+    table = pd.DataFrame({'Stayed': stayed, 'Left': left}, index=pd.Index(labels, name=name))
+    total = table['Stayed'] + table['Left']
+    table['Attrition Rate'] = (table['Left'] / total.where(total > 0)).fillna(0.0)
+    return table
+
+
+class SummaryCache:
+    """Keep the aggregates of the current dataset in memory and on disk."""
+
+    def __init__(self, path=SUMMARY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._key = None
+        self._summary = None
+        self.last_seconds = 0.0
+
+    def _read(self, key):
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored.get('version') != SUMMARY_VERSION or stored.get('sha256') != key:
+            return None
+        return {name: tuple(value) for name, value in stored['charts'].items()}
+
+    def _write(self, key, summary):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': SUMMARY_VERSION, 'sha256': key, 'charts': summary}, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self):
+        data = dataset.get()
+        key = dataset.fingerprint
+        if self._summary is not None and key == self._key:
+            return self._summary
+
+        with self._lock:
+            if self._summary is None or key != self._key:
+                start = time.perf_counter()
+                summary = self._read(key)
+                if summary is None:
+                    summary = compute_summary(data)
+                    self._write(key, summary)
+                self._summary = summary
+                self._key = key
+                self.last_seconds = time.perf_counter() - start
+            return self._summary
+
+
+summaries = SummaryCache()
+
+
+def attrition_chart(table, label_angle=0):
+    """Stacked stayed/left bars in the order of the table index."""
+    import altair as alt
+
+    name = table.index.name
+    long_table = table.reset_index().melt(
+        id_vars=[name, 'Attrition Rate'], value_vars=['Stayed', 'Left'],
+        var_name='Status', value_name='Employees')
+    return alt.Chart(long_table).mark_bar().encode(
+        x=alt.X(name + ':N', sort=list(table.index), title=None, axis=alt.Axis(labelAngle=label_angle)),
+        y=alt.Y('Employees:Q', title=None),
+        color=alt.Color('Status:N', scale=alt.Scale(domain=['Stayed', 'Left'], range=[STAYED_COLOR, LEFT_COLOR]),
+                        legend=alt.Legend(title=None, orient='top')),
+        order=alt.Order('Status:N', sort='descending'),
+        tooltip=[name + ':N', 'Status:N', 'Employees:Q', alt.Tooltip('Attrition Rate:Q', format='.1%')],
+    )
+
+
+def main():
+    from data_access import DATASET_PATH
+
+    start = time.perf_counter()
+    data = dataset.get()
+    summary = compute_summary(data)
+    summaries._write(dataset.fingerprint, summary)
+    print('Aggregated {:,} rows of {} into {} charts in {:.2f}s -> {}'.format(
+        len(data), os.path.basename(DATASET_PATH), len(summary), time.perf_counter() - start, SUMMARY_PATH))
+
+
+if __name__ == '__main__':
+    main()
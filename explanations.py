@@ -0,0 +1,71 @@
+"""Tables and charts of the feature contributions behind a prediction.
+
+Contributions are the exact TreeSHAP attributions of the model's log-odds of
+leaving, summed per field (see tree_engine and LoadedModel.explain). For one
+employee they add up, together with the expected value, to the log-odds of
+the prediction.
+"""
+import numpy as np
+import pandas as pd
+
+from eda import LEFT_COLOR, STAYED_COLOR
+from features import FEATURE_FIELDS
+
+
+FIELD_LABELS = {
+    'Gender': 'Gender',
+    'Age_Profile': 'Age',
+    'JobLevel': 'Position',
+    'MonthlyIncome': 'Monthly Income',
+    'BusinessTravel': 'Business Travel',
+    'OverTime': 'Overtime',
+    'WorkLifeBalance': 'Work-Life Balance',
+    'JobSatisfaction': 'Job Satisfaction',
+    'EnvironmentSatisfaction': 'Environment Satisfaction',
+    'TrainingTimesLastYear': 'Training Last Year',
+    'YearsAtCompany': 'Tenure',
+}
+
+
+def contribution_table(contributions):
+    """Contributions of one employee, largest effect first."""
+    table = pd.DataFrame({
+        'Feature': [FIELD_LABELS[field] for field in FEATURE_FIELDS],
+        'Contribution': np.asarray(contributions, dtype=float),
+    })
+    table['Effect'] = np.where(table['Contribution'] > 0, 'Raises risk', 'Lowers risk')
+    order = table['Contribution'].abs().sort_values(ascending=False).index
+    return table.loc[order].reset_index(drop=True)
+
+
+def importance_table(attributions):
+    """Mean absolute contribution of each field over many employees."""
+    table = pd.DataFrame({
+        'Feature': [FIELD_LABELS[field] for field in FEATURE_FIELDS],
+        'Mean |Contribution|': np.abs(np.asarray(attributions, dtype=float)).mean(axis=0),
+    })
+    return table.sort_values('Mean |Contribution|', ascending=False).reset_index(drop=True)
+
+
+def contribution_chart(table):
+    """Horizontal bars, risk-raising contributions in the color of leavers."""
+    import altair as alt
+
+    return alt.Chart(table).mark_bar().encode(
+        x=alt.X('Contribution:Q', title='Contribution to the log-odds of leaving'),
+        y=alt.Y('Feature:N', sort=list(table['Feature']), title=None),
+        color=alt.Color('Effect:N', scale=alt.Scale(domain=['Raises risk', 'Lowers risk'],
+                                                    range=[LEFT_COLOR, STAYED_COLOR]),
+                        legend=alt.Legend(title=None, orient='top')),
+        tooltip=['Feature:N', alt.Tooltip('Contribution:Q', format='+.3f')],
+    )
+
+
+def importance_chart(table):
+    import altair as alt
+
+    return alt.Chart(table).mark_bar(color=LEFT_COLOR).encode(
+        x=alt.X('Mean |Contribution|:Q', title='Mean absolute contribution to the log-odds of leaving'),
+        y=alt.Y('Feature:N', sort=list(table['Feature']), title=None),
+        tooltip=['Feature:N', alt.Tooltip('Mean |Contribution|:Q', format='.3f')],
+    )
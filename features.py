@@ -0,0 +1,213 @@
+"""Feature mappings shared by the app and the batch scoring tools.
+
+The codes follow notebooks/1_ds_project_EDA.ipynb, which produced the
+training data in data/attrition_features*.csv.
+"""
+import numpy as np
+import pandas as pd
+
+
+# Model inputs, in the order the prediction page collects them
+FEATURE_FIELDS = [
+    'Gender',
+    'Age_Profile',
+    'JobLevel',
+    'MonthlyIncome',
+    'BusinessTravel',
+    'OverTime',
+    'WorkLifeBalance',
+    'JobSatisfaction',
+    'EnvironmentSatisfaction',
+    'TrainingTimesLastYear',
+    'YearsAtCompany',
+]
+
+# Fields that were one-hot encoded before training
+ONE_HOT_FIELDS = ['Age_Profile', 'BusinessTravel']
+
+# Raw HR export values -> model codes
+GENDER_CODES = {'Female': 0, 'Male': 1}
+OVERTIME_CODES = {'No': 0, 'Yes': 1}
+BUSINESS_TRAVEL_CODES = {'Travel_Rarely': 1, 'Travel_Frequently': 2, 'Non-Travel': 3}
+
+# Age_Profile 1-4: Young Adult (18-25), Adult (26-44), Middle-age (45-59), Old age (60+)
+AGE_PROFILE_BINS = [17, 25, 44, 59, np.inf]
+
+# Below this many rows the encoder gathers all columns at once
+SMALL_BATCH_ROWS = 64
+
+SATISFACTION_CODES = {"Low": 1, "Medium": 2, "High": 3, "Very High": 4}
+
+# Prediction page labels -> model codes, in the order the options are shown
+LABEL_CODES = {
+    'Gender': {"Male": 1, "Female": 0},
+    'Age_Profile': {"Young Adult (18-25)": 1, "Adult (26-44)": 2, "Middle-age (45-59)": 3, "Old age (60+)": 4},
+    'JobLevel': {"Entry-Level": 1, "Junior": 2, "Middle": 3, "Senior": 4, "Executive": 5},
+    'BusinessTravel': {"Rarely": 1, "Frequently": 2, "Non-Travel": 3},
+    'OverTime': {"No": 0, "Yes": 1},
+    'WorkLifeBalance': {"Bad": 1, "Good": 2, "Better": 3, "Best": 4},
+    'JobSatisfaction': SATISFACTION_CODES,
+    'EnvironmentSatisfaction': SATISFACTION_CODES,
+    'TrainingTimesLastYear': {"None": 0, "1-2": 1, "3-4": 2, "5-6": 3, "7-8": 4, "9-10": 5, "More than 10": 6},
+}
+
+
+# Bounds of the numeric inputs on the prediction page
+INPUT_RANGES = {
+    'MonthlyIncome': (1009, 19999),
+    'YearsAtCompany': (0, 40),
+}
+
+
+def clean_column_names(data):
+    # The IBM export starts with a UTF-8 byte order mark, which shows up as
+    # part of the first header when the file is read as ISO-8859-1
+    data.columns = [str(col).replace('\u00ef\u00bb\u00bf', '').replace('\ufeff', '').strip()
+                    for col in data.columns]
+    return data
+
+
+def _codes(column, mapping):
+    # Text columns may be object or categorical (see data_access)
+    if not pd.api.types.is_numeric_dtype(column):
+        return column.map(mapping).astype(float)
+    return pd.to_numeric(column, errors='coerce').astype(float)
+
+
+def missing_columns(data):
+    """The model fields raw_to_features cannot find in a frame (Age stands in for Age_Profile)."""
+    return [field for field in FEATURE_FIELDS
+            if field not in data and not (field == 'Age_Profile' and 'Age' in data)]
+
+
+def raw_to_features(data):
+    """Map a frame in the IBM_HR-Attrition.csv layout to the model fields.
+
+    Frames that already hold the coded fields (e.g. data/attrition_features.csv)
+    are passed through. Unknown or missing values become NaN.
+    """
+    missing = missing_columns(data)
+    if missing:
+        raise ValueError('Missing columns: {}'.format(', '.join(missing)))
+
+    features = pd.DataFrame(index=data.index)
+
+    for field in FEATURE_FIELDS:
+        if field == 'Age_Profile' and 'Age_Profile' not in data and 'Age' in data:
+            age = pd.to_numeric(data['Age'], errors='coerce')
+            features[field] = pd.cut(age, bins=AGE_PROFILE_BINS, labels=[1, 2, 3, 4]).astype(float)
+        elif field == 'Gender':
+            features[field] = _codes(data[field], GENDER_CODES)
+        elif field == 'OverTime':
+            features[field] = _codes(data[field], OVERTIME_CODES)
+        elif field == 'BusinessTravel':
+            features[field] = _codes(data[field], BUSINESS_TRAVEL_CODES)
+        else:
+            features[field] = pd.to_numeric(data[field], errors='coerce').astype(float)
+
+    return features
+
+
+class FeatureEncoder:
+    """Encode coded model fields into the column layout of training_cols.csv.
+
+    The mapping from each training column to its source field is compiled once,
+    so encoding is a single gather plus an equality test for the one-hot
+    columns, written into a preallocated array for any number of rows.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.n_columns = len(self.columns)
+
+        field_index = []
+        match_code = []
+        for col in self.columns:
+            if col in FEATURE_FIELDS:
+                field_index.append(FEATURE_FIELDS.index(col))
+                match_code.append(np.nan)
+            else:
+                # e.g. BusinessTravel_2 -> BusinessTravel == 2
+                field, _, code = col.rpartition('_')
+                if field not in ONE_HOT_FIELDS:
+                    raise ValueError('Unknown training column: {}'.format(col))
+                field_index.append(FEATURE_FIELDS.index(field))
+                match_code.append(float(code))
+
+        self._field_index = np.array(field_index, dtype=np.intp)
+        self._one_hot = np.flatnonzero(~np.isnan(match_code))
+        self._one_hot_codes = np.array(match_code)[self._one_hot]
+        self._plan = [(i, None if np.isnan(code) else code)
+                      for i, code in zip(field_index, match_code)]
+        one_hot_fields = self._field_index[self._one_hot]
+        self._one_hot_groups = [self._one_hot[one_hot_fields == i] for i in np.unique(one_hot_fields)]
+
+        self._label_tables = [LABEL_CODES.get(field, {}) for field in FEATURE_FIELDS]
+
+    def empty(self, n_rows):
+        # Column-major, so each training column is written contiguously
+        return np.empty((n_rows, self.n_columns), order='F')
+
+    def transform(self, values, out=None):
+        """Encode an (n_rows, 11) array of codes ordered like FEATURE_FIELDS."""
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values.reshape(1, -1)
+        if out is None:
+            out = self.empty(len(values))
+
+        if len(values) <= SMALL_BATCH_ROWS:
+            # A single gather has the least call overhead for a few rows
+            np.take(values, self._field_index, axis=1, out=out)
+            matched = out[:, self._one_hot] == self._one_hot_codes
+            out[:, self._one_hot] = matched
+        else:
+            for j, (i, code) in enumerate(self._plan):
+                if code is None:
+                    out[:, j] = values[:, i]
+                else:
+                    np.equal(values[:, i], code, out=out[:, j])
+            matched = out[:, self._one_hot]
+
+        # A missing or unknown code matches no column of its field (and a valid
+        # one exactly one); its columns are left NaN for the imputer rather
+        # than encoding no category at all
+        if np.count_nonzero(matched) < len(out) * len(self._one_hot_groups):
+            for group in self._one_hot_groups:
+                unmatched = out[:, group].sum(axis=1) == 0
+                out[np.ix_(unmatched, group)] = np.nan
+        return out
+
+    def transform_frame(self, features, out=None):
+        return self.transform(features[FEATURE_FIELDS].to_numpy(dtype=float), out)
+
+    def codes(self, inputs):
+        """Map one employee's inputs (page labels or codes) to a row of codes."""
+        row = []
+        for field, table in zip(FEATURE_FIELDS, self._label_tables):
+            value = inputs.get(field)
+            if isinstance(value, str):
+                value = table.get(value)
+            row.append(np.nan if value is None else float(value))
+        return row
+
+    def transform_labels(self, inputs, out=None):
+        return self.transform([self.codes(inputs)], out)
+
+    def field_columns(self, field):
+        """Indices of the training columns encoded from a field."""
+        return np.flatnonzero(self._field_index == FEATURE_FIELDS.index(field))
+
+    def field_totals(self, column_values):
+        """Sum per-column values (e.g. attributions) back onto FEATURE_FIELDS.
+
+        The one-hot columns of a field add up to the field, so the result has
+        one column per field, ordered like FEATURE_FIELDS.
+        """
+        column_values = np.asarray(column_values, dtype=float)
+        if column_values.ndim == 1:
+            column_values = column_values.reshape(1, -1)
+        totals = np.zeros((len(column_values), len(FEATURE_FIELDS)))
+        for j, i in enumerate(self._field_index):
+            totals[:, i] += column_values[:, j]
+        return totals
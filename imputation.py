@@ -0,0 +1,93 @@
+"""Median imputation fitted once on the training data.
+
+The medians of the training split of train.py (not the holdout) are stored in
+model/imputer.json next to the model, so inference only has to fill the gaps
+instead of fitting an imputer on the rows being scored. A missing or unknown
+BusinessTravel or Age_Profile is encoded as NaN in all of its one-hot columns
+and filled with the one-hot of the field's median code. To refit after
+retraining:
+    python imputation.py
+"""
+import json
+import os
+
+import numpy as np
+
+from features import ONE_HOT_FIELDS
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMPUTER_PATH = os.path.join(BASE_DIR, 'model', 'imputer.json')
+TRAINING_DATA_PATH = os.path.join(BASE_DIR, 'data', 'attrition_features_ohe.csv')
+
+
+class MedianImputer:
+    """Fill missing values with the training median of each column."""
+
+    def __init__(self, columns, medians):
+        self.columns = list(columns)
+        self.medians = np.asarray(medians, dtype=float)
+
+    @classmethod
+    def fit(cls, data, columns):
+        medians = data[columns].median()
+        # A one-hot field gets the one-hot of its median code, so a missing
+        # value is filled with a category instead of none or several
+        for field in ONE_HOT_FIELDS:
+            group = [col for col in columns if col.rpartition('_')[0] == field]
+            if not group:
+                continue
+            codes = np.array([float(col.rpartition('_')[2]) for col in group])
+            field_codes = data[group].to_numpy(dtype=float) @ codes
+            median = np.percentile(field_codes, 50, method='lower')
+            medians[group] = (codes == median).astype(float)
+        return cls(columns, medians.to_numpy(dtype=float))
+
+    @classmethod
+    def load(cls, path=IMPUTER_PATH):
+        with open(path) as f:
+            params = json.load(f)
+        return cls(params['columns'], params['medians'])
+
+    def save(self, path=IMPUTER_PATH):
+        params = {
+            'strategy': 'median',
+            'source': os.path.relpath(TRAINING_DATA_PATH, BASE_DIR),
+            'columns': self.columns,
+            'medians': self.medians.tolist(),
+        }
+        with open(path, 'w') as f:
+            json.dump(params, f, indent=2)
+
+    def transform(self, X, has_missing=None):
+        """Return X with NaNs replaced; X is returned as is when nothing is missing.
+
+        Pass has_missing=False when the caller already validated the input to
+        skip the NaN scan altogether.
+        """
+        if has_missing is False:
+            return X
+
+        missing = np.isnan(X)
+        if not missing.any():
+            return X
+
+        rows, cols = np.nonzero(missing)
+        X = X.copy()
+        X[rows, cols] = self.medians[cols]
+        return X
+
+
+def main():
+    from model_registry import read_training_columns
+    from train import load_training_data
+
+    columns = read_training_columns()
+    X_train = load_training_data()[0]
+    imputer = MedianImputer.fit(X_train, columns)
+    imputer.save()
+    print('Saved medians for {} columns to {}'.format(len(columns), IMPUTER_PATH))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""Exact lookup table of the attrition probability over the prediction page inputs.
+
+Every input on the prediction page is a radio button, except MonthlyIncome
+and YearsAtCompany, which are integers within INPUT_RANGES. The trees only
+compare each input with a finite set of thresholds, so the values of a field
+that fall between the same thresholds always give the same prediction. Each
+field's values are grouped into these bins, one representative of every
+combination of bins is scored with the compiled trees, and the probabilities
+are stored as one float32 array in C order:
+
+    model/lookup/
+        manifest.json    bins of every field, shape, model fingerprint
+        proba.npy        probability of leaving of every cell
+
+A query maps each input to its bin with one array lookup, so answering it
+does not depend on the size of the model. The answers are the probabilities
+of the compiled trees rounded to float32 (within 3e-8); a cell within
+FALLBACK_MARGIN of 0.5 is stored as NaN and answered by the model instead,
+so the predicted class is always the model's. Every cell is also checked
+against the pickled model while the table is built. The table is ignored
+once the model it was built for is replaced, and picked up when it is
+(re)built while the app is running.
+
+The number of cells grows with the thresholds of the model: 192 (768 bytes)
+for the notebook model, whose thresholds are in MinMaxScaler units, but
+120,766,464 (483 MB) for a model trained on unscaled inputs. A query saves
+about 9 us of a 23 us prediction, which only matters to deployments that
+answer many single predictions. So the table is not kept in git, and only
+used when ATTRITION_LOOKUP=1 is set. To build it after retraining:
+    python lookup.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from features import FEATURE_FIELDS, INPUT_RANGES, LABEL_CODES
+from tree_engine import TOLERANCE
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOOKUP_PATH = os.path.join(BASE_DIR, 'model', 'lookup')
+MANIFEST_NAME = 'manifest.json'
+TABLE_NAME = 'proba.npy'
+LOOKUP_ENV = 'ATTRITION_LOOKUP'
+
+# Bumped whenever the layout of the table or the manifest changes
+FORMAT_VERSION = 3
+
+# Cells this close to 0.5 are left to the model, so rounding to float32
+# (at most 3e-8) can never change the predicted class
+FALLBACK_MARGIN = 1e-6
+
+# Cells scored (and verified) per step while building
+BUILD_ROWS = 1 << 20
+
+# Random page inputs (not bin representatives) checked after building
+CHECK_SAMPLES = 100000
+
+
+def table_stamp(path=LOOKUP_PATH):
+    """(mtime, size) of the manifest, or None without a table; changes whenever a table is built."""
+    try:
+        info = os.stat(os.path.join(path, MANIFEST_NAME))
+    except OSError:
+        return None
+    return info.st_mtime_ns, info.st_size
+
+
+def field_domain(field):
+    """Every value the prediction page can send for a field."""
+    if field in INPUT_RANGES:
+        low, high = INPUT_RANGES[field]
+        return np.arange(low, high + 1, dtype=float)
+    return np.array(sorted(set(LABEL_CODES[field].values())), dtype=float)
+
+
+def engine_fingerprint(engine):
+    digest = hashlib.sha256()
+    for array in [engine.feature, engine.threshold, engine.leaves]:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(json.dumps([engine.init_score, engine.link, engine.classes.tolist()]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def field_bins(engine, encoder, field):
+    """Group a field's values by the outcome of every split on its columns.
+
+    Returns (values, bin of each value, representative value of each bin).
+    """
+    values = field_domain(field)
+    codes = np.zeros((len(values), len(FEATURE_FIELDS)))
+    codes[:, FEATURE_FIELDS.index(field)] = values
+    encoded = encoder.transform(codes).astype(np.float32)
+
+    # The number of thresholds below a value fixes every split on the column
+    signature = [np.zeros(len(values), dtype=np.intp)]
+    for j in encoder.field_columns(field):
+        thresholds = np.unique(engine.threshold[(engine.feature == j) & np.isfinite(engine.threshold)])
+        signature.append(np.searchsorted(thresholds, encoded[:, j], side='left'))
+    _, first, bins = np.unique(np.stack(signature, axis=1), axis=0, return_index=True, return_inverse=True)
+
+    # Number the bins by their smallest value
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return values, rank[bins.ravel()], values[first[order]]
+
+
+class LookupTable:
+    """Probability of leaving for every combination of input bins."""
+
+    def __init__(self, proba, manifest):
+        self.proba = proba
+        self.manifest = manifest
+        self.shape = tuple(manifest['shape'])
+        self.fingerprint = manifest['fingerprint']
+        # Per field: the smallest value and the bin of every value from there
+        self._low = []
+        self._bins = []
+        for entry in manifest['fields']:
+            self._low.append(int(entry['low']))
+            self._bins.append(np.array(entry['bins'], dtype=np.intp))
+
+    @classmethod
+    def load(cls, path=LOOKUP_PATH, mmap_mode='r'):
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError('{} has lookup format {}, expected {}'.format(
+                path, manifest.get('format_version'), FORMAT_VERSION))
+        proba = np.load(os.path.join(path, TABLE_NAME), mmap_mode=mmap_mode, allow_pickle=False)
+        if proba.shape != (int(np.prod(manifest['shape'])),) or proba.dtype != np.float32:
+            raise ValueError('{} does not match its manifest'.format(path))
+        return cls(proba, manifest)
+
+    def cell(self, codes):
+        """Flat index of a row of codes ordered like FEATURE_FIELDS, or None outside the table."""
+        index = 0
+        for value, low, bins, size in zip(codes, self._low, self._bins, self.shape):
+            if value != value or value != int(value):
+                return None
+            offset = int(value) - low
+            if offset < 0 or offset >= len(bins) or bins[offset] < 0:
+                return None
+            index = index * size + bins[offset]
+        return index
+
+    def predict_proba(self, codes):
+        """(1, 2) probabilities for one row of codes, or None outside the table or near 0.5."""
+        index = self.cell(codes)
+        if index is None:
+            return None
+        proba = float(self.proba[index])
+        if proba != proba:
+            return None
+        return np.array([[1.0 - proba, proba]])
+
+
+def load_for(engine, path=LOOKUP_PATH):
+    """The table built for this engine, or None if there is no such table."""
+    if engine is None or not os.path.exists(os.path.join(path, MANIFEST_NAME)):
+        return None
+    try:
+        table = LookupTable.load(path)
+    except (OSError, ValueError):
+        return None
+    if table.fingerprint != engine_fingerprint(engine):
+        return None
+    return table
+
+
+def check(table, loaded_model, reference, n_samples=CHECK_SAMPLES, random_state=0):
+    """Compare the table with the compiled trees and the reference model on random page inputs.
+
+    The cells are checked with their representatives while building; this
+    checks that every other value of a bin is answered the same.
+    """
+    rng = np.random.RandomState(random_state)
+    codes = np.column_stack([rng.choice(field_domain(field), n_samples) for field in FEATURE_FIELDS])
+    proba = np.array([table.proba[table.cell(row)] for row in codes])
+    encoded = loaded_model.encoder.transform(codes)
+    compiled = loaded_model.engine.predict_proba(encoded)[:, 1]
+    if np.any(proba != _stored(compiled)):
+        raise ValueError('Table differs from the compiled trees between thresholds')
+    return _compare(compiled, reference.predict_proba(encoded))
+
+
+def _stored(proba):
+    # The float32 cells of the table, NaN where the model answers
+    return np.where(np.abs(proba - 0.5) <= FALLBACK_MARGIN, np.nan, proba).astype(np.float32)
+
+
+def _compare(proba, expected):
+    # Largest difference of the compiled trees from the reference model
+    diff = float(np.max(np.abs(proba - expected[:, 1])))
+    if diff > TOLERANCE:
+        raise ValueError('Table differs from the model by {:.3g}'.format(diff))
+    # The predicted class must not change either
+    if np.any((proba > 0.5) != (expected[:, 1] > expected[:, 0])):
+        raise ValueError('Table changes the predicted class of a cell')
+    return diff
+
+
+def build(loaded_model, reference=None, path=LOOKUP_PATH, block_rows=BUILD_ROWS):
+    """Score every cell with the compiled trees and check it against reference.
+
+    reference is any model with predict_proba (the pickled sklearn model by
+    default in main()). Returns the manifest of the table.
+    """
+    engine = loaded_model.engine
+    encoder = loaded_model.encoder
+    if engine is None:
+        raise ValueError('The model cannot be compiled, so it cannot be tabulated')
+
+    fields = []
+    representatives = []
+    for field in FEATURE_FIELDS:
+        values, bins, reps = field_bins(engine, encoder, field)
+        low = int(values[0])
+        by_value = np.full(int(values[-1]) - low + 1, -1, dtype=np.intp)
+        by_value[values.astype(np.intp) - low] = bins
+        fields.append({'field': field, 'low': low, 'bins': by_value.tolist(),
+                       'representatives': reps.tolist()})
+        representatives.append(reps)
+    shape = [len(reps) for reps in representatives]
+    n_cells = int(np.prod(shape))
+
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    table = np.lib.format.open_memmap(os.path.join(tmp_path, TABLE_NAME), mode='w+',
+                                      dtype=np.float32, shape=(n_cells,))
+
+    max_diff = 0.0
+    codes = np.empty((min(block_rows, n_cells), len(FEATURE_FIELDS)))
+    for start in range(0, n_cells, block_rows):
+        stop = min(start + block_rows, n_cells)
+        block = codes[:stop - start]
+        for i, index in enumerate(np.unravel_index(np.arange(start, stop), shape)):
+            np.take(representatives[i], index, out=block[:, i])
+        encoded = encoder.transform(block)
+        proba = engine.predict_proba(encoded)[:, 1]
+        table[start:stop] = _stored(proba)
+        if reference is not None:
+            max_diff = max(max_diff, _compare(proba, reference.predict_proba(encoded)))
+    n_fallback = int(np.isnan(table).sum())
+    table.flush()
+    del table
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'fingerprint': engine_fingerprint(engine),
+        'fields': fields,
+        'shape': shape,
+        'n_cells': n_cells,
+        'dtype': 'float32',
+        'fallback_margin': FALLBACK_MARGIN,
+        'n_fallback': n_fallback,
+        'verified': reference is not None,
+        'max_diff': max_diff,
+    }
+    if reference is not None:
+        manifest['max_diff'] = max(max_diff, check(LookupTable(
+            np.load(os.path.join(tmp_path, TABLE_NAME), mmap_mode='r'), manifest), loaded_model, reference))
+    with open(os.path.join(tmp_path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+    return manifest
+
+
+def main():
+    import pickle
+
+    from model_registry import MODEL_PATH, get_model
+
+    parser = argparse.ArgumentParser(description='Tabulate the model over every prediction page input.')
+    parser.add_argument('-o', '--output', default=LOOKUP_PATH, help='table directory to write')
+    parser.add_argument('--reference', default=MODEL_PATH,
+                        help='pickled model every cell is checked against (default: %(default)s)')
+    parser.add_argument('--no-verify', action='store_true', help='skip the check against the reference')
+    args = parser.parse_args()
+
+    reference = None
+    if not args.no_verify:
+        with open(args.reference, 'rb') as f:
+            reference = pickle.load(f)
+
+    start = time.perf_counter()
+    manifest = build(get_model(), reference, args.output)
+    print('Tabulated {:,} cells ({}) in {:.0f}s -> {} ({:.3g} MB)'.format(
+        manifest['n_cells'], ' x '.join(str(n) for n in manifest['shape']), time.perf_counter() - start,
+        args.output, manifest['n_cells'] * np.dtype(np.float32).itemsize / 1e6))
+    print('{:,} cells within {:g} of 0.5 are left to the model'.format(
+        manifest['n_fallback'], manifest['fallback_margin']))
+    if manifest['verified']:
+        print('Every cell matches {} (max |diff| {:.3g})'.format(
+            os.path.basename(args.reference), manifest['max_diff']))
+
+
+if __name__ == '__main__':
+    main()
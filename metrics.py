@@ -0,0 +1,234 @@
+"""Hot-path timers, counters and latency histograms.
+
+Instrumentation is off unless the process is started with
+
+    ATTRITION_METRICS=1 streamlit run app.py
+
+and until then every timer and counter below is a no-op that returns at
+once. When it is on:
+
+    with metrics.timer('attrition_stage_seconds', stage='encode'):
+        ...
+    metrics.count('attrition_cache_requests_total', cache='lookup', result='hit')
+
+Durations go into histograms with fixed, doubling buckets (10 us to about
+3 min), so recording is O(1) and percentiles are read off the buckets. All
+metrics can be rendered in the Prometheus text format: app.py has a hidden
+diagnostics page (open it with ?diagnostics=1), serve.py serves GET
+/metrics, and with ATTRITION_METRICS_FILE set the app also keeps a copy in
+that file for the node_exporter textfile collector.
+"""
+import bisect
+import os
+import threading
+import time
+
+
+METRICS_ENV = 'ATTRITION_METRICS'
+METRICS_FILE_ENV = 'ATTRITION_METRICS_FILE'
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = [1e-5 * 2 ** i for i in range(25)]
+
+# Least time between two writes of the metrics file
+WRITE_INTERVAL = 10.0
+
+
+def env_flag(name, default=False):
+    """Whether an ATTRITION_* switch is on: unset means default, 0/false/no mean off."""
+    value = os.environ.get(name, '').lower()
+    if not value:
+        return default
+    return value not in ('0', 'false', 'no')
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum and maximum."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Estimate of the q-th percentile, interpolated within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = BUCKETS[i - 1] if i > 0 else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, key):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe_key(self.key, time.perf_counter() - self.start)
+        return False
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Metrics:
+    """A set of counters and histograms, shared by every thread of the process."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        # Callables returning {name: value}, read at export time
+        self._collectors = []
+        self.started_at = time.time()
+        self._written_at = 0.0
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, _key(name, labels))
+
+    def observe(self, name, seconds, **labels):
+        if self.enabled:
+            self.observe_key(_key(name, labels), seconds)
+
+    def observe_key(self, key, seconds):
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def add_collector(self, collect):
+        """Export the values of collect() as gauges; they are read even when disabled."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started_at = time.time()
+
+    def hit_rates(self, name='attrition_cache_requests_total'):
+        """{cache: (hits, requests)} from a counter labelled with cache and result."""
+        rates = {}
+        with self._lock:
+            for (counter, labels), value in self.counters.items():
+                labels = dict(labels)
+                if counter != name or 'cache' not in labels:
+                    continue
+                hits, requests = rates.get(labels['cache'], (0, 0))
+                rates[labels['cache']] = (hits + value * (labels.get('result') == 'hit'), requests + value)
+        return rates
+
+    def histogram_rows(self, percentiles=(50, 90, 99)):
+        """One dict per histogram: name, labels, count, mean, percentiles and max, in ms."""
+        rows = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                row = {'metric': name, 'labels': ', '.join('{}={}'.format(k, v) for k, v in labels),
+                       'count': histogram.count, 'mean_ms': histogram.sum / histogram.count * 1e3}
+                for q in percentiles:
+                    row['p{}_ms'.format(q)] = histogram.percentile(q) * 1e3
+                row['max_ms'] = histogram.max * 1e3
+                rows.append(row)
+        return rows
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+            collectors = list(self._collectors)
+
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                lines.append('# TYPE {} counter'.format(name))
+                declared.add(name)
+            lines.append('{}{} {}'.format(name, _labels(labels), value))
+        for (name, labels), histogram in histograms:
+            if name not in declared:
+                lines.append('# TYPE {} histogram'.format(name))
+                declared.add(name)
+            cumulative = 0
+            for bound, n in zip(BUCKETS + [float('inf')], histogram.counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else '{:.6g}'.format(bound)
+                lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', le),)), cumulative))
+            lines.append('{}_sum{} {!r}'.format(name, _labels(labels), histogram.sum))
+            lines.append('{}_count{} {}'.format(name, _labels(labels), histogram.count))
+        for collect in collectors:
+            for name, value in sorted(collect().items()):
+                if name not in declared:
+                    lines.append('# TYPE {} gauge'.format(name))
+                    declared.add(name)
+                lines.append('{} {!r}'.format(name, float(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+        self._written_at = time.time()
+
+    def maybe_write_textfile(self):
+        """Write the file named by ATTRITION_METRICS_FILE, at most every WRITE_INTERVAL seconds."""
+        path = os.environ.get(METRICS_FILE_ENV)
+        if self.enabled and path and time.time() - self._written_at >= WRITE_INTERVAL:
+            self.write_textfile(path)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+registry = Metrics(env_flag(METRICS_ENV))
+
+timer = registry.timer
+observe = registry.observe
+count = registry.count
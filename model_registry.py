@@ -0,0 +1,265 @@
+"""Process-wide cache for the attrition model and the artifacts saved with it.
+
+Streamlit re-executes app.py on every widget interaction, but imported modules
+are kept in memory for the lifetime of the server process, so the registry
+below is shared by every session. The model is only loaded again when the
+content of the artifacts on disk changes.
+
+The model bundle in model/gbm_bundle (see artifacts.py) is preferred: it is
+memory-mapped and needs neither pickle nor scikit-learn. The pickled model in
+model/model_gbm.pkl is only loaded when there is no bundle. When the bundle
+was not converted from the model_gbm.pkl and training_cols.csv on disk (a
+retrained model that was not converted) it is still the one served, with a
+warning to run python artifacts.py.
+"""
+import csv
+import hashlib
+import os
+import json
+import pickle
+import threading
+import time
+import warnings
+
+import artifacts
+import lookup
+import metrics
+from features import FeatureEncoder
+from imputation import IMPUTER_PATH, MedianImputer
+from tree_engine import compile_model
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_DIR, 'model', 'model_gbm.pkl')
+COLUMNS_PATH = os.path.join(BASE_DIR, 'model', 'training_cols.csv')
+LOOKUP_ENABLED = metrics.env_flag(lookup.LOOKUP_ENV)
+
+
+def read_training_columns(path=COLUMNS_PATH):
+    # training_cols.csv is a single column with the header "0"
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    return [row[0] for row in rows[1:] if row]
+
+
+class LoadedModel:
+    """A loaded model together with the schema it expects."""
+
+    def __init__(self, model, columns, imputer, fingerprint, load_seconds):
+        self.model = model
+        self.columns = columns
+        self.encoder = FeatureEncoder(columns)
+        self.imputer = imputer
+        # Flattened trees for fast scoring; None if the model cannot be compiled
+        self.engine = compile_model(model)
+        self.fingerprint = fingerprint
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self._lookup = None
+        self._lookup_stamp = None
+
+    def predict_proba(self, X):
+        if self.engine is not None and self.engine.is_faster(len(X)):
+            return self.engine.predict_proba(X)
+        return self.model.predict_proba(X)
+
+    def predict(self, X):
+        proba = self.predict_proba(X)
+        return self.model.classes_.take(proba.argmax(axis=1))
+
+    def lookup_table(self):
+        """The precomputed table of this model (see lookup.py), or None if there is none."""
+        # Checked on every call, so a table built while the app runs is picked up
+        stamp = lookup.table_stamp()
+        if stamp != self._lookup_stamp:
+            self._lookup = lookup.load_for(self.engine) if stamp is not None else None
+            self._lookup_stamp = stamp
+        return self._lookup
+
+    def predict_proba_codes(self, codes):
+        """Probabilities for one row of codes from the table, or None when it cannot answer.
+
+        Always None unless the table is turned on with ATTRITION_LOOKUP=1.
+        """
+        if not LOOKUP_ENABLED:
+            return None
+        table = self.lookup_table()
+        proba = None if table is None else table.predict_proba(codes)
+        metrics.count('attrition_cache_requests_total', cache='lookup', result='miss' if proba is None else 'hit')
+        return proba
+
+    @property
+    def can_explain(self):
+        return self.engine is not None and self.engine.cover is not None
+
+    def explain(self, X):
+        """Per-field attributions of the raw score (log-odds of leaving).
+
+        Returns (attributions, expected_value), with one column per field of
+        FEATURE_FIELDS, or None when the model cannot be explained.
+        """
+        if not self.can_explain:
+            return None
+        attributions = self.encoder.field_totals(self.engine.shap_values(X))
+        return attributions, self.engine.expected_value
+
+
+class ModelRegistry:
+    """Load the model once per process and reload it when the files change."""
+
+    def __init__(self, model_path=MODEL_PATH, columns_path=COLUMNS_PATH,
+                 imputer_path=IMPUTER_PATH, bundle_path=artifacts.BUNDLE_PATH):
+        self.model_path = model_path
+        self.columns_path = columns_path
+        self.imputer_path = imputer_path
+        self.bundle_path = bundle_path
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._entry = None
+        self._stamp = None
+        self._stats = {
+            'loads': 0,
+            'load_seconds': 0.0,
+            'last_load_seconds': 0.0,
+            'hits': 0,
+            'hit_seconds': 0.0,
+        }
+
+    def _use_bundle(self):
+        return self.bundle_path is not None and os.path.exists(artifacts.manifest_path(self.bundle_path))
+
+    def _paths(self):
+        if self._use_bundle():
+            # The pickle and its columns, when deployed, to tell whether the bundle is stale
+            sources = [path for path in [self.model_path, self.columns_path] if os.path.exists(path)]
+            return [artifacts.manifest_path(self.bundle_path), self.imputer_path] + sources
+        return [self.model_path, self.columns_path, self.imputer_path]
+
+    def _bundle_is_current(self, contents):
+        """Whether the bundle was converted from the pickle and training_cols.csv read."""
+        if self.model_path not in contents or self.columns_path not in contents:
+            # A bundle deployed without its sources
+            return True
+        try:
+            manifest = json.loads(contents[artifacts.manifest_path(self.bundle_path)])
+        except ValueError:
+            return False
+        return manifest.get('format_version') == artifacts.FORMAT_VERSION and manifest.get('source_sha256') == {
+            'model': hashlib.sha256(contents[self.model_path]).hexdigest(),
+            'columns': hashlib.sha256(contents[self.columns_path]).hexdigest(),
+        }
+
+    def _file_stamp(self):
+        # (mtime, size) of every artifact; cheap enough to check on each call
+        paths = self._paths()
+        if self._use_bundle():
+            paths += artifacts.array_paths(self.bundle_path)
+        stamp = []
+        for path in paths:
+            info = os.stat(path)
+            stamp.append((info.st_mtime_ns, info.st_size))
+        return tuple(stamp)
+
+    def _record(self, key, start):
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            if key == 'hit':
+                self._stats['hits'] += 1
+                self._stats['hit_seconds'] += elapsed
+            else:
+                self._stats['loads'] += 1
+                self._stats['load_seconds'] += elapsed
+                self._stats['last_load_seconds'] = elapsed
+
+    def get(self):
+        start = time.perf_counter()
+        stamp = self._file_stamp()
+        entry = self._entry
+        if entry is not None and stamp == self._stamp:
+            self._record('hit', start)
+            return entry
+
+        with self._lock:
+            # Another session may have reloaded while we were waiting
+            if self._entry is not None and stamp == self._stamp:
+                self._record('hit', start)
+                return self._entry
+
+            # Shared with train.py, which swaps in new artifacts as one set
+            with artifacts.publish_lock():
+                contents = {}
+                for path in self._paths():
+                    with open(path, 'rb') as f:
+                        contents[path] = f.read()
+
+                # The pickle is never loaded next to a bundle: a pickle that does
+                # not match the bundle is not the one the bundle was verified from
+                use_bundle = self._use_bundle()
+                if use_bundle and not self._bundle_is_current(contents):
+                    warnings.warn('{} was not converted from {} and {}; still serving the bundle. '
+                                  'Run python artifacts.py to rebuild it.'.format(
+                                      self.bundle_path, self.model_path, self.columns_path))
+
+                # The bundle manifest carries the hashes of the array files
+                used = [artifacts.manifest_path(self.bundle_path), self.imputer_path] if use_bundle \
+                    else [self.model_path, self.columns_path, self.imputer_path]
+                digest = hashlib.sha256()
+                for path in used:
+                    digest.update(contents[path])
+                fingerprint = digest.hexdigest()
+
+                # The files were touched but their content did not change
+                if self._entry is not None and fingerprint == self._entry.fingerprint:
+                    self._stamp = stamp
+                    self._record('hit', start)
+                    return self._entry
+
+                if use_bundle:
+                    model, manifest = artifacts.load_bundle(self.bundle_path)
+                    columns = manifest['columns']
+                else:
+                    model = pickle.loads(contents[self.model_path])
+                    columns = read_training_columns(self.columns_path)
+                n_features = getattr(model, 'n_features_in_', None)
+                if n_features is not None and n_features != len(columns):
+                    raise ValueError(
+                        'Model expects {} features but its schema lists {} columns'.format(
+                            n_features, len(columns)))
+
+                imputer_params = json.loads(contents[self.imputer_path])
+                imputer = MedianImputer(imputer_params['columns'], imputer_params['medians'])
+                if imputer.columns != columns:
+                    raise ValueError('{} was not fitted on the training columns'.format(
+                        os.path.basename(self.imputer_path)))
+
+            self._entry = LoadedModel(model, columns, imputer, fingerprint,
+                                      time.perf_counter() - start)
+            self._stamp = stamp
+            self._record('load', start)
+            return self._entry
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['mean_hit_seconds'] = stats['hit_seconds'] / stats['hits'] if stats['hits'] else 0.0
+        stats['fingerprint'] = self._entry.fingerprint if self._entry is not None else None
+        return stats
+
+
+registry = ModelRegistry()
+
+
+def get_model():
+    return registry.get()
+
+
+def _registry_gauges():
+    stats = registry.stats()
+    return {
+        'attrition_model_loads': stats['loads'],
+        'attrition_model_cache_hits': stats['hits'],
+        'attrition_model_last_load_seconds': stats['last_load_seconds'],
+    }
+
+
+metrics.registry.add_collector(_registry_gauges)
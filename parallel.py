@@ -0,0 +1,196 @@
+"""Multi-process scoring with the compiled trees in shared memory.
+
+The arrays of the compiled model (see tree_engine) are copied once into
+shared memory, and every worker process maps them as NumPy arrays when it
+starts. A batch is written once, feature-major float32, into a shared input
+block; each worker scores a range of rows on one thread and writes the raw
+scores straight into a shared output block. Per task only the names of the
+blocks and the row range are pickled, never the model or the data.
+
+    from parallel import ParallelScorer
+
+    with ParallelScorer(loaded_model.engine, workers=4) as scorer:
+        proba = scorer.predict_proba(X)
+
+Batches too small to be worth splitting are scored in the calling process.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tree_engine import BLOCK_ROWS, CompiledGBM
+
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Tasks per worker and batch, so that a slow worker does not hold up the batch
+TASKS_PER_WORKER = 4
+
+# Fewest rows in a task; smaller batches are scored in the calling process
+MIN_TASK_ROWS = BLOCK_ROWS
+
+# Workers must not inherit the parent's numba and server threads
+START_METHOD = 'spawn'
+
+MODEL_ARRAYS = ['feature', 'threshold', 'leaves']
+
+
+class SharedArray:
+    """A NumPy array in a named shared memory block."""
+
+    def __init__(self, shm, shape, dtype, owner):
+        self.shm = shm
+        self.owner = owner
+        self.array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, shape, dtype):
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        return cls(shm, shape, dtype, owner=True)
+
+    @classmethod
+    def copy_of(cls, array):
+        shared = cls.create(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, dtype = spec
+        return cls(shared_memory.SharedMemory(name=name), shape, dtype, owner=False)
+
+    @property
+    def spec(self):
+        """What another process needs to attach: (name, shape, dtype)."""
+        return self.shm.name, self.array.shape, self.array.dtype.str
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# State of a worker process: the model, and the batch blocks it last used
+_worker = {}
+
+
+def _init_worker(model_spec):
+    arrays = {name: SharedArray.attach(spec) for name, spec in model_spec['arrays'].items()}
+    _worker['model_blocks'] = arrays
+    _worker['engine'] = CompiledGBM(
+        arrays['feature'].array, arrays['threshold'].array, arrays['leaves'].array,
+        model_spec['depth'], model_spec['init_score'], model_spec['learning_rate'],
+        model_spec['n_features'], model_spec['classes'], model_spec['link'])
+
+
+def _batch_block(key, spec):
+    # Keep the last input and output blocks mapped; they only change when a
+    # batch outgrows them
+    block = _worker.get(key)
+    if block is None or block.shm.name != spec[0]:
+        if block is not None:
+            block.close()
+        block = _worker[key] = SharedArray.attach(spec)
+    return block.array
+
+
+def _score_rows(input_spec, output_spec, start, stop):
+    XT = _batch_block('input', input_spec)
+    raw = _batch_block('output', output_spec)
+    _worker['engine'].decision_function_into(XT, raw, start, stop)
+    return stop - start
+
+
+class ParallelScorer:
+    """Score batches with a CompiledGBM over a pool of worker processes."""
+
+    def __init__(self, engine, workers=DEFAULT_WORKERS, start_method=START_METHOD):
+        self.engine = engine
+        self.workers = int(workers)
+        self._model_blocks = {name: SharedArray.copy_of(np.ascontiguousarray(getattr(engine, name)))
+                              for name in MODEL_ARRAYS}
+        model_spec = {
+            'arrays': {name: block.spec for name, block in self._model_blocks.items()},
+            'depth': engine.depth,
+            'init_score': engine.init_score,
+            'learning_rate': engine.learning_rate,
+            'n_features': engine.n_features,
+            'classes': engine.classes.tolist(),
+            'link': engine.link,
+        }
+        self._pool = ProcessPoolExecutor(self.workers, multiprocessing.get_context(start_method),
+                                         initializer=_init_worker, initargs=(model_spec,))
+        self._input = None
+        self._output = None
+
+    @classmethod
+    def from_pickle(cls, model_path, workers=DEFAULT_WORKERS):
+        import pickle
+
+        with open(model_path, 'rb') as f:
+            return cls(CompiledGBM.from_sklearn(pickle.load(f)), workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def warm_up(self):
+        """Start every worker now rather than on the first batch."""
+        self.decision_function(np.zeros((self.workers * MIN_TASK_ROWS, self.engine.n_features)))
+
+    def _reserve(self, n_rows):
+        # Grow the batch blocks to at least n_rows; they are reused after that
+        if self._input is not None and self._input.array.shape[1] >= n_rows:
+            return
+        capacity = max(n_rows, 2 * self._input.array.shape[1] if self._input is not None else 0)
+        for block in [self._input, self._output]:
+            if block is not None:
+                block.close()
+        self._input = SharedArray.create((self.engine.n_features, capacity), np.float32)
+        self._output = SharedArray.create((capacity,), np.float64)
+
+    def decision_function(self, X):
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.engine.n_features:
+            raise ValueError('Expected {} features, got {}'.format(self.engine.n_features, X.shape[1]))
+        n_rows = len(X)
+        if n_rows < 2 * MIN_TASK_ROWS:
+            return self.engine.decision_function(X)
+
+        self._reserve(n_rows)
+        # The only copy of the batch: into shared memory, feature-major float32
+        self._input.array[:, :n_rows] = X.T
+        task_rows = max(MIN_TASK_ROWS, -(-n_rows // (self.workers * TASKS_PER_WORKER)))
+        futures = [self._pool.submit(_score_rows, self._input.spec, self._output.spec,
+                                     start, min(start + task_rows, n_rows))
+                   for start in range(0, n_rows, task_rows)]
+        for future in futures:
+            future.result()
+        return self._output.array[:n_rows].copy()
+
+    def predict_proba(self, X):
+        return self.engine.raw_to_proba(self.decision_function(X))
+
+    def predict(self, X):
+        proba = self.predict_proba(X)
+        return self.engine.classes.take(np.argmax(proba, axis=1))
+
+    def close(self):
+        if self._pool is None:
+            return
+        self._pool.shutdown()
+        self._pool = None
+        for block in [self._input, self._output] + list(self._model_blocks.values()):
+            if block is not None:
+                block.close()
+        self._input = self._output = None
+        self._model_blocks = {}
@@ -0,0 +1,108 @@
+"""Per-process LRU cache of the predictions made on the prediction page.
+
+Streamlit keeps imported modules for the lifetime of the server process, so
+the cache below is shared by every session. Entries are keyed by the model
+fingerprint and the tuple of codes of the eleven inputs: a profile that was
+already predicted (by anyone, since the model was last replaced) is answered
+without encoding, scoring or explaining it again.
+"""
+import collections
+import threading
+
+import metrics
+
+
+MAX_ENTRIES = 4096
+
+
+class LRUCache:
+    """A bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """The cached value, or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        metrics.count('attrition_cache_requests_total', cache='prediction',
+                      result='miss' if value is None else 'hit')
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0,
+            }
+
+
+cache = LRUCache()
+
+
+def compute(loaded_model, codes):
+    """Probabilities (1, 2), predicted class and explanation (or None) for one row of codes."""
+    # One-hot encode the input in the training column order, and impute
+    # (a no-op, the page checks that every input is filled in)
+    with metrics.timer('attrition_stage_seconds', stage='encode'):
+        encoded = loaded_model.encoder.transform([codes])
+    with metrics.timer('attrition_stage_seconds', stage='impute'):
+        encoded = loaded_model.imputer.transform(encoded)
+
+    # The precomputed table answers page inputs (to float32) when it is built and turned on
+    with metrics.timer('attrition_stage_seconds', stage='predict'):
+        proba = loaded_model.predict_proba_codes(codes)
+        if proba is None:
+            proba = loaded_model.predict_proba(encoded)
+        prediction = loaded_model.model.classes_.take(proba.argmax(axis=1))
+
+    with metrics.timer('attrition_stage_seconds', stage='explain'):
+        explained = loaded_model.explain(encoded)
+    return proba, prediction, explained
+
+
+def predict(loaded_model, codes):
+    """compute(), answered from the cache when this profile was seen before.
+
+    The returned arrays are shared with other sessions and must not be
+    modified.
+    """
+    key = (loaded_model.fingerprint, tuple(float(code) for code in codes))
+    result = cache.get(key)
+    if result is None:
+        result = compute(loaded_model, codes)
+        for array in [result[0], result[1]] + ([] if result[2] is None else [result[2][0]]):
+            array.flags.writeable = False
+        cache.put(key, result)
+    return result
+
+
+metrics.registry.add_collector(lambda: {'attrition_prediction_cache_' + name: value
+                                        for name, value in cache.stats().items()})
@@ -0,0 +1,276 @@
+"""Standalone HTTP scoring service for the attrition model.
+
+Requests that arrive within a short window are merged into one micro-batch and
+scored with a single predict_proba call, using the same encoder, imputer and
+model artifacts as the Streamlit app.
+
+Usage:
+    python serve.py --port 8502 --batch-window-ms 5
+
+Endpoints:
+    POST /predict   one employee as a JSON object, or {"instances": [...]}.
+                    Fields are named like FEATURE_FIELDS and take either the
+                    prediction page labels or the model codes.
+    GET  /stats     throughput, batch sizes and latency percentiles
+    GET  /metrics   the same and the stage timings of metrics.py, in the
+                    Prometheus text format
+    GET  /drift     PSI and KS of every field against the training profile
+                    (drift.py)
+    GET  /healthz   liveness check
+"""
+import argparse
+import collections
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import drift
+import metrics
+from model_registry import get_model
+
+
+DEFAULT_BATCH_WINDOW_MS = 5
+DEFAULT_MAX_BATCH_ROWS = 1024
+
+# Number of recent requests kept for the latency percentiles
+LATENCY_WINDOW = 10000
+
+
+class ServiceStats:
+    """Request counters and a rolling window of request latencies."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def record_request(self, n_rows, seconds):
+        with self._lock:
+            self.requests += 1
+            self.rows += n_rows
+            self.latencies.append(seconds)
+
+    def record_batch(self):
+        with self._lock:
+            self.batches += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = np.array(self.latencies)
+            uptime = time.time() - self.started_at
+            snapshot = {
+                'uptime_seconds': uptime,
+                'requests': self.requests,
+                'rows': self.rows,
+                'batches': self.batches,
+                'errors': self.errors,
+                'requests_per_second': self.requests / uptime if uptime else 0.0,
+                'rows_per_second': self.rows / uptime if uptime else 0.0,
+                'mean_batch_rows': self.rows / self.batches if self.batches else 0.0,
+            }
+
+        for q in [50, 90, 95, 99]:
+            value = np.percentile(latencies, q) * 1e3 if len(latencies) else 0.0
+            snapshot['latency_p{}_ms'.format(q)] = value
+        return snapshot
+
+
+class MicroBatcher:
+    """Collect concurrent requests and score them with one model call."""
+
+    def __init__(self, stats, batch_window_ms=DEFAULT_BATCH_WINDOW_MS,
+                 max_batch_rows=DEFAULT_MAX_BATCH_ROWS):
+        self.stats = stats
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_rows = max_batch_rows
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def encode(self, records):
+        """Codes of the records; TypeError or ValueError for values that are not a label or a number."""
+        # Encoding labels to codes happens on the request thread
+        loaded_model = get_model()
+        with metrics.timer('attrition_stage_seconds', stage='codes'):
+            return np.array([loaded_model.encoder.codes(record) for record in records], dtype=float)
+
+    def submit(self, codes):
+        future = Future()
+        self._queue.put((codes, future))
+        return future
+
+    def _collect(self):
+        items = [self._queue.get()]
+        n_rows = len(items[0][0])
+        deadline = time.perf_counter() + self.batch_window
+
+        while n_rows < self.max_batch_rows:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            items.append(item)
+            n_rows += len(item[0])
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            try:
+                self._score(items)
+            except Exception as exc:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(exc)
+
+    def _score(self, items):
+        loaded_model = get_model()
+
+        codes = np.concatenate([codes for codes, _ in items])
+        drift.monitor.observe(codes)
+        with metrics.timer('attrition_stage_seconds', stage='encode'):
+            encoded = loaded_model.encoder.transform(codes)
+        complete = ~np.isnan(encoded).any(axis=1)
+        with metrics.timer('attrition_stage_seconds', stage='impute'):
+            encoded = loaded_model.imputer.transform(encoded, has_missing=not complete.all())
+
+        with metrics.timer('attrition_stage_seconds', stage='predict'):
+            proba = loaded_model.predict_proba(encoded)
+            prediction = loaded_model.model.classes_.take(np.argmax(proba, axis=1))
+        metrics.count('attrition_predictions_total', int((prediction == 1).sum()), outcome='leave')
+        metrics.count('attrition_predictions_total', int((prediction != 1).sum()), outcome='stay')
+        self.stats.record_batch()
+
+        start = 0
+        for item_codes, future in items:
+            stop = start + len(item_codes)
+            future.set_result([
+                {
+                    'prediction': int(prediction[i]),
+                    'probability': float(proba[i, 1]),
+                    'imputed': bool(not complete[i]),
+                }
+                for i in range(start, stop)
+            ])
+            start = stop
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/healthz':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._send_json(200, self.server.stats.snapshot())
+        elif self.path == '/drift':
+            self._send_json(200, drift.monitor.report().to_dict(orient='records'))
+        elif self.path == '/metrics':
+            body = metrics.registry.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length))
+            records = payload['instances'] if 'instances' in payload else [payload]
+            if not records or not all(isinstance(record, dict) for record in records):
+                raise ValueError('expected an employee object or {"instances": [...]}')
+            # A list or an object as a field value is the client's error too
+            codes = self.server.batcher.encode(records)
+        except (ValueError, TypeError, KeyError) as exc:
+            self.server.stats.record_error()
+            self._send_json(400, {'error': str(exc)})
+            return
+
+        try:
+            predictions = self.server.batcher.submit(codes).result()
+        except Exception as exc:
+            self.server.stats.record_error()
+            self._send_json(500, {'error': str(exc)})
+            return
+
+        self.server.stats.record_request(len(records), time.perf_counter() - start)
+        self._send_json(200, {'predictions': predictions})
+
+    def log_message(self, format, *args):
+        # Per-request access logs would dominate the cost of a prediction
+        pass
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The socketserver default of 5 drops connections under a burst of clients
+    request_queue_size = 128
+
+
+def make_server(host, port, batch_window_ms=DEFAULT_BATCH_WINDOW_MS,
+                max_batch_rows=DEFAULT_MAX_BATCH_ROWS):
+    server = PredictionServer((host, port), PredictionHandler)
+    server.stats = ServiceStats()
+    metrics.registry.add_collector(lambda: {'attrition_serve_' + name: value
+                                            for name, value in server.stats.snapshot().items()})
+    server.batcher = MicroBatcher(server.stats, batch_window_ms, max_batch_rows)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve attrition predictions over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--batch-window-ms', type=float, default=DEFAULT_BATCH_WINDOW_MS,
+                        help='how long to wait for more requests before scoring (default: %(default)s)')
+    parser.add_argument('--max-batch-rows', type=int, default=DEFAULT_MAX_BATCH_ROWS,
+                        help='score as soon as this many rows are waiting (default: %(default)s)')
+    args = parser.parse_args()
+
+    # Load the artifacts before accepting traffic
+    get_model()
+
+    server = make_server(args.host, args.port, args.batch_window_ms, args.max_batch_rows)
+    print('Serving attrition predictions on http://{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""Resized, compressed variants of the images in assets/, served as static files.
+
+The build step writes two variants of every image the pages show
+(SERVED_IMAGES, under assets/) to static/assets/, named by the sha256 of
+their content:
+
+    <name>-<hash>.webp    at most MAX_WIDTH pixels wide
+    <name>-<hash>.png     the same size, as an optimized PNG, for browsers
+                          without WebP
+
+and records them in static/assets/manifest.json with the sha256 of the
+source, so images that did not change are not encoded again. The outputs are
+committed, so running the app does not need Pillow.
+
+With server.enableStaticServing (.streamlit/config.toml), Streamlit serves
+static/ under app/static/. The pages reference the variants by URL with
+their hash as the version argument, which makes Tornado answer with a ten
+year Cache-Control, and mark them loading="lazy", so the browser fetches an
+image once, and only when it scrolls into view. Without static serving the
+variants are read once into memory and passed to st.image.
+
+To rebuild the variants after changing one of these images, or the list:
+    python static_assets.py
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import threading
+
+from data_access import file_sha256, file_stamp
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(BASE_DIR, 'assets')
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+OUTPUT_DIR = os.path.join(STATIC_DIR, 'assets')
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, 'manifest.json')
+STATIC_URL = 'app/static/'
+
+# Bumped whenever the encoding settings or the manifest layout change
+MANIFEST_VERSION = 1
+
+# The images app.py shows with image(); the rest of assets/ is not served
+SERVED_IMAGES = [
+    'img/intro_img.png',
+    'img/objectives_img.png',
+    'img/references_img.png',
+]
+# Twice the width of the centered page layout, for high-density screens
+MAX_WIDTH = 1408
+WEBP_QUALITY = 80
+PALETTE_COLORS = 256
+
+
+def encode_variants(path, max_width=MAX_WIDTH):
+    """(width, height, {format: bytes}) of the WebP and PNG variants of an image."""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.load()
+        resized = image.width > max_width
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.mode else 'RGB')
+        if resized:
+            image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+
+        # Charts and flat illustrations are often smaller lossless
+        variants = {}
+        for options in [{'quality': WEBP_QUALITY}, {'lossless': True}]:
+            buffer = io.BytesIO()
+            image.save(buffer, 'WEBP', method=6, **options)
+            if 'webp' not in variants or buffer.tell() < len(variants['webp']):
+                variants['webp'] = buffer.getvalue()
+        # The PNG fallback is reduced to a palette of PALETTE_COLORS
+        buffer = io.BytesIO()
+        image.quantize(PALETTE_COLORS, method=Image.FASTOCTREE).save(buffer, 'PNG', optimize=True)
+        variants['png'] = buffer.getvalue()
+        if not resized and path.lower().endswith('.png') and os.path.getsize(path) < len(variants['png']):
+            with open(path, 'rb') as f:
+                variants['png'] = f.read()
+        return image.width, image.height, variants
+
+
+def read_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def build(source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR, max_width=MAX_WIDTH, full=False, names=SERVED_IMAGES):
+    """Bring the variants of names (relative to source_dir) up to date; returns (manifest, names encoded)."""
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    previous = None if full else read_manifest(manifest_path)
+    if previous is not None and previous.get('max_width') != max_width:
+        previous = None
+    previous_images = previous['images'] if previous else {}
+
+    os.makedirs(output_dir, exist_ok=True)
+    images = {}
+    encoded = []
+    for name in names:
+        source_sha256 = file_sha256(os.path.join(source_dir, name))
+        entry = previous_images.get(name)
+        if entry is not None and entry['source_sha256'] == source_sha256 and all(
+                os.path.exists(os.path.join(output_dir, entry[fmt]['file'])) for fmt in ('webp', 'png')):
+            images[name] = entry
+            continue
+
+        width, height, variants = encode_variants(os.path.join(source_dir, name), max_width)
+        entry = {'source_sha256': source_sha256, 'source_bytes': os.path.getsize(os.path.join(source_dir, name)),
+                 'width': width, 'height': height}
+        stem = os.path.splitext(name)[0].replace('/', '-')
+        for fmt, content in variants.items():
+            digest = hashlib.sha256(content).hexdigest()[:12]
+            filename = '{}-{}.{}'.format(stem, digest, fmt)
+            with open(os.path.join(output_dir, filename), 'wb') as f:
+                f.write(content)
+            entry[fmt] = {'file': filename, 'hash': digest, 'bytes': len(content)}
+        images[name] = entry
+        encoded.append(name)
+
+    manifest = {'version': MANIFEST_VERSION, 'max_width': max_width, 'images': images}
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    # Variants of images that changed or were removed
+    current = {entry[fmt]['file'] for entry in images.values() for fmt in ('webp', 'png')}
+    for filename in os.listdir(output_dir):
+        if filename != 'manifest.json' and filename not in current:
+            os.remove(os.path.join(output_dir, filename))
+    return manifest, encoded
+
+
+class AssetCache:
+    """The manifest and the bytes of the variants shown, in memory."""
+
+    def __init__(self, manifest_path=MANIFEST_PATH):
+        self.manifest_path = manifest_path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._images = {}
+        self._content = {}
+
+    def _entries(self):
+        try:
+            stamp = file_stamp(self.manifest_path)
+        except OSError:
+            return {}
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    manifest = read_manifest(self.manifest_path)
+                    self._images = manifest['images'] if manifest else {}
+                    self._content = {}
+                    self._stamp = stamp
+        return self._images
+
+    def entry(self, name):
+        """The manifest entry of an image of assets/, or None if it was not built."""
+        return self._entries().get(name)
+
+    def url(self, name, fmt='webp'):
+        entry = self.entry(name)
+        if entry is None:
+            return None
+        variant = entry[fmt]
+        # The v argument gets a long-lived Cache-Control from Tornado
+        return '{}assets/{}?v={}'.format(STATIC_URL, variant['file'], variant['hash'])
+
+    def content(self, name, fmt='webp'):
+        """Bytes of a variant, or of the source image when it was not built."""
+        entry = self.entry(name)
+        path = os.path.join(os.path.dirname(self.manifest_path), entry[fmt]['file']) if entry \
+            else os.path.join(SOURCE_DIR, name)
+        content = self._content.get(path)
+        if content is None:
+            with open(path, 'rb') as f:
+                content = f.read()
+            with self._lock:
+                self._content[path] = content
+        return content
+
+
+asset_cache = AssetCache()
+
+
+def image(name, caption=None):
+    """Show an image of assets/ (named relative to it) from its compressed variants."""
+    import streamlit as st
+
+    entry = asset_cache.entry(name)
+    if entry is None or not st.get_option('server.enableStaticServing'):
+        st.image(asset_cache.content(name), caption=caption)
+        return
+
+    st.markdown(
+        '<picture><source srcset="{webp}" type="image/webp">'
+        '<img src="{png}" width="{width}" height="{height}" loading="lazy" decoding="async" '
+        'style="width: 100%; height: auto;" alt=""></picture>'.format(
+            webp=asset_cache.url(name, 'webp'), png=asset_cache.url(name, 'png'),
+            width=entry['width'], height=entry['height']),
+        unsafe_allow_html=True)
+    if caption:
+        st.caption(caption)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the compressed image variants served by the app.')
+    parser.add_argument('--source', default=SOURCE_DIR, help='directory of SERVED_IMAGES (default: %(default)s)')
+    parser.add_argument('--output', default=OUTPUT_DIR, help='where to write the variants (default: %(default)s)')
+    parser.add_argument('--max-width', type=int, default=MAX_WIDTH,
+                        help='images wider than this are scaled down (default: %(default)s)')
+    parser.add_argument('--full', action='store_true', help='encode every image even if it did not change')
+    args = parser.parse_args()
+
+    manifest, encoded = build(args.source, args.output, args.max_width, args.full)
+    images = manifest['images'].values()
+    source_bytes = sum(entry['source_bytes'] for entry in images)
+    webp_bytes = sum(entry['webp']['bytes'] for entry in images)
+    png_bytes = sum(entry['png']['bytes'] for entry in images)
+    print('Encoded {} of {} images -> {}'.format(len(encoded), len(manifest['images']), args.output))
+    print('Sources {:,} bytes, WebP {:,} bytes ({:.0%}), PNG {:,} bytes ({:.0%})'.format(
+        source_bytes, webp_bytes, webp_bytes / max(source_bytes, 1), png_bytes, png_bytes / max(source_bytes, 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Out-of-core scoring of workforce extracts too large to load at once.
+
+The extract is read, scored and written a chunk at a time, so memory is
+bounded by a few chunks however long the file is:
+
+    reader thread   pd.read_csv(chunksize=...) into a bounded queue
+    score workers   encode, impute and predict chunks in a thread pool
+    main thread     writes the scored chunks in input order
+
+Reading, scoring and writing overlap. The compiled trees already use every
+core on a large chunk, so extra workers mostly overlap the encoding of one
+chunk with the scoring of another.
+
+The columns of the IBM layout are read with fixed dtypes (nullable integers
+and text), so every chunk is parsed and written the same way whichever
+values it happens to hold; a value that is not an integer in an integer
+column is an error. The output is byte for byte the same as
+batch_scoring.py's unless an integer column has missing values: batch
+scoring then writes the whole column as floats (3.0), streaming keeps the
+integers (3).
+
+Usage:
+    python streaming.py huge_export.csv -o scored.csv
+    python streaming.py huge_export.csv -o scored.csv --chunk-size 200000 --workers 4
+"""
+import argparse
+import collections
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from batch_scoring import PREDICTION_COL, score_frame
+from features import clean_column_names
+
+
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Chunks read ahead of the scoring workers
+READ_AHEAD = 2
+
+TEXT_COLUMNS = ['Attrition', 'BusinessTravel', 'Department', 'EducationField', 'Gender', 'JobRole',
+                'MaritalStatus', 'Over18', 'OverTime']
+INTEGER_COLUMNS = ['Age', 'DailyRate', 'DistanceFromHome', 'Education', 'EmployeeCount', 'EmployeeNumber',
+                   'EnvironmentSatisfaction', 'HourlyRate', 'JobInvolvement', 'JobLevel', 'JobSatisfaction',
+                   'MonthlyIncome', 'MonthlyRate', 'NumCompaniesWorked', 'PercentSalaryHike',
+                   'PerformanceRating', 'RelationshipSatisfaction', 'StandardHours', 'StockOptionLevel',
+                   'TotalWorkingYears', 'TrainingTimesLastYear', 'WorkLifeBalance', 'YearsAtCompany',
+                   'YearsInCurrentRole', 'YearsSinceLastPromotion', 'YearsWithCurrManager']
+
+_DONE = object()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, in kilobytes elsewhere
+    return peak / 1e6 if os.uname().sysname == 'Darwin' else peak / 1e3
+
+
+def layout_dtypes(path_or_buffer):
+    """dtype of every column of the file's header that belongs to the IBM layout."""
+    header = pd.read_csv(path_or_buffer, encoding='ISO-8859-1', nrows=0).columns
+    if hasattr(path_or_buffer, 'seek'):
+        path_or_buffer.seek(0)
+    dtypes = {}
+    # Keyed by the header as read, before the byte order mark is cleaned off
+    for raw, col in zip(header, clean_column_names(pd.DataFrame(columns=header)).columns):
+        if col in INTEGER_COLUMNS:
+            dtypes[raw] = 'Int64'
+        elif col in TEXT_COLUMNS:
+            dtypes[raw] = object
+    return dtypes
+
+
+def read_chunks(path_or_buffer, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Chunks of a CSV in the IBM_HR-Attrition.csv layout."""
+    dtypes = layout_dtypes(path_or_buffer)
+    for chunk in pd.read_csv(path_or_buffer, encoding='ISO-8859-1', chunksize=chunk_size, dtype=dtypes):
+        yield clean_column_names(chunk)
+
+
+def prefetch(iterable, depth=READ_AHEAD):
+    """Run an iterator in a background thread, at most depth items ahead."""
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                # Give up when the consumer is gone
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+        except Exception as exc:
+            items.put((None, exc))
+            return
+        items.put((_DONE, None))
+
+    thread = threading.Thread(target=produce, name='stream-reader', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def score_stream(chunks, loaded_model=None, workers=DEFAULT_WORKERS, explain=False):
+    """Scored chunks, in input order, with up to workers chunks in flight."""
+    if loaded_model is None:
+        from model_registry import get_model
+
+        loaded_model = get_model()
+
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stream-score') as pool:
+        for chunk in chunks:
+            pending.append(pool.submit(score_frame, chunk, loaded_model, len(chunk), explain))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def score_file(input_path, output_path, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS,
+               explain=False, progress=None):
+    """Stream a CSV through the model into output_path; returns the rows scored and predicted to leave."""
+    n_rows = 0
+    n_leaving = 0
+    chunks = prefetch(read_chunks(input_path, chunk_size))
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'w', newline='') as out:
+        for i, scored in enumerate(score_stream(chunks, workers=workers, explain=explain)):
+            scored.to_csv(out, index=False, header=i == 0)
+            n_rows += len(scored)
+            n_leaving += int((scored[PREDICTION_COL] == 1).sum())
+            if progress is not None:
+                progress(n_rows)
+    os.replace(tmp_path, output_path)
+    return n_rows, n_leaving
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a workforce extract of any size with bounded memory.')
+    parser.add_argument('input', help='CSV in the IBM_HR-Attrition.csv layout')
+    parser.add_argument('-o', '--output', default='scored.csv', help='where to write the scored CSV')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='rows read, scored and written at a time (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='chunks scored concurrently (default: %(default)s)')
+    parser.add_argument('--explain', action='store_true',
+                        help='add the contribution of each field to every prediction')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    n_rows, n_leaving = score_file(args.input, args.output, args.chunk_size, args.workers, args.explain)
+    run_time = time.time() - start_time
+    print('Scored {:,} rows in {:.1f}s ({:,.0f} rows/s), {:,} predicted to leave -> {}'.format(
+        n_rows, run_time, n_rows / max(run_time, 1e-9), n_leaving, args.output))
+    print('Peak RSS {:.0f} MB'.format(peak_rss_mb()))
+
+
+if __name__ == '__main__':
+    main()
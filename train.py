@@ -0,0 +1,436 @@
+"""Train the attrition model: grid search, refit and publish.
+
+This is the training procedure of
+notebooks/2_data_modelling_random_undersampler_applied_gbm.ipynb as a script:
+a 70/30 stratified split of data/attrition_features_ohe.csv, a grid search
+over n_estimators x learning_rate with StratifiedKFold(5) on a
+RandomUnderSampler + GradientBoostingClassifier pipeline, and a refit of the
+best candidate on the training split.
+
+Every (candidate, fold) pair is fitted in a process pool. The scores of each
+fitted fold are cached under model/.train_cache, keyed by the training data
+and the search settings, so an interrupted search picks up where it stopped.
+Per-candidate wall times and scores are written to
+data/modelling/gbm/search_results.csv.
+
+With --search halving the grid is searched by successive halving instead:
+n_estimators is treated as the budget, every learning rate is boosted to
+the first stage, only the better half is warm-started to the next stage, and
+so on. All n_estimators grid points up to a stage are scored from the same
+fit with staged_predict. The results go to search_results_halving.csv.
+
+The model, training_cols.csv, imputer.json and the model bundle are swapped
+in together under the publish lock that the model registry reads them with.
+
+Usage:
+    python train.py --jobs 4
+    python train.py --metric accuracy --no-publish
+    python train.py --search halving
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import artifacts
+from imputation import IMPUTER_PATH, TRAINING_DATA_PATH, MedianImputer
+from model_registry import COLUMNS_PATH, MODEL_PATH
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, 'model', '.train_cache')
+RESULTS_PATH = os.path.join(BASE_DIR, 'data', 'modelling', 'gbm', 'search_results.csv')
+HALVING_RESULTS_PATH = os.path.join(BASE_DIR, 'data', 'modelling', 'gbm', 'search_results_halving.csv')
+
+# Search settings of the modelling notebook
+PARAM_GRID = {
+    'n_estimators': [1, 10, 50, 100, 200],
+    'learning_rate': [1, 0.5, 0.1, 0.01],
+}
+N_SPLITS = 5
+TEST_SIZE = 0.30
+SPLIT_RANDOM_STATE = 42
+MODEL_RANDOM_STATE = 143
+
+# Successive halving: trees per candidate after each stage, and the share of
+# candidates kept (1 / HALVING_FACTOR) between stages
+HALVING_STAGES = [10, 50, 200]
+HALVING_FACTOR = 2
+
+# Bumped whenever the fitting procedure changes, so cached folds are not reused
+CACHE_VERSION = 1
+
+TARGET = 'Attrition'
+
+
+def load_training_data(path=TRAINING_DATA_PATH):
+    from sklearn.model_selection import train_test_split
+
+    data = pd.read_csv(path)
+    X = data.drop([TARGET], axis=1)
+    y = data[TARGET]
+    return train_test_split(X, y, random_state=SPLIT_RANDOM_STATE, test_size=TEST_SIZE, stratify=y)
+
+
+def candidates(param_grid=PARAM_GRID):
+    """Grid points in the order GridSearchCV enumerates them."""
+    from sklearn.model_selection import ParameterGrid
+
+    return list(ParameterGrid(param_grid))
+
+
+def make_pipeline(params, random_state=MODEL_RANDOM_STATE):
+    # The notebook also had a MinMaxScaler in front, but only the classifier
+    # was saved and the app feeds it unscaled values. Trees do not need
+    # scaling, so the classifier is trained on the values it is served.
+    from imblearn.pipeline import make_pipeline as make_imblearn_pipeline
+    from imblearn.under_sampling import RandomUnderSampler
+    from sklearn.ensemble import GradientBoostingClassifier
+
+    return make_imblearn_pipeline(
+        RandomUnderSampler(random_state=random_state),
+        GradientBoostingClassifier(random_state=random_state, **params))
+
+
+def search_key(X, y, n_splits=N_SPLITS, param_grid=PARAM_GRID, **settings):
+    # Cached folds are only valid for the same data and search settings
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(X, index=True).to_numpy().tobytes())
+    digest.update(pd.util.hash_pandas_object(y, index=True).to_numpy().tobytes())
+    digest.update(json.dumps(dict(settings, **{
+        'version': CACHE_VERSION,
+        'n_splits': n_splits,
+        'param_grid': param_grid,
+        'random_state': MODEL_RANDOM_STATE,
+        'columns': list(X.columns),
+    }), sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def fold_cache_path(cache_dir, params, fold, extension='.json'):
+    name = '_'.join('{}-{}'.format(key, params[key]) for key in sorted(params))
+    return os.path.join(cache_dir, '{}_fold{}{}'.format(name, fold, extension))
+
+
+def write_json(path, payload):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+_worker_data = {}
+
+
+def _init_worker(X, y):
+    # The training split is sent to each worker once, not with every task
+    _worker_data['X'] = X
+    _worker_data['y'] = y
+
+
+def fit_fold(params, fold, train_index, val_index):
+    """Fit one candidate on one fold and return its scores and fit time."""
+    X, y = _worker_data['X'], _worker_data['y']
+    X_train, X_val = X[train_index], X[val_index]
+    y_train, y_val = y[train_index], y[val_index]
+
+    pipeline = make_pipeline(params)
+    start = time.perf_counter()
+    pipeline.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    result = _scores(params, fold, y_train, pipeline.predict(X_train), y_val, pipeline.predict(X_val))
+    result['fit_seconds'] = fit_seconds
+    return result
+
+
+def _scores(params, fold, y_train, train_pred, y_val, val_pred):
+    from sklearn.metrics import accuracy_score, recall_score
+
+    return {
+        'params': params,
+        'fold': fold,
+        'train_recall': recall_score(y_train, train_pred),
+        'val_recall': recall_score(y_val, val_pred),
+        'train_accuracy': accuracy_score(y_train, train_pred),
+        'val_accuracy': accuracy_score(y_val, val_pred),
+    }
+
+
+def grow_fold(params, fold, train_index, val_index, model, n_estimators, eval_points):
+    """Warm-start a candidate on one fold up to n_estimators trees.
+
+    Returns the model, the time spent fitting it in this call and the scores
+    at each number of trees in eval_points.
+    """
+    from imblearn.under_sampling import RandomUnderSampler
+    from sklearn.ensemble import GradientBoostingClassifier
+
+    X, y = _worker_data['X'], _worker_data['y']
+    X_train, X_val = X[train_index], X[val_index]
+    y_train, y_val = y[train_index], y[val_index]
+
+    # The same undersampled rows as the pipeline of the full grid
+    X_resampled, y_resampled = RandomUnderSampler(
+        random_state=MODEL_RANDOM_STATE).fit_resample(X_train, y_train)
+    if model is None:
+        model = GradientBoostingClassifier(random_state=MODEL_RANDOM_STATE, warm_start=True, **params)
+    model.set_params(n_estimators=n_estimators)
+
+    start = time.perf_counter()
+    model.fit(X_resampled, y_resampled)
+    fit_seconds = time.perf_counter() - start
+
+    rows = []
+    stages = zip(model.staged_predict(X_train), model.staged_predict(X_val))
+    for n_trees, (train_pred, val_pred) in enumerate(stages, 1):
+        if n_trees in eval_points:
+            rows.append(_scores(dict(params, n_estimators=n_trees), fold,
+                                y_train, train_pred, y_val, val_pred))
+    return model, fit_seconds, rows
+
+
+def run_halving(X, y, n_jobs=None, cache_dir=CACHE_DIR, metric='recall', n_splits=N_SPLITS,
+                param_grid=PARAM_GRID, stages=HALVING_STAGES, factor=HALVING_FACTOR):
+    """Successive halving over the grid, with n_estimators as the budget.
+
+    Returns the (candidate, fold) results like run_search, for the grid
+    points that were reached, and a log of (trees, candidates, fit seconds)
+    per stage.
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    grid_points = sorted(param_grid['n_estimators'])
+    if stages[-1] < grid_points[-1]:
+        raise ValueError('The last stage must reach {} estimators'.format(grid_points[-1]))
+
+    run_dir = os.path.join(cache_dir, search_key(X, y, n_splits, param_grid, stages=stages), 'halving')
+    os.makedirs(run_dir, exist_ok=True)
+
+    base_grid = {key: values for key, values in param_grid.items() if key != 'n_estimators'}
+    survivors = candidates(base_grid)
+    folds = list(StratifiedKFold(n_splits=n_splits).split(X, y))
+    models = {}
+    fit_seconds = {}
+    results = []
+    log = []
+
+    X_values = X.to_numpy(dtype=float)
+    y_values = y.to_numpy()
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                             initargs=(X_values, y_values)) as pool:
+        previous = 0
+        for stage, n_trees in enumerate(stages):
+            eval_points = [n for n in grid_points if previous < n <= n_trees]
+
+            outcomes = {}
+            futures = {}
+            for params in survivors:
+                for fold, (train_index, val_index) in enumerate(folds):
+                    key = (json.dumps(params, sort_keys=True), fold)
+                    # Pickled with the model, which the next stage grows further
+                    path = fold_cache_path(run_dir, dict(params, n_estimators=n_trees), fold, '.pkl')
+                    if os.path.exists(path):
+                        with open(path, 'rb') as f:
+                            outcomes[key] = pickle.load(f)
+                    else:
+                        future = pool.submit(grow_fold, params, fold, train_index, val_index,
+                                             models.get(key), n_trees, eval_points)
+                        futures[future] = (key, path)
+
+            for future in as_completed(futures):
+                key, path = futures[future]
+                outcomes[key] = future.result()
+                with open(path + '.tmp', 'wb') as f:
+                    pickle.dump(outcomes[key], f)
+                os.replace(path + '.tmp', path)
+
+            stage_seconds = 0.0
+            for key in sorted(outcomes):
+                model, seconds, rows = outcomes[key]
+                stage_seconds += seconds
+                models[key] = model
+                # Rows carry the time it took to grow this fold to their size
+                fit_seconds[key] = fit_seconds.get(key, 0.0) + seconds
+                for row in rows:
+                    row['fit_seconds'] = fit_seconds[key]
+                results.extend(rows)
+
+            print('Stage {}: {} candidates x {} folds grown to {} trees ({} cached, {} fitted)'.format(
+                stage + 1, len(survivors), n_splits, n_trees, len(outcomes) - len(futures), len(futures)))
+            log.append((n_trees, len(survivors), stage_seconds))
+
+            # Keep the candidates with the best score at any size reached so far
+            if stage < len(stages) - 1:
+                summary = summarize(results)
+                base_keys = sorted(base_grid)
+                score = {}
+                for _, row in summary.iterrows():
+                    key = tuple(float(row[k]) for k in base_keys)
+                    score[key] = max(score.get(key, 0.0), row['mean_val_' + metric])
+                n_keep = max(1, math.ceil(len(survivors) / factor))
+                survivors = sorted(survivors, key=lambda params: -score[tuple(float(params[k]) for k in base_keys)])
+                survivors = survivors[:n_keep]
+            previous = n_trees
+    return results, log
+
+
+def run_search(X, y, n_jobs=None, cache_dir=CACHE_DIR, n_splits=N_SPLITS, param_grid=PARAM_GRID):
+    """Cross-validate every candidate; return one result dict per (candidate, fold)."""
+    from sklearn.model_selection import StratifiedKFold
+
+    run_dir = os.path.join(cache_dir, search_key(X, y, n_splits, param_grid))
+    os.makedirs(run_dir, exist_ok=True)
+
+    folds = list(StratifiedKFold(n_splits=n_splits).split(X, y))
+    results = []
+    pending = []
+    for params in candidates(param_grid):
+        for fold, (train_index, val_index) in enumerate(folds):
+            path = fold_cache_path(run_dir, params, fold)
+            if os.path.exists(path):
+                with open(path) as f:
+                    results.append(json.load(f))
+            else:
+                pending.append((params, fold, train_index, val_index, path))
+
+    print('{} candidates x {} folds: {} cached, {} to fit'.format(
+        len(candidates(param_grid)), n_splits, len(results), len(pending)))
+
+    X_values = X.to_numpy(dtype=float)
+    y_values = y.to_numpy()
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                             initargs=(X_values, y_values)) as pool:
+        futures = {
+            pool.submit(fit_fold, params, fold, train_index, val_index): path
+            for params, fold, train_index, val_index, path in pending
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            # Written as soon as it is done, so an interrupted run can resume
+            write_json(futures[future], result)
+            results.append(result)
+            print('  [{}/{}] {} fold {}: val recall {:.3f} in {:.2f}s'.format(
+                i, len(pending), result['params'], result['fold'],
+                result['val_recall'], result['fit_seconds']))
+    return results
+
+
+def summarize(results):
+    """One row per candidate, in the spirit of data/modelling/results_df.csv."""
+    rows = pd.DataFrame([dict(result['params'], **result) for result in results]).drop(columns=['params'])
+    keys = sorted(PARAM_GRID)
+    summary = rows.groupby(keys).agg(
+        mean_train_recall=('train_recall', 'mean'),
+        mean_val_recall=('val_recall', 'mean'),
+        mean_train_accuracy=('train_accuracy', 'mean'),
+        mean_val_accuracy=('val_accuracy', 'mean'),
+        runtime=('fit_seconds', 'sum'),
+        mean_fold_runtime=('fit_seconds', 'mean'),
+    ).reset_index()
+    return summary
+
+
+def best_candidate(summary, metric):
+    # Ties go to the smaller learning rate, then the fewer estimators
+    return summary.loc[summary['mean_val_' + metric].idxmax()]
+
+
+def candidate_params(row):
+    return {'n_estimators': int(row['n_estimators']), 'learning_rate': float(row['learning_rate'])}
+
+
+def publish(model, columns, imputer, model_path=MODEL_PATH, columns_path=COLUMNS_PATH,
+            imputer_path=IMPUTER_PATH, bundle_path=artifacts.BUNDLE_PATH):
+    """Swap in the model, its columns, its medians and its bundle as one set."""
+    from tree_engine import CompiledGBM
+
+    engine = CompiledGBM.from_sklearn(model)
+    engine.check(model)
+
+    # Everything is written next to the targets first, then renamed under the lock
+    staging = tempfile.mkdtemp(prefix='.release-', dir=os.path.dirname(model_path))
+    try:
+        staged_model = os.path.join(staging, os.path.basename(model_path))
+        staged_columns = os.path.join(staging, os.path.basename(columns_path))
+        staged_imputer = os.path.join(staging, os.path.basename(imputer_path))
+        with open(staged_model, 'wb') as f:
+            pickle.dump(model, f)
+        pd.DataFrame(columns).to_csv(staged_columns, index=False)
+        imputer.save(staged_imputer)
+
+        with artifacts.publish_lock(exclusive=True):
+            artifacts.save_bundle(engine, columns, bundle_path,
+                                  source=os.path.relpath(model_path, BASE_DIR),
+                                  source_hashes=artifacts.source_sha256(staged_model, staged_columns))
+            os.replace(staged_columns, columns_path)
+            os.replace(staged_imputer, imputer_path)
+            os.replace(staged_model, model_path)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def main():
+    from sklearn.metrics import accuracy_score, recall_score
+
+    parser = argparse.ArgumentParser(description='Grid search, refit and publish the attrition model.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes (default: all cores)')
+    parser.add_argument('--metric', choices=['recall', 'accuracy'], default='recall',
+                        help='cross-validation score used to pick the model (default: %(default)s)')
+    parser.add_argument('--search', choices=['grid', 'halving'], default='grid',
+                        help='full grid or successive halving over n_estimators (default: %(default)s)')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='where fitted folds are cached')
+    parser.add_argument('--results', help='per-candidate results CSV (default: {} or {})'.format(
+        os.path.relpath(RESULTS_PATH, BASE_DIR), os.path.basename(HALVING_RESULTS_PATH)))
+    parser.add_argument('--no-publish', action='store_true', help='do not replace the model artifacts')
+    args = parser.parse_args()
+
+    X_train, X_test, y_train, y_test = load_training_data()
+
+    start_time = time.time()
+    if args.search == 'halving':
+        results, log = run_halving(X_train, y_train, args.jobs, args.cache_dir, args.metric)
+        results_path = args.results or HALVING_RESULTS_PATH
+        fit_time = sum(seconds for _, _, seconds in log)
+    else:
+        results = run_search(X_train, y_train, args.jobs, args.cache_dir)
+        results_path = args.results or RESULTS_PATH
+        fit_time = sum(result['fit_seconds'] for result in results)
+    search_time = time.time() - start_time
+
+    summary = summarize(results)
+    summary.to_csv(results_path, index=False)
+    best = best_candidate(summary, args.metric)
+    params = candidate_params(best)
+    print('Search took {:.1f}s ({:.1f}s of fitting); results -> {}'.format(
+        search_time, fit_time, results_path))
+    print('Best by {}: {} (val recall {:.3f}, val accuracy {:.3f})'.format(
+        args.metric, params, best['mean_val_recall'], best['mean_val_accuracy']))
+
+    # Fitted on plain arrays like the folds; the app scores arrays, not frames
+    pipeline = make_pipeline(params)
+    pipeline.fit(X_train.to_numpy(dtype=float), y_train.to_numpy())
+    y_pred = pipeline.predict(X_test.to_numpy(dtype=float))
+    print('Holdout recall {:.3f}, accuracy {:.3f}'.format(
+        recall_score(y_test, y_pred), accuracy_score(y_test, y_pred)))
+
+    if args.no_publish:
+        return
+
+    # Medians of the training split only, so nothing is learned from the holdout
+    columns = list(X_train.columns)
+    imputer = MedianImputer.fit(X_train, columns)
+    publish(pipeline[-1], columns, imputer)
+    print('Published {} with {} columns'.format(os.path.relpath(MODEL_PATH, BASE_DIR), len(columns)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,498 @@
+"""Fast evaluation of a fitted GradientBoostingClassifier.
+
+All regression trees of the ensemble are flattened into contiguous NumPy
+arrays. Every tree is padded to a perfect binary tree of the ensemble's
+max_depth and stored in heap order, so the children of slot k are 2k+1 and
+2k+2 and no child pointers are needed:
+
+    feature    (n_trees, n_internal)    split feature of each internal slot
+    threshold  (n_trees, n_internal)    split threshold, as float32
+    leaves     (n_trees, n_leaf_codes)  leaf value for each path code
+
+Scoring a tree compares each of its internal slots against one contiguous
+feature column for a whole block of rows, and packs the outcomes into one
+bit per slot. The packed code fixes the path through the tree, so the leaf
+value is a single lookup. For shallow trees (max_depth <= 3, the
+GradientBoostingClassifier default) the lookup goes straight into a table
+with one entry per code. Deeper trees follow the code bits down the heap.
+
+The loops are compiled to native code with numba when it is installed and
+run in parallel over row blocks for large batches. Without numba the same
+arrays are evaluated with NumPy across all trees at once.
+
+The training cover (weighted_n_node_samples) of every slot is kept as well,
+
+    cover      (n_trees, n_slots)       training weight reaching each slot
+
+which is all that exact path-dependent TreeSHAP needs. A row's attributions
+within a tree depend only on its path code, so for shallow trees the
+attributions of every code are tabulated once and explaining a batch is one
+lookup per tree, like scoring it.
+"""
+import itertools
+import math
+import os
+import threading
+
+import numpy as np
+from scipy.special import expit
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None and not any(name in os.environ for name in
+                                 ['NUMBA_THREADING_LAYER', 'NUMBA_THREADING_LAYER_PRIORITY']):
+    # With TBB the process cannot exit once a worker thread (a Streamlit
+    # session, the serve.py batcher) has made the first parallel launch
+    numba.config.THREADING_LAYER_PRIORITY = ['omp', 'workqueue', 'tbb']
+
+# The workqueue layer does not allow concurrent launches, and a parallel
+# launch already uses every core
+_parallel_lock = threading.Lock()
+
+
+# Rows scored per block; bounds the per-block working arrays
+BLOCK_ROWS = 8192
+
+# Path codes are packed into uint32, one bit per internal slot
+MAX_DEPTH = 5
+
+# Up to this depth each tree gets a table with one leaf value per path code
+TABLE_MAX_DEPTH = 3
+
+# Without numba the NumPy evaluator only beats sklearn on very small batches
+NUMPY_MAX_ROWS = 10
+
+# Largest difference from sklearn's predict_proba accepted by check()
+TOLERANCE = 1e-9
+
+
+class CompiledGBM:
+    """Flattened trees of a binary GradientBoostingClassifier."""
+
+    def __init__(self, feature, threshold, leaves, depth, init_score, learning_rate,
+                 n_features, classes, link, cover=None, expected_value=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.leaves = leaves
+        self.depth = int(depth)
+        self.init_score = float(init_score)
+        self.learning_rate = float(learning_rate)
+        self.n_features = int(n_features)
+        self.classes = np.asarray(classes)
+        self.link = link
+        self.use_table = self.depth <= TABLE_MAX_DEPTH
+        # Only needed for explanations; older bundles do not have it
+        self.cover = cover
+        self._expected_value = None if expected_value is None else float(expected_value)
+        self._shap_tables = None
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten the estimators of a fitted GradientBoostingClassifier."""
+        if model.estimators_.shape[1] != 1:
+            raise ValueError('Only binary GradientBoostingClassifier models can be compiled')
+
+        trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+        depth = max(max(tree.max_depth for tree in trees), 1)
+        if depth > MAX_DEPTH:
+            raise ValueError('Trees deeper than {} levels cannot be compiled'.format(MAX_DEPTH))
+
+        n_internal = 2 ** depth - 1
+        feature = np.zeros((len(trees), n_internal), dtype=np.intp)
+        threshold = np.full((len(trees), n_internal), np.inf)
+        heap_value = np.zeros((len(trees), 2 ** (depth + 1) - 1))
+        cover = np.zeros_like(heap_value)
+
+        for t, tree in enumerate(trees):
+            stack = [(0, 0)]
+            while stack:
+                slot, node = stack.pop()
+                cover[t, slot] = tree.weighted_n_node_samples[node]
+                if tree.children_left[node] == -1:
+                    # Padded slots below a shallow leaf always go left and
+                    # every slot underneath carries the leaf value
+                    heap_value[t, _subtree_slots(slot, heap_value.shape[1])] = tree.value[node, 0, 0]
+                    left = 2 * slot + 1
+                    while left < cover.shape[1]:
+                        cover[t, left] = cover[t, slot]
+                        left = 2 * left + 1
+                else:
+                    feature[t, slot] = tree.feature[node]
+                    threshold[t, slot] = tree.threshold[node]
+                    stack.append((2 * slot + 1, tree.children_left[node]))
+                    stack.append((2 * slot + 2, tree.children_right[node]))
+
+        # Fold the learning rate into the leaf values, as sklearn scales each stage
+        heap_value *= model.learning_rate
+
+        if depth <= TABLE_MAX_DEPTH:
+            leaves = heap_value[:, _leaf_slots(np.arange(2 ** n_internal), depth)]
+        else:
+            leaves = heap_value
+
+        link = 'exponential' if model.loss == 'exponential' else 'logistic'
+        return cls(feature, _float32_thresholds(threshold), np.ascontiguousarray(leaves),
+                   depth, _init_score(model, link), model.learning_rate,
+                   model.n_features_in_, model.classes_, link, cover)
+
+    @property
+    def n_trees(self):
+        return len(self.feature)
+
+    # Same names as the sklearn estimator, so either can be used as the model
+    @property
+    def classes_(self):
+        return self.classes
+
+    @property
+    def n_features_in_(self):
+        return self.n_features
+
+    def is_faster(self, n_rows):
+        """Whether this evaluator is expected to beat sklearn on n_rows rows."""
+        return numba is not None or n_rows <= NUMPY_MAX_ROWS
+
+    def _feature_major(self, X):
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError('Expected {} features, got {}'.format(self.n_features, X.shape[1]))
+
+        # Feature-major float32 copy; sklearn also evaluates trees on float32
+        return np.ascontiguousarray(X.T, dtype=np.float32)
+
+    def decision_function(self, X):
+        XT = self._feature_major(X)
+        raw = np.empty(XT.shape[1])
+
+        if numba is not None and len(raw) > BLOCK_ROWS:
+            with _parallel_lock:
+                _score_parallel(XT, self.feature, self.threshold, self.leaves, self.depth,
+                                self.use_table, self.init_score, raw)
+        else:
+            self.decision_function_into(XT, raw)
+        return raw
+
+    def decision_function_into(self, XT, out, start=0, stop=None):
+        """Write the raw scores of columns start:stop of a feature-major float32 XT into out.
+
+        Runs on the calling thread only, for callers that spread the rows
+        over processes themselves (see parallel.py).
+        """
+        stop = XT.shape[1] if stop is None else stop
+        for block in range(start, stop, BLOCK_ROWS):
+            block_stop = min(block + BLOCK_ROWS, stop)
+            if numba is not None:
+                _score_block(XT, self.feature, self.threshold, self.leaves, self.depth,
+                             self.use_table, self.init_score, block, block_stop, out)
+            else:
+                out[block:block_stop] = self._score_numpy(XT[:, block:block_stop])
+
+    def _codes(self, XT):
+        # (n_trees, n_rows) path codes, one bit per internal slot
+        codes = np.zeros((self.n_trees, XT.shape[1]), dtype=np.uint32)
+        for k in range(self.feature.shape[1]):
+            go_right = ~(XT[self.feature[:, k]] <= self.threshold[:, k, None])
+            codes |= go_right.astype(np.uint32) << np.uint32(k)
+        return codes
+
+    def _score_numpy(self, XT):
+        codes = self._codes(XT)
+        if self.use_table:
+            slots = codes
+        else:
+            slots = _leaf_slots(codes, self.depth)
+        values = np.take_along_axis(self.leaves, slots.astype(np.intp), axis=1)
+        return self.init_score + values.sum(axis=0)
+
+    def predict_proba(self, X):
+        return self.raw_to_proba(self.decision_function(X))
+
+    def raw_to_proba(self, raw):
+        """(n_rows, 2) class probabilities from raw scores; raw is overwritten."""
+        if self.link == 'exponential':
+            raw *= 2.0
+        proba = np.empty((len(raw), 2))
+        proba[:, 1] = expit(raw)
+        proba[:, 0] = 1.0 - proba[:, 1]
+        return proba
+
+    def predict(self, X):
+        proba = self.predict_proba(X)
+        return self.classes.take(np.argmax(proba, axis=1))
+
+    @property
+    def expected_value(self):
+        """Raw score averaged over the training rows, as the trees saw them."""
+        if self._expected_value is None:
+            self._require_cover()
+            values = self._heap_leaf_values()
+            paths = _leaf_paths(self.depth)
+            no_codes = np.zeros(0, dtype=np.uint32)
+            self._expected_value = self.init_score + sum(
+                _tree_attributions(self.feature[t], self.threshold[t], self.cover[t], values[t], paths,
+                                   no_codes, self.n_features)[1]
+                for t in range(self.n_trees))
+        return self._expected_value
+
+    def _require_cover(self):
+        if self.cover is None:
+            raise ValueError('The model was compiled without node covers and cannot be explained')
+
+    def _heap_leaf_values(self):
+        # (n_trees, 2 ** depth) value of each bottom slot of the heap, left to right
+        if not self.use_table:
+            return self.leaves[:, 2 ** self.depth - 1:]
+        codes = [sum(1 << int(slot) for slot, right in zip(slots, dirs) if right)
+                 for slots, dirs in _leaf_paths(self.depth)]
+        return self.leaves[:, codes]
+
+    def shap_tables(self):
+        """(n_trees, n_codes, n_features) attributions of every path code of every tree.
+
+        Only built for trees shallow enough to have a table of leaf values.
+        """
+        if self._shap_tables is None:
+            self._require_cover()
+            values = self._heap_leaf_values()
+            paths = _leaf_paths(self.depth)
+            codes = np.arange(self.leaves.shape[1], dtype=np.uint32)
+            tables = np.empty((self.n_trees, len(codes), self.n_features))
+            expected = self.init_score
+            for t in range(self.n_trees):
+                tables[t], tree_expected = _tree_attributions(
+                    self.feature[t], self.threshold[t], self.cover[t], values[t], paths, codes, self.n_features)
+                expected += tree_expected
+            self._expected_value = expected
+            self._shap_tables = tables
+        return self._shap_tables
+
+    def shap_values(self, X):
+        """Exact path-dependent TreeSHAP attributions of decision_function.
+
+        Returns an (n_rows, n_features) array; each row plus expected_value
+        adds up to the raw score of that row.
+        """
+        self._require_cover()
+        XT = self._feature_major(X)
+        out = np.zeros((XT.shape[1], self.n_features))
+        tables = self.shap_tables() if self.use_table else None
+        if not self.use_table:
+            values = self._heap_leaf_values()
+            paths = _leaf_paths(self.depth)
+
+        for start in range(0, XT.shape[1], BLOCK_ROWS):
+            block = out[start:start + BLOCK_ROWS]
+            codes = self._codes(XT[:, start:start + BLOCK_ROWS])
+            for t in range(self.n_trees):
+                if tables is not None:
+                    block += tables[t].take(codes[t], axis=0)
+                else:
+                    # Deep trees have too many codes to tabulate; explain the ones present
+                    unique, inverse = np.unique(codes[t], return_inverse=True)
+                    attributions, _ = _tree_attributions(
+                        self.feature[t], self.threshold[t], self.cover[t], values[t], paths, unique,
+                        self.n_features)
+                    block += attributions[inverse]
+        return out
+
+    def check(self, model, X=None, n_samples=256, random_state=0):
+        """Raise if predict_proba differs from the sklearn model by more than TOLERANCE.
+
+        Without X, rows are sampled around the split thresholds of each feature.
+        With node covers the attributions must also add up to the raw scores.
+        """
+        if X is None:
+            X = self.sample_inputs(n_samples, random_state)
+        diff = np.max(np.abs(self.predict_proba(X) - model.predict_proba(X)))
+        if diff > TOLERANCE:
+            raise ValueError('Compiled trees differ from the model by {:.3g}'.format(diff))
+        if self.cover is not None:
+            gap = np.max(np.abs(self.shap_values(X).sum(axis=1) + self.expected_value
+                                - self.decision_function(X)))
+            if gap > TOLERANCE:
+                raise ValueError('Attributions do not add up to the raw scores (off by {:.3g})'.format(gap))
+        return diff
+
+    def sample_inputs(self, n_samples, random_state=0):
+        rng = np.random.RandomState(random_state)
+        X = np.zeros((n_samples, self.n_features))
+        for j in range(self.n_features):
+            thresholds = self.threshold[(self.feature == j) & np.isfinite(self.threshold)]
+            if len(thresholds):
+                X[:, j] = rng.uniform(thresholds.min() - 1, thresholds.max() + 1, n_samples)
+        return X
+
+
+def compile_model(model):
+    """Return a verified CompiledGBM for the model, or None when it cannot be compiled."""
+    if isinstance(model, CompiledGBM):
+        return model
+    if not hasattr(model, 'estimators_') or not hasattr(model, 'init_'):
+        return None
+    try:
+        engine = CompiledGBM.from_sklearn(model)
+        engine.check(model)
+    except ValueError:
+        return None
+    return engine
+
+
+def _subtree_slots(slot, n_slots):
+    slots = []
+    level = [slot]
+    while level and level[0] < n_slots:
+        slots.extend(level)
+        level = [child for s in level for child in (2 * s + 1, 2 * s + 2)]
+    return slots
+
+
+def _leaf_slots(codes, depth):
+    # Follow the path bits down the heap: bit k set means slot k went right
+    slots = np.zeros_like(codes)
+    for _ in range(depth):
+        slots = 2 * slots + 1 + ((codes >> slots) & 1)
+    return slots
+
+
+def _leaf_paths(depth):
+    """(slots, went_right) from the root to each bottom slot of the heap, left to right."""
+    paths = []
+    for leaf in range(2 ** depth):
+        slots = []
+        dirs = []
+        slot = 0
+        for level in range(depth):
+            right = (leaf >> (depth - 1 - level)) & 1
+            slots.append(slot)
+            dirs.append(right)
+            slot = 2 * slot + 1 + right
+        paths.append((np.array(slots, dtype=np.intp), np.array(dirs, dtype=np.uint32)))
+    return paths
+
+
+def _tree_attributions(feature, threshold, cover, values, paths, codes, n_features):
+    """TreeSHAP attributions of one tree for each path code, and its expected value.
+
+    Per leaf, the path-dependent value function is a product over the split
+    features on the path: the share of the training cover that follows the
+    path for a feature outside the coalition, and whether the row follows
+    it for a feature inside. The Shapley values of such a product have a
+    closed form over the subsets of the path features, of which there are
+    at most 2 ** (depth - 1).
+    """
+    attributions = np.zeros((len(codes), n_features))
+    expected = 0.0
+    for (slots, dirs), value in zip(paths, values):
+        zero = {}
+        one = {}
+        reachable = True
+        for slot, right in zip(slots, dirs):
+            if not np.isfinite(threshold[slot]):
+                # Padding below a shallow leaf; every row goes left
+                if right:
+                    reachable = False
+                    break
+                continue
+            child = 2 * slot + 1 + right
+            j = int(feature[slot])
+            ratio = cover[child] / cover[slot] if cover[slot] > 0 else 0.0
+            follows = ((codes >> np.uint32(slot)) & 1) == right
+            # A feature split on twice counts once, with both conditions
+            zero[j] = zero.get(j, 1.0) * ratio
+            one[j] = one.get(j, True) & follows
+        if not reachable:
+            continue
+
+        path_features = list(zero)
+        m = len(path_features)
+        expected += value * np.prod([zero[j] for j in path_features])
+        for i in path_features:
+            others = [j for j in path_features if j != i]
+            total = np.zeros(len(codes))
+            for size in range(m):
+                weight = math.factorial(size) * math.factorial(m - size - 1) / math.factorial(m)
+                for coalition in itertools.combinations(others, size):
+                    term = np.full(len(codes), weight)
+                    for j in others:
+                        term *= one[j] if j in coalition else zero[j]
+                    total += term
+            attributions[:, i] += value * (one[i] - zero[i]) * total
+    return attributions, expected
+
+
+def _float32_thresholds(threshold):
+    # For a float32 x, x <= t holds exactly when x <= the largest float32 not
+    # above t, so the comparison can be done in float32 without changing a path
+    threshold32 = threshold.astype(np.float32)
+    above = threshold32.astype(np.float64) > threshold
+    threshold32[above] = np.nextafter(threshold32[above], np.float32(-np.inf))
+    return threshold32
+
+
+def _init_score(model, link):
+    # Raw prediction of the initial estimator, as in sklearn's
+    # BinomialDeviance / ExponentialLoss get_init_raw_predictions
+    if model.init_ == 'zero':
+        return 0.0
+
+    if getattr(model.init_, 'strategy', None) != 'prior':
+        raise ValueError('Only the default (prior) init estimator can be compiled')
+
+    proba_pos_class = model.init_.class_prior_[1]
+    eps = np.finfo(np.float32).eps
+    proba_pos_class = np.clip(proba_pos_class, eps, 1 - eps)
+    log_odds = np.log(proba_pos_class / (1 - proba_pos_class))
+    return 0.5 * log_odds if link == 'exponential' else log_odds
+
+
+if numba is not None:
+    @numba.njit(nogil=True, cache=True)
+    def _score_block(XT, feature, threshold, leaves, depth, use_table, init_score, start, stop, out):
+        n_internal = feature.shape[1]
+        n_rows = stop - start
+        codes = np.empty(n_rows, dtype=np.uint32)
+        # Plain loops over block views, which LLVM can vectorize
+        block_out = out[start:stop]
+        block_out[:] = init_score
+
+        for t in range(feature.shape[0]):
+            f = feature[t]
+            th = threshold[t]
+            values = leaves[t]
+
+            x = XT[f[0], start:stop]
+            tk = th[0]
+            for i in range(n_rows):
+                codes[i] = np.uint32(not x[i] <= tk)
+            for k in range(1, n_internal):
+                x = XT[f[k], start:stop]
+                tk = th[k]
+                shift = np.uint32(k)
+                for i in range(n_rows):
+                    codes[i] |= np.uint32(not x[i] <= tk) << shift
+
+            # Trees are added one at a time, in the same order as sklearn
+            if use_table:
+                for i in range(n_rows):
+                    block_out[i] += values[codes[i]]
+            else:
+                for i in range(n_rows):
+                    code = codes[i]
+                    slot = 0
+                    for _ in range(depth):
+                        slot = 2 * slot + 1 + ((code >> slot) & 1)
+                    block_out[i] += values[slot]
+
+    @numba.njit(nogil=True, cache=True, parallel=True)
+    def _score_parallel(XT, feature, threshold, leaves, depth, use_table, init_score, out):
+        n_rows = XT.shape[1]
+        n_blocks = (n_rows + BLOCK_ROWS - 1) // BLOCK_ROWS
+        for b in numba.prange(n_blocks):
+            start = b * BLOCK_ROWS
+            stop = min(start + BLOCK_ROWS, n_rows)
+            _score_block(XT, feature, threshold, leaves, depth, use_table, init_score, start, stop, out)
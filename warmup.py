@@ -0,0 +1,59 @@
+"""Optional background warm-up for the Streamlit app.
+
+The model registry, numba and scipy are only imported when a page needs the
+model. On autoscaled replicas the first prediction can instead be made fast by
+loading everything in a background thread as soon as the server starts:
+
+    ATTRITION_WARMUP=1 streamlit run app.py
+
+The warm-up runs at most once per process, however often app.py is re-run.
+"""
+import threading
+import time
+
+import metrics
+
+WARMUP_ENV = 'ATTRITION_WARMUP'
+
+_lock = threading.Lock()
+_thread = None
+status = {'started': False, 'done': False, 'seconds': None, 'error': None}
+
+
+def warm_up():
+    import numpy as np
+
+    from model_registry import get_model
+    from tree_engine import BLOCK_ROWS
+
+    start = time.perf_counter()
+    try:
+        loaded_model = get_model()
+        # Compile (or load from the numba cache) both the single-block and
+        # the parallel kernels
+        for n_rows in [1, BLOCK_ROWS + 1]:
+            loaded_model.predict_proba(np.zeros((n_rows, len(loaded_model.columns))))
+        # Tabulate the attributions shown with each prediction
+        loaded_model.explain(np.zeros((1, len(loaded_model.columns))))
+    except Exception as exc:
+        # The pages load the model themselves and report the error
+        status['error'] = repr(exc)
+    status['seconds'] = time.perf_counter() - start
+    status['done'] = True
+
+
+def start():
+    """Start the warm-up thread unless it was already started in this process."""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=warm_up, name='model-warmup', daemon=True)
+            status['started'] = True
+            _thread.start()
+    return _thread
+
+
+def start_if_enabled():
+    if metrics.env_flag(WARMUP_ENV):
+        return start()
+    return None
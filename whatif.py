@@ -0,0 +1,84 @@
+"""What-if sweeps for one employee on the prediction page.
+
+Starting from the employee's inputs, the grid below varies the levers HR can
+act on together: every MonthlyIncome on the page in INCOME_STEP steps, with
+and without overtime, for every training bucket. The grid (a few thousand
+counterfactual employees) is encoded and scored in one batched call, which
+costs about as much as a single prediction.
+"""
+import numpy as np
+import pandas as pd
+
+from eda import LEFT_COLOR
+from features import FEATURE_FIELDS, INPUT_RANGES, LABEL_CODES
+
+
+INCOME_STEP = 100
+
+# Probability of leaving above which the model predicts that the employee leaves
+DECISION_THRESHOLD = 0.5
+
+
+def _labels(field):
+    return {code: label for label, code in LABEL_CODES[field].items()}
+
+
+def income_values(step=INCOME_STEP):
+    low, high = INPUT_RANGES['MonthlyIncome']
+    return np.unique(np.append(np.arange(low, high + 1, step), high)).astype(float)
+
+
+def counterfactual_grid(codes, step=INCOME_STEP):
+    """Rows of codes: the employee's codes with income x overtime x training varied."""
+    incomes = income_values(step)
+    overtime = sorted(_labels('OverTime'))
+    training = sorted(_labels('TrainingTimesLastYear'))
+
+    income_grid, overtime_grid, training_grid = np.meshgrid(incomes, overtime, training, indexing='ij')
+    grid = np.tile(np.asarray(codes, dtype=float), (income_grid.size, 1))
+    grid[:, FEATURE_FIELDS.index('MonthlyIncome')] = income_grid.ravel()
+    grid[:, FEATURE_FIELDS.index('OverTime')] = overtime_grid.ravel()
+    grid[:, FEATURE_FIELDS.index('TrainingTimesLastYear')] = training_grid.ravel()
+    return grid
+
+
+def sweep(loaded_model, codes, step=INCOME_STEP):
+    """Probability of leaving over the counterfactual grid, as a long table."""
+    grid = counterfactual_grid(codes, step)
+    proba = loaded_model.predict_proba(loaded_model.encoder.transform(grid))[:, 1]
+
+    overtime = _labels('OverTime')
+    training = _labels('TrainingTimesLastYear')
+    return pd.DataFrame({
+        'Monthly Income': grid[:, FEATURE_FIELDS.index('MonthlyIncome')].astype(int),
+        'Overtime': [overtime[code] for code in grid[:, FEATURE_FIELDS.index('OverTime')]],
+        'Training Last Year': [training[code] for code in grid[:, FEATURE_FIELDS.index('TrainingTimesLastYear')]],
+        'Probability of Leaving': proba,
+    })
+
+
+def lowest_risk(table):
+    """The row of the grid with the lowest probability of leaving."""
+    return table.loc[table['Probability of Leaving'].idxmin()]
+
+
+def sweep_chart(table, current_income=None):
+    """One line per training bucket, one panel per overtime answer."""
+    import altair as alt
+
+    training_order = list(LABEL_CODES['TrainingTimesLastYear'])
+    lines = alt.Chart().mark_line().encode(
+        x=alt.X('Monthly Income:Q', axis=alt.Axis(format=',d')),
+        y=alt.Y('Probability of Leaving:Q', axis=alt.Axis(format='%'), scale=alt.Scale(domain=[0, 1])),
+        color=alt.Color('Training Last Year:N', sort=training_order,
+                        scale=alt.Scale(scheme='blues'), legend=alt.Legend(orient='top')),
+        tooltip=['Monthly Income:Q', 'Overtime:N', 'Training Last Year:N',
+                 alt.Tooltip('Probability of Leaving:Q', format='.1%')],
+    )
+    # Faceted layers must share the data, so the rules are drawn at constants
+    layers = [lines, alt.Chart().mark_rule(color=LEFT_COLOR, strokeDash=[4, 4]).encode(
+        y=alt.datum(DECISION_THRESHOLD))]
+    if current_income is not None:
+        layers.append(alt.Chart().mark_rule(color='gray').encode(x=alt.datum(current_income)))
+    return alt.layer(*layers, data=table).facet(
+        column=alt.Column('Overtime:N', sort=list(LABEL_CODES['OverTime']), title='Overtime'))